@@ -5,14 +5,12 @@ import pandas as pd
 import locale
 from pathlib import Path
 from datetime import datetime
-import duckdb
 import gc
 import numpy as np
 import warnings
 import logging
 import shutil
 import time
-from joblib import Parallel, delayed
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 from sklearn.metrics import mean_absolute_percentage_error
@@ -40,9 +38,14 @@ except NameError:
     caminho_base = Path.cwd()
 
 pasta_input_parquet = caminho_base.parent / '01_INPUT_PIPELINE/01_BD_PARQUET'
-arquivo_input_regras_negocio = caminho_base.parent / '01_INPUT_PIPELINE/02_REGRAS_NEGOCIO/KRONA_REGRAS.xlsm'
-pasta_staging_parquet = caminho_base.parent / '02_STAGING_PARQUET' # Armazena arquivos parquet com tratamentos, aplicações de regras, depara, etc
-pasta_input_painel = caminho_base.parent / '03_INPUT_PAINEL' # Armazena arquivos que serão consumidos no painel de S&OP para os gerentes
+pasta_input_regras = caminho_base.parent / '01_INPUT_PIPELINE/02_REGRAS_NEGOCIO'
+# Planilha de regras da empresa planejada (PLANILHAS_REGRAS_EMPRESA no functions.py)
+arquivo_input_regras_negocio = arquivo_regras_empresa(pasta_input_regras, EMPRESA_PLANO)
+pasta_staging_raiz = caminho_base.parent / '02_STAGING_PARQUET' # Armazena arquivos parquet com tratamentos, aplicações de regras, depara, etc
+pasta_input_painel_raiz = caminho_base.parent / '03_INPUT_PAINEL' # Armazena arquivos que serão consumidos no painel de S&OP para os gerentes
+# Staging e saídas do painel da empresa planejada (EMPRESA=<NOME>/ com MODO_MULTIEMPRESA; a própria pasta sem ele)
+pasta_staging_parquet = pasta_empresa(pasta_staging_raiz, EMPRESA_PLANO)
+pasta_input_painel = pasta_empresa(pasta_input_painel_raiz, EMPRESA_PLANO)
 pasta_painel = caminho_base.parent / '05_PAINEL'
 pasta_validacao_anna = caminho_base.parent / '06_VALIDACAO_ANNA'
 
@@ -62,41 +65,36 @@ pasta_validacao_anna = caminho_base.parent / '06_VALIDACAO_ANNA'
 
 print("✅ Mapeamento de pastas concluído com sucesso!")
 
+# Preflight das entradas: colunas, linhas e datas do Fato_Vendas_Krona (só o rodapé dos parquets) e abas da
+# planilha de regras. Extração incompleta ou desatualizada interrompe aqui, antes da ingestão e do forecast.
+if USAR_PREFLIGHT:
+    preflight_entradas(pasta_input_parquet, arquivo_input_regras_negocio, pasta_staging_raiz)
+
 # %%
 # Carregar dados arquivo KRONA_REGRAS
-caminho_arquivo = arquivo_input_regras_negocio
+# Planilha aberta uma única vez; abas já tratadas (tipos, nulos, duplicidades) conforme REGRAS_NEGOCIO no functions.py,
+# vindas do cache CACHE_REGRAS quando o conteúdo da aba não mudou
+regras_negocio = carregar_regras_negocio(arquivo_input_regras_negocio, pasta_cache_regras(pasta_staging_raiz, EMPRESA_PLANO))
 
 #-----------------------------------------------------------------------#
 #--------------- Carregar produtos eliminar ----------------------------#
 #-----------------------------------------------------------------------#
-guia_excel = 'PRODUTOS_ELIMINAR'
-df_produtos_eliminar = pd.read_excel(caminho_arquivo, sheet_name=guia_excel, engine='calamine', dtype={'COD_PROD': str})
-df_produtos_eliminar['COD_PROD'] = df_produtos_eliminar['COD_PROD'].astype(str)
-df_produtos_eliminar = df_produtos_eliminar.drop_duplicates(subset=['COD_PROD'])
-df_produtos_eliminar = df_produtos_eliminar[df_produtos_eliminar['COD_PROD'].notna()].reset_index(drop=True)
+df_produtos_eliminar = regras_negocio['PRODUTOS_ELIMINAR']
 
 #-----------------------------------------------------------------------#
 #---------------Carregar Regionais Gestor ------------------------------#
 #-----------------------------------------------------------------------#
-guia_excel = 'REGIONAIS_GESTOR'
-df_regionais_gestor = pd.read_excel(caminho_arquivo, sheet_name=guia_excel, engine='calamine')
-df_regionais_gestor = df_regionais_gestor.drop_duplicates(subset=['REGIONAL', 'REGIONAL_GESTOR'])
-df_regionais_gestor = df_regionais_gestor[df_regionais_gestor['REGIONAL'].notna()].reset_index(drop=True)
+df_regionais_gestor = regras_negocio['REGIONAIS_GESTOR']
 
 #-----------------------------------------------------------------------#
 #---------------Carregar Regionais Construtora -------------------------#
 #-----------------------------------------------------------------------#
-guia_excel = 'REGIONAIS_CONSTRUTORA'
-df_regionais_construtora = pd.read_excel(caminho_arquivo, sheet_name=guia_excel, engine='calamine')
-df_regionais_construtora = df_regionais_construtora.drop_duplicates(subset=['REGIONAL BASE', 'REGIONAL ATUALIZADA'])
+df_regionais_construtora = regras_negocio['REGIONAIS_CONSTRUTORA']
 
 #-----------------------------------------------------------------------#
 #---------------Carregar Clientes para planejamento de Demanda----------#
 #-----------------------------------------------------------------------#
-guia_excel = 'CLIENTES_DEMANDA'
-df_clientes_plan_demanda = pd.read_excel(caminho_arquivo, sheet_name=guia_excel, engine='calamine', dtype={'Cod_Grupo_Cliente': str})
-df_clientes_plan_demanda = df_clientes_plan_demanda.drop_duplicates(subset=['Cod_Grupo_Cliente'])
-df_clientes_plan_demanda = df_clientes_plan_demanda[df_clientes_plan_demanda['Cod_Grupo_Cliente'].notna()].reset_index(drop=True)
+df_clientes_plan_demanda = regras_negocio['CLIENTES_DEMANDA']
 
 # Converter a coluna de clientes para set para acelerar o isin
 lista_clientes_plan_demanda = set(df_clientes_plan_demanda['Cod_Grupo_Cliente'])
@@ -109,68 +107,55 @@ produtos_a_eliminar = df_produtos_eliminar[['COD_PROD']].drop_duplicates().reset
 #-----------------------------------------------------------------------#
 #---------------Carregar DIRECIONA_CLIENTES_REGIONAL--------------------#
 #-----------------------------------------------------------------------#
-guia_excel = 'DIRECIONA_CLIENTES_REGIONAL'
-df_direc_cli_regional = pd.read_excel(caminho_arquivo, sheet_name=guia_excel, engine='calamine', dtype={'COD_GRUPO_CLIENTE': str, 'COD_CLIENTE': str})
-df_direc_cli_regional = df_direc_cli_regional[df_direc_cli_regional['COD_CLIENTE'].notna()].reset_index(drop=True)
+df_direc_cli_regional = regras_negocio['DIRECIONA_CLIENTES_REGIONAL']
 
 #-----------------------------------------------------------------------#
 #---------------Carregar PERIODO_PREVISAO-------------------------------#
 #-----------------------------------------------------------------------#
-guia_excel = 'PERIODO_PREVISAO'
-df_periodo_previsao = pd.read_excel(caminho_arquivo, sheet_name=guia_excel, engine='calamine')
-df_periodo_previsao = df_periodo_previsao[df_periodo_previsao['PERIODO_PROJECAO'].notna()].reset_index(drop=True)
-df_periodo_previsao = df_periodo_previsao.drop_duplicates(subset=['PERIODO_PROJECAO'])
+# Sem nulos/duplicados e em ordem crescente de PERIODO_PROJECAO
+df_periodo_previsao = regras_negocio['PERIODO_PREVISAO']
 
-# Classificar o df_periodo_previsao em ordem crescente de PERIODO_PROJECAO
-df_periodo_previsao = df_periodo_previsao.sort_values(by='PERIODO_PROJECAO').reset_index(drop=True)
+# Meses do horizonte como MES_ID (filtros de horizonte comparam inteiros)
+meses_previsao = mes_id(df_periodo_previsao['PERIODO_PROJECAO'])
 
 print("✅ Importação e tratamento de dados do arquivo KRONA_REGRAS, concluídos com sucesso!")
 
-# %%
-# Script para eliminar duplicação de Chv_Cliente no Dim_Clientes_Krona, conforme orientado por Marcos TI, criamos essa rotina para encontrar as duplicações, eliminar e gerar novo Parquet sem duplicações.
-
-# Carregar o Parquet
-df_dim_cli_krona = pd.read_parquet(pasta_input_parquet / "Dim_Clientes_Krona.parquet")
-
-# Eliminar duplciações mantendo a primeira ocorrência
-df_dim_cli_krona = df_dim_cli_krona.drop_duplicates(subset=["Chv_Cliente"], keep='first').reset_index(drop=True)
-
-# Gerar novo Parquet sem duplicações
-df_dim_cli_krona.to_parquet(pasta_input_parquet / "Dim_Clientes_Krona.parquet", index=False)
-
-del df_dim_cli_krona
-gc.collect()
-
 # %%
 # Criando uma DIM_PRODUTOS_KRONA organizada e resumida, para consumir dados de produtos e principalmente peso unitário
 
-# Carregando DIM_PRODUTOS_VENDAS_KRONA, filtrando Nom_Empresa que contenha "Krona" para eliminar produtos de outras empresas que possam estar na base, e selecionando apenas as colunas necessárias para o planejamento de demanda
-dim_produtos = pd.read_parquet(
+# Carregando DIM_PRODUTOS_VENDAS_KRONA uma única vez e selecionando apenas as colunas necessárias para o planejamento de demanda
+dim_produtos_grupo = pd.read_parquet(
     pasta_input_parquet / "Dim_Produtos_Vendas_Krona.parquet",
     columns=["Cod_Produto", "Des_Produto", "Num_Peso", "Cod_Familia", "Des_Familia", "Cod_Linha", "Des_Linha", "Nom_Empresa"]
 )
-dim_produtos = dim_produtos[dim_produtos["Nom_Empresa"].str.contains("Krona")]
 
-# Drop coluna Nom_Empresa, pois já filtramos apenas os produtos da Krona
-dim_produtos = dim_produtos.drop(columns=["Nom_Empresa"])
+# Uma DIM_PRODUTOS por empresa ingerida (só a EMPRESA_PLANO sem MODO_MULTIEMPRESA), no staging da empresa
+for empresa in empresas_ingestao():
+    # Filtrando Nom_Empresa que contenha o nome da empresa para eliminar produtos de outras empresas que possam estar na base
+    dim_produtos = dim_produtos_grupo[dim_produtos_grupo["Nom_Empresa"].str.contains(empresa)]
+
+    # Drop coluna Nom_Empresa, pois já filtramos apenas os produtos da empresa
+    dim_produtos = dim_produtos.drop(columns=["Nom_Empresa"])
 
-cols_str = ["Cod_Produto", "Cod_Familia", "Cod_Linha"]
+    cols_str = ["Cod_Produto", "Cod_Familia", "Cod_Linha"]
 
-dim_produtos[cols_str] = dim_produtos[cols_str].astype("string")
+    dim_produtos[cols_str] = dim_produtos[cols_str].astype("string")
 
-# Eliminar duplicas de Cod_Produto
-dim_produtos = dim_produtos.drop_duplicates(subset=["Cod_Produto"], keep='first').reset_index(drop=True)
+    # Eliminar duplicas de Cod_Produto
+    dim_produtos = dim_produtos.drop_duplicates(subset=["Cod_Produto"], keep='first').reset_index(drop=True)
 
-# Concatenar Cod_Familia com Des_Familia, Cod_Linha com Des_Linha e criar colunas novas para isso, e eliminar as colunas antigas de código e descrição de família e linha
-dim_produtos["FAMILIA"] = dim_produtos["Cod_Familia"] + " - " + dim_produtos["Des_Familia"]
-dim_produtos["LINHA"] = dim_produtos["Cod_Linha"] + " - "+ dim_produtos["Des_Linha"]
-dim_produtos = dim_produtos.drop(columns=["Cod_Familia", "Des_Familia", "Cod_Linha", "Des_Linha"])
+    # Concatenar Cod_Familia com Des_Familia, Cod_Linha com Des_Linha e criar colunas novas para isso, e eliminar as colunas antigas de código e descrição de família e linha
+    dim_produtos["FAMILIA"] = dim_produtos["Cod_Familia"] + " - " + dim_produtos["Des_Familia"]
+    dim_produtos["LINHA"] = dim_produtos["Cod_Linha"] + " - "+ dim_produtos["Des_Linha"]
+    dim_produtos = dim_produtos.drop(columns=["Cod_Familia", "Des_Familia", "Cod_Linha", "Des_Linha"])
 
-# REnomar colunas para manter padrão de nomenclatura
-dim_produtos.rename(columns={"Cod_Produto": "COD_PROD", "Des_Produto": "DESC_PROD", "Num_Peso": "PESO_UNIT"}, inplace=True)
+    # REnomar colunas para manter padrão de nomenclatura
+    dim_produtos.rename(columns={"Cod_Produto": "COD_PROD", "Des_Produto": "DESC_PROD", "Num_Peso": "PESO_UNIT"}, inplace=True)
 
-# Salvar na pasta staging em formato parquet para uso posterior
-dim_produtos.to_parquet(pasta_staging_parquet / "DIM_PRODUTOS_KRONA.parquet", index=False)
+    # Salvar na pasta staging da empresa em formato parquet para uso posterior
+    salvar_dataset_staging(pasta_empresa(pasta_staging_raiz, empresa), "DIM_PRODUTOS_KRONA", dim_produtos)
+
+del dim_produtos_grupo, dim_produtos
 
 # %%
 # # FIXME apagar depois da Anna validar
@@ -436,291 +421,560 @@ dim_produtos.to_parquet(pasta_staging_parquet / "DIM_PRODUTOS_KRONA.parquet", in
 # df.to_excel(excel_output, index=False)
 
 # %%
-empresa = 'Krona'
-vendas = (pasta_input_parquet / "Fato_Vendas_Krona.parquet").as_posix()
+# Empresas e Cod_Empresa de cada uma: EMPRESAS_GRUPO / EMPRESA_PLANO / MODO_MULTIEMPRESA no functions.py
+empresas = empresas_ingestao()
+cod_bloqueios = [80, 90, 95, 99, 60, 81]
+
+vendas_origem = pasta_input_parquet / "Fato_Vendas_Krona.parquet"
+vendas_espelho = pasta_staging_raiz / "FATO_VENDAS_KRONA_ESPELHO"
 produtos = (pasta_input_parquet / "Dim_Produtos_Vendas_Krona.parquet").as_posix()
 clientes  = (pasta_input_parquet / "Dim_Clientes_Krona.parquet").as_posix()
 vendedores = (pasta_input_parquet / "Dim_Vendedores_Krona.parquet").as_posix()
 
-sql = f"""
-WITH
-fato AS (
-  SELECT
-    Cod_Produto,
-    Chv_Cliente,
-    Chv_Vendedor,
-    CASE
-      WHEN EXTRACT(
-        DAY FROM COALESCE(
-          TRY_CAST(Dat_Emissao_Venda AS DATE),
-          CAST(TRY_STRPTIME(TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)), '%Y-%m-%d') AS DATE),
-          CAST(TRY_STRPTIME(TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)), '%d/%m/%Y') AS DATE)
-        )
-      ) >= 21
-      THEN DATE_TRUNC(
-        'month',
-        COALESCE(
-          TRY_CAST(Dat_Emissao_Venda AS DATE),
-          CAST(TRY_STRPTIME(TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)), '%Y-%m-%d') AS DATE),
-          CAST(TRY_STRPTIME(TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)), '%d/%m/%Y') AS DATE)
-        ) + INTERVAL 1 MONTH
-      )
-      ELSE DATE_TRUNC(
-        'month',
-        COALESCE(
-          TRY_CAST(Dat_Emissao_Venda AS DATE),
-          CAST(TRY_STRPTIME(TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)), '%Y-%m-%d') AS DATE),
-          CAST(TRY_STRPTIME(TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)), '%d/%m/%Y') AS DATE)
-        )
-      )
-    END AS PERIODO,
-    TRIM(Nom_Empresa) AS EMPRESA,
-    SUM(TRY_CAST(Qtd_Venda AS DOUBLE)) AS QTD_VENDA,
-    SUM(TRY_CAST(Qtd_Peso_Venda AS DOUBLE)) AS VOL_VENDA
-  FROM parquet_scan('{vendas}')
-  WHERE UPPER(TRIM(Nom_Empresa)) LIKE '%{empresa.strip().upper()}%'
-    AND UPPER(TRIM(Des_Origem))  LIKE '%{empresa.strip().upper()}%'
-    AND Cod_Empresa IN ('01','05','08','0802','10')
-    AND TRY_CAST(NULLIF(TRIM(Cod_Bloqueio), '') AS INTEGER) IN (80,90,95,99,60,81)
-    AND TRY_CAST(Qtd_Venda AS DOUBLE) > 0
-    AND Dat_Emissao_Venda IS NOT NULL
-    AND TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)) <> ''
-    AND COALESCE(
-      TRY_CAST(Dat_Emissao_Venda AS DATE),
-      CAST(TRY_STRPTIME(TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)), '%Y-%m-%d') AS DATE),
-      CAST(TRY_STRPTIME(TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)), '%d/%m/%Y') AS DATE)
-    ) >= DATE '2022-01-01'
-  GROUP BY Cod_Produto, Chv_Cliente, Chv_Vendedor, PERIODO, EMPRESA
-),
-prod AS (
-  SELECT
-    Cod_Produto,
-    TRIM(Des_Produto) AS Des_Produto,
-    Cod_Familia,
-    TRIM(Des_Familia) AS Des_Familia,
-    Cod_Linha,
-    TRIM(Des_Linha) AS Des_Linha,
-    TRIM(Nom_Empresa) AS EMPRESA,
-    TRY_CAST(Num_Peso AS DOUBLE) AS PESO_UNIT
-  FROM parquet_scan('{produtos}')
-  WHERE Des_Linha IS NOT NULL
-    AND TRIM(Des_Linha) <> ''
-    AND Cod_Empresa IN ('01','05','08','0802','10')
-),
-cli AS (
-  SELECT
-    Chv_Cliente,
-    TRIM(Nom_Cliente) AS NOME_CLIENTE,
-    TRIM(Nom_Empresa) AS EMPRESA,
-    Chv_Vendedor_Cliente,
-    TRIM(Des_Segmento) AS SEGMENTO,
-    CASE
-      WHEN TRIM(Cod_Grupo_Cliente) = '' OR Cod_Grupo_Cliente IS NULL
-      THEN TRIM(SPLIT_PART(Chv_Cliente, '|', 2))
-      ELSE TRIM(Cod_Grupo_Cliente)
-    END AS COD_GRUPO_CLIENTE,
-    CASE
-      WHEN TRIM(Des_Grupo_e_Cliente) = '' OR Des_Grupo_e_Cliente IS NULL
-      THEN TRIM(Nom_Cliente)
-      ELSE TRIM(Des_Grupo_e_Cliente)
-    END AS DESC_GRUPO_E_CLIENTE
-  FROM parquet_scan('{clientes}')
-),
-vend AS (
-  SELECT
-    Chv_Vendedor,
-    TRIM(Des_Regiao) AS Des_Regiao
-  FROM parquet_scan('{vendedores}')
-),
-final AS (
-  SELECT
-    f.EMPRESA,
-    TRIM(SPLIT_PART(c.Chv_Cliente, '|', 2)) AS COD_CLIENTE,
-    c.NOME_CLIENTE,
-    c.COD_GRUPO_CLIENTE,
-    c.DESC_GRUPO_E_CLIENTE,
-    c.SEGMENTO,
-    f.Cod_Produto AS COD_PROD,
-    p.Des_Produto AS DESC_PRODUTO,
-    CAST(p.Cod_Familia AS VARCHAR) || ' - ' || p.Des_Familia AS FAMILIA,
-    CAST(p.Cod_Linha   AS VARCHAR) || ' - ' || p.Des_Linha   AS LINHA,
-    v1.Des_Regiao AS REGIAO_CLIENTE,
-    v2.Des_Regiao AS REGIAO_MOVIMENTO,
-    f.PERIODO,
-    f.QTD_VENDA,
-    f.VOL_VENDA,
-    f.VOL_VENDA / f.QTD_VENDA AS PESO_UNIT
-  FROM fato f
-  LEFT JOIN prod p ON f.Cod_Produto = p.Cod_Produto AND f.EMPRESA = p.EMPRESA
-  LEFT JOIN cli  c ON f.Chv_Cliente = c.Chv_Cliente AND f.EMPRESA = c.EMPRESA
-  LEFT JOIN vend v1 ON c.Chv_Vendedor_Cliente = v1.Chv_Vendedor
-  LEFT JOIN vend v2 ON f.Chv_Vendedor         = v2.Chv_Vendedor
-)
-SELECT
-  UPPER(EMPRESA) AS EMPRESA,
-  COD_CLIENTE,
-  NOME_CLIENTE,
-  COD_GRUPO_CLIENTE,
-  DESC_GRUPO_E_CLIENTE,
-  SEGMENTO,
-  COD_PROD,
-  DESC_PRODUTO,
-  FAMILIA,
-  LINHA,
-  PESO_UNIT,
-  REGIAO_CLIENTE,
-  REGIAO_MOVIMENTO,
-  PERIODO,
-  QTD_VENDA,
-  VOL_VENDA
-FROM final
-"""
-df_vendas_krona_silver = duckdb.query(sql).to_df()
-
-# Salvar em parquet
-df_vendas_krona_silver.to_parquet(pasta_staging_parquet / "df_vendas_krona_silver.parquet", index=False)
-
-del df_vendas_krona_silver
-gc.collect()
+# Perfil JSON de cada comando DuckDB desta etapa (PERFILAR_SQL_DUCKDB no functions.py)
+iniciar_perfil_sql(pasta_staging_raiz, "ingestao_vendas")
 
-print("✅ Carregamento de df_vendas_krona_silver concluído com sucesso!")
+# Espelho tipado e pré-filtrado do fato de vendas (datas, quantidades e PERIODO data cota já convertidos)
+# Uma única leitura do Fato_Vendas_Krona.parquet para todas as empresas, uma partição por empresa
+# Só é regerado quando o Fato_Vendas_Krona.parquet ou os filtros mudam
+atualizar_espelho_fato_vendas(vendas_origem, vendas_espelho, empresas, cod_bloqueios)
 
-# %%
 # ============================================================
-# 1. Criando coluna REGIONAL copiando a coluna REGIAO_CLIENTE 
-#    no df_vendas_krona. 
-#    Onde o segmento contém CONSTRUTORA ou INSTALADOR, buscar 
-#    na tabela de regionais_construtora a regional atualizada.
+# CARGA INCREMENTAL (marca d'água por PERIODO)
+# Guarda o último PERIODO fechado e a assinatura de cada mês da origem.
+# Na próxima execução só os meses abertos ou alterados passam pelo SQL
+# silver/gold, e o resultado é emendado no histórico gold existente.
+# Mudança em clientes, vendedores ou abas de regional reprocessa só os
+# clientes afetados (snapshots versionados); a de produtos força recarga completa.
 # ============================================================
+MODO_INCREMENTAL = True           # True = reprocessa só meses abertos/alterados | False = recarga completa sempre
+FORCAR_RECARGA_COMPLETA = False   # True = ignora a marca d'água nesta execução e reprocessa todo o histórico
+
+
+def regras_ingestao_empresa(regras):
+    """Abas da planilha de regras de uma empresa usadas na ingestão, já no formato das relações do SQL."""
+    return {
+        "map_reg": regras['REGIONAIS_CONSTRUTORA'][['REGIONAL BASE', 'REGIONAL ATUALIZADA']],
+        "direc_cli_regional": regras['DIRECIONA_CLIENTES_REGIONAL'][['COD_CLIENTE', 'REGIONAL']],
+        "reg_gestor": regras['REGIONAIS_GESTOR'][['REGIONAL', 'REGIONAL_GESTOR']],
+        "produtos_eliminar": regras['PRODUTOS_ELIMINAR'][['COD_PROD']].drop_duplicates().reset_index(drop=True),
+    }
+
+
+def ingerir_vendas_empresa(cod_empresas, vendas, pasta_staging, regras_ingestao):
+    """
+    Silver/gold de vendas de uma empresa a partir da partição dela no espelho do fato:
+    carga incremental, resolução de regional, df_vendas_krona_gold e df_vendas_krona
+    (sem os produtos a eliminar), gravados no staging da empresa.
+    regras_ingestao: regras da própria empresa (regras_ingestao_empresa).
+    """
+    vendas = Path(vendas).as_posix()
+    arquivo_controle_ingestao = pasta_staging / "CONTROLE_INGESTAO_VENDAS.json"
+    arquivo_vendas_gold = pasta_staging / "df_vendas_krona_gold.parquet"
+    filtro_fato = "QTD_VENDA > 0 AND DATA_EMISSAO >= DATE '2022-01-01'"
+
+    ultimo_fechado = ultimo_periodo_fechado_data_cota()
+    fingerprints_vendas = fingerprint_periodos_vendas(vendas, filtro_fato)
+    # Clientes, vendedores e abas de regional não forçam mais a recarga completa: entram pelos snapshots
+    # versionados abaixo (reatribuição incremental). Só a dimensão de produtos ainda refaz o histórico inteiro
+    dependencias_vendas = {
+        "produtos": fingerprint_arquivo(produtos, conteudo=True),
+    }
+
+    controle_anterior = None
+    if MODO_INCREMENTAL and arquivo_vendas_gold.exists():
+        controle_anterior = ler_json(arquivo_controle_ingestao)
 
-# Carregar o df_vendas_krona_silver do parquet
-df_vendas_krona_gold = pd.read_parquet(pasta_staging_parquet / "df_vendas_krona_silver.parquet")
-
-# Cria a tabela de de-para das regionais (já registrada no engine)
-duckdb.register("vendas", df_vendas_krona_gold)
-duckdb.register("map_reg", df_regionais_construtora[['REGIONAL BASE','REGIONAL ATUALIZADA']])
-duckdb.register("direc_cli_regional", df_direc_cli_regional[['COD_CLIENTE', 'REGIONAL']])
-
-sql = """
-WITH base AS (
-  SELECT
-    v.*,
-    -- Substitui valores vazios de REGIAO_CLIENTE por REGIAO_MOVIMENTO
-    COALESCE(NULLIF(v.REGIAO_CLIENTE,''), v.REGIAO_MOVIMENTO) AS RC_FIX,
-    UPPER(v.SEGMENTO) AS SEG_UP,
-    UPPER(v.REGIAO_CLIENTE) AS RC,
-    UPPER(v.REGIAO_MOVIMENTO) AS RM
-  FROM vendas v
-),
-
-ajuste AS (
-  SELECT
-    b.*,
-    CASE
-      -- >>> ADICIONADO: override por cliente (se existir na df_direc_cli_regional)
-      WHEN d.REGIONAL IS NOT NULL AND d.REGIONAL <> '' THEN d.REGIONAL
-      
-      -- 1) Se SEGMENTO contém CONSTRUTORA ou INSTALADOR => usa de-para
-      WHEN b.SEG_UP LIKE '%CONSTRUTORA%' OR b.SEG_UP LIKE '%INSTALADOR%'
-        THEN COALESCE(m."REGIONAL ATUALIZADA", b.RC_FIX)
-      -- ============================================================
-      -- 2. Converter TELEVENDAS - Regras para definir REGIONAL:
-      --    REGIONAL = CONSTRUTORA => REGIONAL_CONSTRUTORA
-      --    REGIAO_CLIENTE = TELEVENDAS e REGIAO_MOVIMENTO = TELEVENDAS => TELEVENDAS
-      --    REGIAO_CLIENTE != TELEVENDAS e REGIAO_MOVIMENTO = TELEVENDAS => TELEVENDAS
-      --    REGIAO_CLIENTE = TELEVENDAS e REGIAO_MOVIMENTO != TELEVENDAS => REGIAO_MOVIMENTO
-      --    Caso contrário => REGIAO_CLIENTE
-      -- ============================================================
-      WHEN b.RC='TELEVENDAS' AND b.RM='TELEVENDAS' THEN 'TELEVENDAS'
-      WHEN b.RC<>'TELEVENDAS' AND b.RM='TELEVENDAS' THEN 'TELEVENDAS'
-      WHEN b.RC='TELEVENDAS' AND b.RM<>'TELEVENDAS' THEN b.RM
-      ELSE b.RC_FIX
-    END AS REGIONAL
-  FROM base b
-  LEFT JOIN map_reg m
-    ON m."REGIONAL BASE" = b.REGIAO_CLIENTE
-  -- >>> ADICIONADO: join com regional direcionada por clientez
-  LEFT JOIN direc_cli_regional d
-    ON d.COD_CLIENTE = b.COD_CLIENTE
-)
+    # ============================================================
+    # PIPELINE ÚNICO NO DUCKDB: FATO EM CHAVES -> GOLD -> ELIMINAÇÃO DE PRODUTOS
+    # As tabelas de regras ficam registradas como relações e todo o
+    # tratamento (regional já resolvida, regional gestor e produtos a
+    # eliminar) roda no mesmo plano, gravando direto em parquet com COPY ... TO,
+    # sem passar o histórico pelo pandas.
+    # ============================================================
+    con = conectar_duckdb()
+
+    # Regras da empresa registradas como relações (map_reg, direc_cli_regional, reg_gestor, produtos_eliminar)
+    for nome_regra, df_regra in regras_ingestao.items():
+        con.register(nome_regra, df_regra)
+
+    # Dimensões tratadas, usadas pelo SQL do lote e pela resolução de regional
+    ctes_dimensoes = f"""
+    prod AS (
+      SELECT
+        Cod_Produto,
+        TRIM(Des_Produto) AS Des_Produto,
+        Cod_Familia,
+        TRIM(Des_Familia) AS Des_Familia,
+        Cod_Linha,
+        TRIM(Des_Linha) AS Des_Linha,
+        TRIM(Nom_Empresa) AS EMPRESA,
+        TRY_CAST(Num_Peso AS DOUBLE) AS PESO_UNIT
+      FROM parquet_scan('{produtos}')
+      WHERE Des_Linha IS NOT NULL
+        AND TRIM(Des_Linha) <> ''
+        AND Cod_Empresa IN ({sql_lista(cod_empresas)})
+    ),
+    cli AS (
+      SELECT
+        Chv_Cliente,
+        TRIM(Nom_Cliente) AS NOME_CLIENTE,
+        TRIM(Nom_Empresa) AS EMPRESA,
+        Chv_Vendedor_Cliente,
+        TRIM(Des_Segmento) AS SEGMENTO,
+        CASE
+          WHEN TRIM(Cod_Grupo_Cliente) = '' OR Cod_Grupo_Cliente IS NULL
+          THEN TRIM(SPLIT_PART(Chv_Cliente, '|', 2))
+          ELSE TRIM(Cod_Grupo_Cliente)
+        END AS COD_GRUPO_CLIENTE,
+        CASE
+          WHEN TRIM(Des_Grupo_e_Cliente) = '' OR Des_Grupo_e_Cliente IS NULL
+          THEN TRIM(Nom_Cliente)
+          ELSE TRIM(Des_Grupo_e_Cliente)
+        END AS DESC_GRUPO_E_CLIENTE
+      FROM parquet_scan('{clientes}', file_row_number = true)
+      -- Chv_Cliente duplicada no Dim_Clientes_Krona (orientação do Marcos TI): mantém a primeira ocorrência do arquivo,
+      -- sem regravar o parquet de origem; a dimensão entra na assinatura da carga incremental
+      QUALIFY ROW_NUMBER() OVER (PARTITION BY Chv_Cliente ORDER BY file_row_number) = 1
+    ),
+    vend AS (
+      SELECT
+        Chv_Vendedor,
+        TRIM(Des_Regiao) AS Des_Regiao
+      FROM parquet_scan('{vendedores}')
+    )
+    """
 
--- ============================================================
--- Resultado final consolidado
--- ============================================================
-SELECT
-  EMPRESA,
-  COD_CLIENTE,
-  NOME_CLIENTE,
-  COD_GRUPO_CLIENTE,
-  DESC_GRUPO_E_CLIENTE,
-  COD_PROD,
-  DESC_PRODUTO,
-  FAMILIA,
-  LINHA,
-  REGIONAL,
-  REGIAO_CLIENTE,   -- ADICIONADO
-  REGIAO_MOVIMENTO, -- ADICIONADO
-  PERIODO,
-  SUM(QTD_VENDA) AS QTD_VENDA,
-  SUM(VOL_VENDA) AS VOL_VENDA
-FROM ajuste
--- WHERE REGIONAL IS NOT NULL AND REGIONAL <> ''
-GROUP BY
-  EMPRESA,
-  COD_CLIENTE,
-  NOME_CLIENTE,
-  COD_GRUPO_CLIENTE,
-  DESC_GRUPO_E_CLIENTE,
-  COD_PROD,
-  DESC_PRODUTO,
-  FAMILIA,
-  LINHA,
-  REGIAO_MOVIMENTO, -- ADICIONADO
-  REGIAO_CLIENTE,   -- ADICIONADO
-  REGIONAL,
-  PERIODO
-"""
-
-# Executa no DuckDB
-df_vendas_krona_gold= duckdb.query(sql).to_df()
-
-# Inserir REGIONAL_GESTOR no df_vendas_krona
-df_vendas_krona_gold = pd.merge(
-    df_vendas_krona_gold,
-    df_regionais_gestor,
-    left_on='REGIONAL',
-    right_on='REGIONAL',
-    how='left'
-)
+    # ============================================================
+    # SNAPSHOTS VERSIONADOS (SNAPSHOTS_DIMENSOES no staging da empresa)
+    # Clientes e vendedores tratados e as abas que decidem a REGIONAL ganham
+    # uma versão nova só quando mudam. O controle da ingestão guarda as
+    # versões refletidas no gold; na carga incremental a diferença entre as
+    # versões diz quais chaves mudaram (novas, alteradas ou removidas).
+    # ============================================================
+    pasta_snapshots = pasta_staging / PASTA_SNAPSHOTS_DIMENSOES
+    snapshots_regional = {
+        "CLIENTES": (f"WITH {ctes_dimensoes} SELECT * FROM cli", "Chv_Cliente"),
+        "VENDEDORES": (f"WITH {ctes_dimensoes} SELECT * FROM vend", "Chv_Vendedor"),
+        "REGIONAIS_CONSTRUTORA": ("SELECT * FROM map_reg", "REGIONAL BASE"),
+        "DIRECIONA_CLIENTES_REGIONAL": ("SELECT * FROM direc_cli_regional", "COD_CLIENTE"),
+        "REGIONAIS_GESTOR": ("SELECT * FROM reg_gestor", "REGIONAL"),
+    }
+    versoes_snapshot = {
+        nome: atualizar_snapshot_dimensao(con, pasta_snapshots, nome, sql_snapshot)
+        for nome, (sql_snapshot, _) in snapshots_regional.items()
+    }
+
+    # Versões do gold que não estão mais em disco (ou gold anterior aos snapshots): sem base de comparação, recarga completa
+    versoes_gold = (controle_anterior or {}).get("snapshots", {})
+    snapshots_indisponiveis = any(
+        nome not in versoes_gold or not caminho_snapshot_dimensao(pasta_snapshots, nome, versoes_gold[nome]).exists()
+        for nome in snapshots_regional
+    )
 
-colunas_ordenadas = [
-    "EMPRESA",
-    "COD_CLIENTE",
-    "NOME_CLIENTE",
-    "COD_GRUPO_CLIENTE",
-    "DESC_GRUPO_E_CLIENTE",
-    "COD_PROD",
-    "DESC_PRODUTO",
-    "FAMILIA",
-    "LINHA",
-    "REGIONAL",
-    "REGIAO_CLIENTE",   # ADICIONADO
-    "REGIAO_MOVIMENTO", # ADICIONADO
-    "REGIONAL_GESTOR",
-    "PERIODO",
-    "QTD_VENDA",
-    "VOL_VENDA"
-]
+    plano_carga = planejar_carga_incremental(
+        controle_anterior, fingerprints_vendas, dependencias_vendas, ultimo_fechado,
+        forcar=FORCAR_RECARGA_COMPLETA or snapshots_indisponiveis
+    )
+    carga_completa = plano_carga["modo"] == "COMPLETA"
+    periodos_carga = plano_carga["periodos"]
+    periodos_remover = plano_carga["remover"]
 
-df_vendas_krona_gold = df_vendas_krona_gold[colunas_ordenadas]
+    # ============================================================
+    # REATRIBUIÇÃO INCREMENTAL DE REGIONAL
+    # Um cliente (COD_CLIENTE do gold; NULL = vendas sem cliente na
+    # dimensão) é reprocessado em todos os meses quando alguma venda dele
+    # depende de uma chave alterada: o próprio Chv_Cliente, o vendedor da
+    # venda ou da carteira, a regional direcionada do COD_CLIENTE, o de-para
+    # construtora da REGIAO_CLIENTE ou o REGIONAL_GESTOR da REGIONAL atual.
+    # As linhas desses clientes são trocadas no gold; o resto fica intacto.
+    # ============================================================
+    reatribuir_clientes = False
+    if not carga_completa:
+        alteracoes = {
+            nome: comparar_snapshots_dimensao(
+                con, pasta_snapshots, nome, chave, versoes_gold[nome], versoes_snapshot[nome], f"alteradas_{nome.lower()}"
+            )
+            for nome, (_, chave) in snapshots_regional.items()
+        }
+        reatribuir_clientes = any(alteracoes.values())
+
+    if reatribuir_clientes:
+        cli_gold = caminho_snapshot_dimensao(pasta_snapshots, "CLIENTES", versoes_gold["CLIENTES"]).as_posix()
+        con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE clientes_unidade AS
+        WITH
+        {ctes_dimensoes},
+        cli_gold AS (
+          SELECT Chv_Cliente, EMPRESA FROM parquet_scan('{cli_gold}')
+        ),
+        pares AS (
+          SELECT DISTINCT Chv_Cliente, Chv_Vendedor, EMPRESA
+          FROM parquet_scan('{vendas}')
+          WHERE {filtro_fato}
+        )
+        SELECT
+          f.Chv_Cliente,
+          f.EMPRESA,
+          -- COD_CLIENTE que a venda recebe no gold com a dimensão atual e com a refletida no gold
+          CASE WHEN c.Chv_Cliente IS NOT NULL THEN TRIM(SPLIT_PART(f.Chv_Cliente, '|', 2)) END AS COD_CLIENTE,
+          CASE WHEN a.Chv_Cliente IS NOT NULL THEN TRIM(SPLIT_PART(f.Chv_Cliente, '|', 2)) END AS COD_CLIENTE_GOLD,
+          COALESCE(
+            f.Chv_Cliente IN (SELECT CHAVE FROM alteradas_clientes)
+            OR f.Chv_Vendedor IN (SELECT CHAVE FROM alteradas_vendedores)
+            OR c.Chv_Vendedor_Cliente IN (SELECT CHAVE FROM alteradas_vendedores)
+            OR (c.Chv_Cliente IS NOT NULL
+                AND TRIM(SPLIT_PART(f.Chv_Cliente, '|', 2)) IN (SELECT CHAVE FROM alteradas_direciona_clientes_regional))
+            OR v1.Des_Regiao IN (SELECT CHAVE FROM alteradas_regionais_construtora),
+            FALSE
+          ) AS ALTERADO
+        FROM pares f
+        LEFT JOIN cli      c  ON f.Chv_Cliente = c.Chv_Cliente AND f.EMPRESA = c.EMPRESA
+        LEFT JOIN cli_gold a  ON f.Chv_Cliente = a.Chv_Cliente AND f.EMPRESA = a.EMPRESA
+        LEFT JOIN vend     v1 ON c.Chv_Vendedor_Cliente = v1.Chv_Vendedor
+        """)
+        con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE clientes_gold_reprocessar AS
+        SELECT COD_CLIENTE AS COD_CLIENTE_REPROCESSAR FROM clientes_unidade WHERE ALTERADO
+        UNION
+        SELECT COD_CLIENTE_GOLD FROM clientes_unidade WHERE ALTERADO
+        UNION
+        SELECT COD_CLIENTE FROM parquet_scan('{arquivo_vendas_gold.as_posix()}')
+        WHERE REGIONAL IN (SELECT CHAVE FROM alteradas_regionais_gestor)
+        """)
+        con.execute("""
+        CREATE OR REPLACE TEMP TABLE clientes_reprocessar AS
+        SELECT DISTINCT u.Chv_Cliente, u.EMPRESA
+        FROM clientes_unidade u
+        SEMI JOIN clientes_gold_reprocessar r ON u.COD_CLIENTE IS NOT DISTINCT FROM r.COD_CLIENTE_REPROCESSAR
+        """)
+        qtd_clientes = con.execute("SELECT COUNT(*) FROM clientes_gold_reprocessar").fetchone()[0]
+        print(
+            f"🔁 Reatribuição de regional | Clientes reprocessados: {qtd_clientes:,} | Chaves alteradas: "
+            + " | ".join(f"{nome}: {qtd}" for nome, qtd in alteracoes.items() if qtd)
+        )
 
-# Salvar df_vendas_krona_gold em Parquet para salvar as alterações, filtros e regras aplicadas no histórico, otimizando memória e garantindo rastreabilidade
-df_vendas_krona_gold.to_parquet(pasta_staging_parquet / "df_vendas_krona_gold.parquet", index=False)
+    if carga_completa:
+        filtro_periodos = ""
+    else:
+        filtro_periodos = "AND (PERIODO IN (" + (",".join(f"DATE '{p}'" for p in periodos_carga) or "NULL") + ")"
+        if reatribuir_clientes:
+            filtro_periodos += (
+                " OR struct_pack(Chv_Cliente, EMPRESA) IN"
+                " (SELECT struct_pack(Chv_Cliente, EMPRESA) FROM clientes_reprocessar)"
+            )
+        filtro_periodos += ")"
 
-del df_vendas_krona_gold
-gc.collect()
+    print(
+        f"🧭 Carga de vendas {plano_carga['modo']} | Último mês fechado: {ultimo_fechado.date()} | "
+        f"Meses a processar: {len(periodos_carga)} de {len(fingerprints_vendas)}"
+        + (f" ({', '.join(periodos_carga)})" if not carga_completa and periodos_carga else "")
+    )
+
+    # ============================================================
+    # RESOLUÇÃO DE REGIONAL POR COMBINAÇÃO
+    # A cascata de regras (regional direcionada, de-para construtora,
+    # televendas) só depende de COD_CLIENTE, SEGMENTO, REGIAO_CLIENTE e
+    # REGIAO_MOVIMENTO. Ela é avaliada uma vez por combinação distinta e
+    # guardada em LOOKUP_REGIONAL.parquet; o fato recebe a REGIONAL com
+    # um único JOIN. A tabela é refeita só quando as abas de regras ou as
+    # dimensões mudam; combinações novas são resolvidas e acrescentadas.
+    # ============================================================
+    chaves_regional = ["COD_CLIENTE", "SEGMENTO", "REGIAO_CLIENTE", "REGIAO_MOVIMENTO"]
+
+    sql_tuplas_regional = f"""
+    WITH
+    {ctes_dimensoes}
+    SELECT DISTINCT
+      TRIM(SPLIT_PART(c.Chv_Cliente, '|', 2)) AS COD_CLIENTE,
+      c.SEGMENTO,
+      v1.Des_Regiao AS REGIAO_CLIENTE,
+      v2.Des_Regiao AS REGIAO_MOVIMENTO
+    FROM (
+      SELECT DISTINCT Chv_Cliente, Chv_Vendedor, EMPRESA
+      FROM parquet_scan('{vendas}')
+      WHERE {filtro_fato}
+        {filtro_periodos}
+    ) f
+    LEFT JOIN cli  c ON f.Chv_Cliente = c.Chv_Cliente AND f.EMPRESA = c.EMPRESA
+    LEFT JOIN vend v1 ON c.Chv_Vendedor_Cliente = v1.Chv_Vendedor
+    LEFT JOIN vend v2 ON f.Chv_Vendedor         = v2.Chv_Vendedor
+    """
+
+    sql_resolucao_regional = """
+    WITH
+    -- ============================================================
+    -- 1. Criando coluna REGIONAL copiando a coluna REGIAO_CLIENTE.
+    --    Onde o segmento contém CONSTRUTORA ou INSTALADOR, buscar
+    --    na tabela de regionais_construtora a regional atualizada.
+    -- ============================================================
+    base AS (
+      SELECT
+        v.*,
+        -- Substitui valores vazios de REGIAO_CLIENTE por REGIAO_MOVIMENTO
+        COALESCE(NULLIF(v.REGIAO_CLIENTE,''), v.REGIAO_MOVIMENTO) AS RC_FIX,
+        UPPER(v.SEGMENTO) AS SEG_UP,
+        UPPER(v.REGIAO_CLIENTE) AS RC,
+        UPPER(v.REGIAO_MOVIMENTO) AS RM
+      FROM tuplas_novas v
+    ),
+
+    ajuste AS (
+      SELECT
+        b.COD_CLIENTE,
+        b.SEGMENTO,
+        b.REGIAO_CLIENTE,
+        b.REGIAO_MOVIMENTO,
+        CASE
+          -- >>> ADICIONADO: override por cliente (se existir na df_direc_cli_regional)
+          WHEN d.REGIONAL IS NOT NULL AND d.REGIONAL <> '' THEN d.REGIONAL
+
+          -- 1) Se SEGMENTO contém CONSTRUTORA ou INSTALADOR => usa de-para
+          WHEN b.SEG_UP LIKE '%CONSTRUTORA%' OR b.SEG_UP LIKE '%INSTALADOR%'
+            THEN COALESCE(m."REGIONAL ATUALIZADA", b.RC_FIX)
+          -- ============================================================
+          -- 2. Converter TELEVENDAS - Regras para definir REGIONAL:
+          --    REGIONAL = CONSTRUTORA => REGIONAL_CONSTRUTORA
+          --    REGIAO_CLIENTE = TELEVENDAS e REGIAO_MOVIMENTO = TELEVENDAS => TELEVENDAS
+          --    REGIAO_CLIENTE != TELEVENDAS e REGIAO_MOVIMENTO = TELEVENDAS => TELEVENDAS
+          --    REGIAO_CLIENTE = TELEVENDAS e REGIAO_MOVIMENTO != TELEVENDAS => REGIAO_MOVIMENTO
+          --    Caso contrário => REGIAO_CLIENTE
+          -- ============================================================
+          WHEN b.RC='TELEVENDAS' AND b.RM='TELEVENDAS' THEN 'TELEVENDAS'
+          WHEN b.RC<>'TELEVENDAS' AND b.RM='TELEVENDAS' THEN 'TELEVENDAS'
+          WHEN b.RC='TELEVENDAS' AND b.RM<>'TELEVENDAS' THEN b.RM
+          ELSE b.RC_FIX
+        END AS REGIONAL
+      FROM base b
+      LEFT JOIN map_reg m
+        ON m."REGIONAL BASE" = b.REGIAO_CLIENTE
+      -- >>> ADICIONADO: join com regional direcionada por cliente
+      LEFT JOIN direc_cli_regional d
+        ON d.COD_CLIENTE = b.COD_CLIENTE
+    )
+    SELECT * FROM ajuste
+    """
+
+    # Versões dos snapshots usados pela cascata (o REGIONAL_GESTOR entra depois, no JOIN do gold)
+    assinatura_regional = {
+        nome: versoes_snapshot[nome]
+        for nome in ["CLIENTES", "VENDEDORES", "REGIONAIS_CONSTRUTORA", "DIRECIONA_CLIENTES_REGIONAL"]
+    }
+
+    if carga_completa or periodos_carga or reatribuir_clientes:
+        atualizar_tabela_resolucao(
+            con,
+            pasta_staging / "LOOKUP_REGIONAL.parquet",
+            chaves_regional,
+            sql_tuplas_regional,
+            sql_resolucao_regional,
+            assinatura_regional,
+            "regional_resolvida",
+        )
 
-print("✅ Organização de Regionais e Inserção de Regional Gestor na df_vendas_krona_gold concluídos com sucesso!")
+    sql = f"""
+    WITH
+    fato AS (
+      SELECT
+        Cod_Produto,
+        Chv_Cliente,
+        Chv_Vendedor,
+        PERIODO,
+        EMPRESA,
+        SUM(QTD_VENDA) AS QTD_VENDA,
+        SUM(VOL_VENDA) AS VOL_VENDA
+      FROM parquet_scan('{vendas}')
+      WHERE {filtro_fato}
+        {filtro_periodos}
+      GROUP BY Cod_Produto, Chv_Cliente, Chv_Vendedor, PERIODO, EMPRESA
+    ),
+    {ctes_dimensoes},
+
+    -- ============================================================
+    -- Fato agregado só em chaves compactas: produto, cliente, regiões,
+    -- REGIONAL já resolvida e PERIODO. Das dimensões entram aqui só as
+    -- colunas que decidem a regional; os textos descritivos ficam para
+    -- o resultado já agregado (gold).
+    -- ============================================================
+    chaves AS (
+      SELECT
+        f.EMPRESA,
+        f.Chv_Cliente,
+        f.Cod_Produto,
+        v1.Des_Regiao AS REGIAO_CLIENTE,
+        v2.Des_Regiao AS REGIAO_MOVIMENTO,
+        l.REGIONAL,
+        f.PERIODO,
+        SUM(f.QTD_VENDA) AS QTD_VENDA,
+        SUM(f.VOL_VENDA) AS VOL_VENDA
+      FROM fato f
+      LEFT JOIN cli  c ON f.Chv_Cliente = c.Chv_Cliente AND f.EMPRESA = c.EMPRESA
+      LEFT JOIN vend v1 ON c.Chv_Vendedor_Cliente = v1.Chv_Vendedor
+      LEFT JOIN vend v2 ON f.Chv_Vendedor         = v2.Chv_Vendedor
+      -- REGIONAL vinda da tabela de resolução (um único JOIN pela combinação)
+      LEFT JOIN regional_resolvida l
+        ON  TRIM(SPLIT_PART(c.Chv_Cliente, '|', 2)) IS NOT DISTINCT FROM l.COD_CLIENTE
+        AND c.SEGMENTO      IS NOT DISTINCT FROM l.SEGMENTO
+        AND v1.Des_Regiao   IS NOT DISTINCT FROM l.REGIAO_CLIENTE
+        AND v2.Des_Regiao   IS NOT DISTINCT FROM l.REGIAO_MOVIMENTO
+      GROUP BY
+        f.EMPRESA,
+        f.Chv_Cliente,
+        f.Cod_Produto,
+        v1.Des_Regiao,
+        v2.Des_Regiao,
+        l.REGIONAL,
+        f.PERIODO
+    ),
+
+    -- ============================================================
+    -- Atributos descritivos (cliente, produto, família, linha) sobre o
+    -- resultado agregado. O GROUP BY consolida chaves que caem no mesmo
+    -- texto (ex.: mesmo COD_CLIENTE em chaves diferentes).
+    -- ============================================================
+    gold AS (
+      SELECT
+        UPPER(k.EMPRESA) AS EMPRESA,
+        TRIM(SPLIT_PART(c.Chv_Cliente, '|', 2)) AS COD_CLIENTE,
+        c.NOME_CLIENTE,
+        c.COD_GRUPO_CLIENTE,
+        c.DESC_GRUPO_E_CLIENTE,
+        k.Cod_Produto AS COD_PROD,
+        p.Des_Produto AS DESC_PRODUTO,
+        CAST(p.Cod_Familia AS VARCHAR) || ' - ' || p.Des_Familia AS FAMILIA,
+        CAST(p.Cod_Linha   AS VARCHAR) || ' - ' || p.Des_Linha   AS LINHA,
+        k.REGIONAL,
+        k.REGIAO_CLIENTE,   -- ADICIONADO
+        k.REGIAO_MOVIMENTO, -- ADICIONADO
+        k.PERIODO,
+        SUM(k.QTD_VENDA) AS QTD_VENDA,
+        SUM(k.VOL_VENDA) AS VOL_VENDA
+      FROM chaves k
+      LEFT JOIN prod p ON k.Cod_Produto = p.Cod_Produto AND k.EMPRESA = p.EMPRESA
+      LEFT JOIN cli  c ON k.Chv_Cliente = c.Chv_Cliente AND k.EMPRESA = c.EMPRESA
+      -- WHERE REGIONAL IS NOT NULL AND REGIONAL <> ''
+      GROUP BY
+        UPPER(k.EMPRESA),
+        TRIM(SPLIT_PART(c.Chv_Cliente, '|', 2)),
+        c.NOME_CLIENTE,
+        c.COD_GRUPO_CLIENTE,
+        c.DESC_GRUPO_E_CLIENTE,
+        k.Cod_Produto,
+        p.Des_Produto,
+        CAST(p.Cod_Familia AS VARCHAR) || ' - ' || p.Des_Familia,
+        CAST(p.Cod_Linha   AS VARCHAR) || ' - ' || p.Des_Linha,
+        k.REGIAO_MOVIMENTO, -- ADICIONADO
+        k.REGIAO_CLIENTE,   -- ADICIONADO
+        k.REGIONAL,
+        k.PERIODO
+    )
+
+    -- ============================================================
+    -- Resultado final consolidado, com REGIONAL_GESTOR
+    -- ============================================================
+    SELECT
+      g.EMPRESA,
+      g.COD_CLIENTE,
+      g.NOME_CLIENTE,
+      g.COD_GRUPO_CLIENTE,
+      g.DESC_GRUPO_E_CLIENTE,
+      g.COD_PROD,
+      g.DESC_PRODUTO,
+      g.FAMILIA,
+      g.LINHA,
+      g.REGIONAL,
+      g.REGIAO_CLIENTE,   -- ADICIONADO
+      g.REGIAO_MOVIMENTO, -- ADICIONADO
+      r.REGIONAL_GESTOR,
+      CAST(g.PERIODO AS TIMESTAMP) AS PERIODO,
+      g.QTD_VENDA,
+      g.VOL_VENDA
+    FROM gold g
+    LEFT JOIN reg_gestor r
+      ON g.REGIONAL = r.REGIONAL
+    """
+
+    # Salvar df_vendas_krona_gold em Parquet para salvar as alterações, filtros e regras aplicadas no histórico, otimizando memória e garantindo rastreabilidade
+    # Codec / row group / dicionário / ordenação pela política de gravação do dataset (POLITICA_GRAVACAO_PADRAO / benchmark no functions.py)
+    politica_gold = politica_gravacao_staging(pasta_staging, "df_vendas_krona_gold")
+    opcoes_gold = opcoes_copy_parquet(politica_gold)
+    if carga_completa:
+        ordenacao_gold = f"ORDER BY {sql_ordenacao(politica_gold['ordem'])}" if politica_gold["ordem"] else ""
+        con.execute(f"COPY (SELECT * FROM ({sql}) {ordenacao_gold}) TO '{arquivo_vendas_gold.as_posix()}' ({opcoes_gold})")
+    elif periodos_carga or periodos_remover or reatribuir_clientes:
+        # Carga incremental: troca no histórico somente os meses reprocessados e os clientes com regional reatribuída
+        substituir_periodos_parquet(
+            con, arquivo_vendas_gold, sql, periodos_carga + periodos_remover,
+            filtro_substituir=(
+                "EXISTS (SELECT 1 FROM clientes_gold_reprocessar WHERE COD_CLIENTE_REPROCESSAR IS NOT DISTINCT FROM COD_CLIENTE)"
+                if reatribuir_clientes else None
+            ),
+            opcoes=opcoes_gold,
+            ordem=politica_gold["ordem"]
+        )
+    else:
+        print("⏭️ Nenhum mês aberto ou alterado e nenhuma regional a reatribuir. Histórico gold mantido.")
+
+    # Gravar a marca d'água somente depois do gold salvo
+    salvar_json(arquivo_controle_ingestao, {
+        "ultimo_periodo_fechado": str(ultimo_fechado.date()),
+        "fingerprint_periodos": fingerprints_vendas,
+        "dependencias": dependencias_vendas,
+        "snapshots": versoes_snapshot,
+        "modo_ultima_carga": plano_carga["modo"],
+        "periodos_ultima_carga": periodos_carga,
+        "atualizado_em": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    })
+
+    print("✅ Organização de Regionais e Inserção de Regional Gestor na df_vendas_krona_gold concluídos com sucesso!")
+
+    # Aplicar produtos a eliminar no gold (anti-join), e excluir os produtos listados na variavel produtos_a_eliminar vinda do arquivo de regras de negócio
+    sql_vendas_krona = f"""
+      SELECT g.*
+      FROM parquet_scan('{arquivo_vendas_gold.as_posix()}') g
+      ANTI JOIN produtos_eliminar e
+        ON g.COD_PROD = e.COD_PROD
+    """
+    destino_vendas_krona = caminho_dataset_staging(pasta_staging, "df_vendas_krona")
+
+    # Histórico particionado por mês (ANO_MES=YYYY-MM/): cada etapa lê só os meses e colunas que usa;
+    # o df_vendas_krona.parquet (arquivo único) continua sendo gravado ao lado
+    politica_vendas_krona = politica_gravacao_staging(pasta_staging, "df_vendas_krona")
+    opcoes_vendas_krona = opcoes_copy_parquet(politica_vendas_krona)
+    if dataset_particionado("df_vendas_krona"):
+        escrever_dataset_particionado(
+            con, sql_vendas_krona, destino_vendas_krona, opcoes_vendas_krona, manter_arquivo_unico("df_vendas_krona"),
+            politica_vendas_krona["ordem"]
+        )
+    else:
+        if politica_vendas_krona["ordem"]:
+            sql_vendas_krona += f"ORDER BY {sql_ordenacao(politica_vendas_krona['ordem'])}"
+        con.execute(f"COPY ({sql_vendas_krona}) TO '{destino_vendas_krona.as_posix()}' ({opcoes_vendas_krona})")
+
+    con.close()
+
+    # Banco de staging (opcional): disponibiliza o histórico para as leituras filtradas das próximas etapas
+    if USAR_STAGING_DUCKDB:
+        salvar_tabela_staging(conectar_staging(pasta_staging), "df_vendas_krona", destino_vendas_krona)
+
+    print("✅ Eliminação de produtos concluída!")
+
+
+for empresa, cod_empresas in empresas.items():
+    vendas_empresa = espelho_empresa(vendas_espelho, empresa)
+    if vendas_empresa is None:
+        print(f"⚠️ Empresa {empresa} sem vendas no espelho do fato. Ingestão ignorada.")
+        continue
+    print(f"🏢 Ingestão de vendas | Empresa: {empresa}")
+    # Cada empresa com as regras da própria planilha (a da EMPRESA_PLANO já foi carregada acima)
+    regras_empresa = regras_negocio if empresa == EMPRESA_PLANO else carregar_regras_negocio(
+        arquivo_regras_empresa(pasta_input_regras, empresa), pasta_cache_regras(pasta_staging_raiz, empresa)
+    )
+    ingerir_vendas_empresa(
+        cod_empresas, vendas_empresa, pasta_empresa(pasta_staging_raiz, empresa), regras_ingestao_empresa(regras_empresa)
+    )
+
+resumo_perfil_sql("ingestao_vendas")
 
 # %%
 # # FIXME: Gerar arquivo de saída para validação Anna
@@ -757,18 +1011,6 @@ print("✅ Organização de Regionais e Inserção de Regional Gestor na df_vend
 # del df_vendas_krona_gold, df_validacao_anna
 # gc.collect()
 
-# %%
-# Aplicar produtos a eliminar no df_vendas_krona_gold, e excluir os produtos listados na variavel produtos_a_eliminar vinda do arquivo de regras de negócio
-df_vendas_krona = pd.read_parquet(pasta_staging_parquet / "df_vendas_krona_gold.parquet")
-lista_produtos_eliminar = set(produtos_a_eliminar['COD_PROD'])
-df_vendas_krona = df_vendas_krona[~df_vendas_krona['COD_PROD'].isin(lista_produtos_eliminar)]
-df_vendas_krona.to_parquet(pasta_staging_parquet / "df_vendas_krona.parquet", index=False)
-
-del df_vendas_krona
-gc.collect()
-
-print("✅ Eliminação de produtos concluída!")
-
 # %%
 
 # Criar demanda de lançamento, conforme regras alinhadas com a Anna
@@ -776,10 +1018,7 @@ print("✅ Eliminação de produtos concluída!")
 #-----------------------------------------------------------------------#
 #---------------Carrregar Demanda Lançamento Novos Produtos ------------#
 #-----------------------------------------------------------------------#
-caminho_arquivo = arquivo_input_regras_negocio
-
-guia_excel = 'PRODUTOS_LANCAMENTOS'
-df_demanda_produtos_lancamento = pd.read_excel(caminho_arquivo, sheet_name=guia_excel, engine='calamine', dtype={'COD': str})
+df_demanda_produtos_lancamento = regras_negocio['PRODUTOS_LANCAMENTOS'].copy()
 
 # Colunas em Maiuscula
 colunas_info_lancamento = [
@@ -828,6 +1067,15 @@ for col in df_demanda_produtos_lancamento.columns:
     except:
         continue
 
+# Cada cabeçalho de data é convertido uma única vez (mesma conversão da coluna PERIODO após o melt);
+# só os meses do horizonte entram no melt, já como MES_ID
+datas_cabecalho = pd.to_datetime(pd.Series(col_datas, dtype=object)).dt.normalize()
+no_horizonte = datas_cabecalho.isin(df_periodo_previsao['PERIODO_PROJECAO']).to_numpy()
+mes_por_coluna = dict(zip(
+    [col for col, ok in zip(col_datas, no_horizonte) if ok],
+    mes_id(datas_cabecalho[no_horizonte])
+))
+
 colunas_info_lancamento = [
     'NOME',
     'NOME PROJETO',
@@ -845,27 +1093,17 @@ colunas_validas = (
 
 df_demanda_produtos_lancamento = df_demanda_produtos_lancamento[colunas_validas]
 
-# Melt
+# Melt (somente as colunas de meses do PERIODO_PREVISAO, já carregado e tratado junto com as demais regras)
 df_demanda_produtos_lancamento = df_demanda_produtos_lancamento.melt(
     id_vars=[col for col in df_demanda_produtos_lancamento.columns if col not in col_datas],
-    value_vars=col_datas,
-    var_name='PERIODO',
+    value_vars=list(mes_por_coluna),
+    var_name='MES_ID',
     value_name='VALOR'
 )
 
-df_demanda_produtos_lancamento['PERIODO'] = pd.to_datetime(df_demanda_produtos_lancamento['PERIODO']).dt.normalize()
-
-
-#-----------------------------------------------------------------------#
-#---------------Carregar PERIODO_PREVISAO-------------------------------#
-#-----------------------------------------------------------------------#
-df_periodo_previsao = pd.read_excel(caminho_arquivo, sheet_name='PERIODO_PREVISAO', engine='calamine')
-df_periodo_previsao = df_periodo_previsao[df_periodo_previsao['PERIODO_PROJECAO'].notna()]
-df_periodo_previsao['PERIODO_PROJECAO'] = pd.to_datetime(df_periodo_previsao['PERIODO_PROJECAO'])
-
-df_demanda_produtos_lancamento = df_demanda_produtos_lancamento[
-    df_demanda_produtos_lancamento['PERIODO'].isin(df_periodo_previsao['PERIODO_PROJECAO'])
-].reset_index(drop=True)
+df_demanda_produtos_lancamento['MES_ID'] = (
+    df_demanda_produtos_lancamento['MES_ID'].map(mes_por_coluna).astype(np.int32)
+)
 
 #-----------------------------------------------------------------------#
 # FASE 1 - REPLICAÇÃO (VALOR ANTERIOR NO TEMPO)
@@ -873,7 +1111,7 @@ df_demanda_produtos_lancamento = df_demanda_produtos_lancamento[
 
 df_demanda_produtos_lancamento['VALOR'] = pd.to_numeric(df_demanda_produtos_lancamento['VALOR'], errors='coerce')
 
-df_demanda_produtos_lancamento = df_demanda_produtos_lancamento.sort_values(['COD_PROD', 'PERIODO'])
+df_demanda_produtos_lancamento = df_demanda_produtos_lancamento.sort_values(['COD_PROD', 'MES_ID'])
 
 # 0 vira NaN
 df_demanda_produtos_lancamento['VALOR'] = df_demanda_produtos_lancamento['VALOR'].replace(0, np.nan)
@@ -897,21 +1135,25 @@ produtos_sem_valor = (
 
 produtos_sem_valor = produtos_sem_valor[produtos_sem_valor.isna()].index
 
-# Carregar vendas
+# Carregar vendas (somente os 3 últimos meses do histórico, que são os usados na média)
 if 'df_vendas_krona_lancamento' not in locals() or df_vendas_krona_lancamento.empty:
-    df_vendas_krona_lancamento = pd.read_parquet(pasta_staging_parquet / 'df_vendas_krona.parquet')
-
-df_vendas_krona_lancamento['PERIODO'] = pd.to_datetime(df_vendas_krona_lancamento['PERIODO'])
+    ultimo_mes_vendas = mes_id(periodos_dataset_staging(pasta_staging_parquet, 'df_vendas_krona')[-1])
+    df_vendas_krona_lancamento = ler_dataset_staging(
+        pasta_staging_parquet,
+        'df_vendas_krona',
+        colunas=['COD_PROD', 'PERIODO', 'QTD_VENDA'],
+        periodo_inicio=periodo_de_mes_id(ultimo_mes_vendas - 2)
+    )
 
-data_max = df_vendas_krona_lancamento['PERIODO'].max()
-limite = (data_max.to_period('M') - 2).to_timestamp()
+mes_venda = mes_id(df_vendas_krona_lancamento['PERIODO'])
+limite = mes_venda.max() - 2
 
-df_vendas_krona_3m = df_vendas_krona_lancamento[df_vendas_krona_lancamento['PERIODO'] >= limite]
+df_vendas_krona_3m = df_vendas_krona_lancamento[mes_venda >= limite]
 
 df_media_3m = (
     df_vendas_krona_3m
-    .assign(MES=lambda df: df['PERIODO'].dt.to_period('M'))
-    .groupby(['COD_PROD', 'MES'])['QTD_VENDA']
+    .assign(MES_ID=mes_venda[mes_venda >= limite])
+    .groupby(['COD_PROD', 'MES_ID'])['QTD_VENDA']
     .sum()
     .groupby('COD_PROD')
     .mean()
@@ -931,7 +1173,7 @@ df_demanda_produtos_lancamento.drop(columns='MEDIA_3M', inplace=True)
 df_demanda_produtos_lancamento['VALOR'] = df_demanda_produtos_lancamento['VALOR'].fillna(0)
 
 # Carregar DIM_PRODUTOS_KRONA para trazer peso unitário e calcular volume da demanda de lançamento
-df_dim_produtos_krona = pd.read_parquet(pasta_staging_parquet / "DIM_PRODUTOS_KRONA.parquet")
+df_dim_produtos_krona = ler_dataset_staging(pasta_staging_parquet, "DIM_PRODUTOS_KRONA", colunas=["COD_PROD", "PESO_UNIT", "FAMILIA", "LINHA"])
 
 # Unir df_demanda_produtos_lancamento com df_dim_produtos_krona para trazer peso unitário
 df_demanda_produtos_lancamento = df_demanda_produtos_lancamento.merge(df_dim_produtos_krona[["COD_PROD", "PESO_UNIT",'FAMILIA', 'LINHA']], on="COD_PROD", how="left", suffixes=('', '_SOP'))
@@ -951,12 +1193,15 @@ df_demanda_produtos_lancamento.rename(columns={
     'VALOR': 'QTD_LANC'
 }, inplace=True)
 
+# PERIODO (data) só volta na exportação
+df_demanda_produtos_lancamento['PERIODO'] = periodo_de_mes_id(df_demanda_produtos_lancamento['MES_ID'])
+
 # Reordenar colunas para manter padrão e facilitar análises futuras
 colunas_ordenadas = ['COD_PROD', 'DESC_PROD', 'FAMILIA', 'FAMILIA_SOP', 'LINHA', 'MARCA', 'PROCESSO', 'CD: MT', 'CD: NE', 'CD: CO', 'CD: VQ', 'CD: TM', 'PERIODO', 'QTD_LANC', 'VOL_LANC']
 df_demanda_produtos_lancamento = df_demanda_produtos_lancamento[colunas_ordenadas]
 
 # Salvar df_demanda_produtos_lancamento ajustado em Parquet
-df_demanda_produtos_lancamento.to_parquet(pasta_staging_parquet / "df_demanda_produtos_lancamento.parquet", index=False)
+salvar_dataset_staging(pasta_staging_parquet, "df_demanda_produtos_lancamento", df_demanda_produtos_lancamento)
 
 del df_vendas_krona_lancamento, df_dim_produtos_krona
 gc.collect()
@@ -966,54 +1211,119 @@ print("✅ Demanda de lançamento ajustada e concluída!")
 # %%
 # Retirar do histórico df_vendas_krona os produtos de lançamento, ajustar a demanda lançamento utilizando esse histórico, e gerar um parquet pronto com a demanda de lançamento ajustada para consumo no painel e análises futuras
 
-# Carregando o df_vendas_krona
-df_vendas_krona = pd.read_parquet(pasta_staging_parquet / "df_vendas_krona.parquet")
-
 # Carregar o df_demanda_produtos_lancamento ajustada
-df_demanda_produtos_lancamento = pd.read_parquet(pasta_staging_parquet / "df_demanda_produtos_lancamento.parquet")
+df_demanda_produtos_lancamento = ler_dataset_staging(pasta_staging_parquet, "df_demanda_produtos_lancamento", colunas=["COD_PROD"])
+produtos_lancamento = sorted(df_demanda_produtos_lancamento['COD_PROD'].dropna().unique())
 
-# Separar o arquivo de vendas retirando os produtos de lançamento para aplicar as regras de lançamento, e depois unir novamente para aplicar a regra de eliminação de produtos
-lista_produtos_lancamento = set(df_demanda_produtos_lancamento['COD_PROD'])
-df_vendas_krona_lancamento = df_vendas_krona[df_vendas_krona['COD_PROD'].isin(lista_produtos_lancamento)]
-df_vendas_krona = df_vendas_krona[~df_vendas_krona['COD_PROD'].isin(lista_produtos_lancamento)]
+# Separar o arquivo de vendas retirando os produtos de lançamento para aplicar as regras de lançamento, e depois unir
+# novamente para aplicar a regra de eliminação de produtos (em streaming no DuckDB com MODO_MEMORIA_LIMITADA)
+separar_vendas_lancamento(pasta_staging_parquet, produtos_lancamento)
 
-# Salvar df_vendas_krona sem os produtos de lançamento para aplicar as regras de lançamento
-df_vendas_krona.to_parquet(pasta_staging_parquet / "df_vendas_krona.parquet", index=False)
-
-# Salvar df_vendas_krona_lancamento para aplicar as regras de lançamento
-df_vendas_krona_lancamento.to_parquet(pasta_staging_parquet / "df_vendas_krona_lancamento.parquet", index=False)
-
-del df_vendas_krona, df_vendas_krona_lancamento, df_demanda_produtos_lancamento
+del df_demanda_produtos_lancamento
 gc.collect()
 
 print("✅ Separação de históricos de produtos de lançamento concluída!")
 
+# Modelo estrela (ESTRELA/): dimensões com chave inteira (inclusive produtos de lançamento) e fato só com IDs + medidas
+iniciar_perfil_sql(pasta_staging_raiz, "modelo_estrela")
+gerar_modelo_estrela_vendas(
+    pasta_staging_parquet,
+    caminho_dataset_staging(pasta_staging_parquet, "df_vendas_krona"),
+    [
+        caminho_dataset_staging(pasta_staging_parquet, "df_vendas_krona"),
+        caminho_dataset_staging(pasta_staging_parquet, "df_vendas_krona_lancamento")
+    ]
+)
+resumo_perfil_sql("modelo_estrela")
+
+# Camada fria do histórico (USAR_CAMADAS_HISTORICO): meses fechados antigos somados uma vez nos grãos do forecast e das
+# exportações colaborativas. Mês com assinatura nova na ingestão é reagregado; dimensões, regras ou produtos de lançamento
+# diferentes refazem a camada inteira
+if USAR_CAMADAS_HISTORICO:
+    controle_ingestao = ler_json(pasta_staging_parquet / "CONTROLE_INGESTAO_VENDAS.json", {})
+    atualizar_camada_fria(
+        pasta_staging_parquet,
+        {
+            "dependencias": controle_ingestao.get("dependencias"),
+            "snapshots": controle_ingestao.get("snapshots"),
+            "produtos_lancamento": fingerprint_dataframe(pd.DataFrame({"COD_PROD": produtos_lancamento})),
+        },
+        controle_ingestao.get("fingerprint_periodos", {}),
+        controle_ingestao.get("ultimo_periodo_fechado"),
+    )
+
+# Painel de forecast (USAR_PAINEL_FORECAST): matriz séries x meses já agregada e com calendário completo, aberta com
+# memory-map pelos forecasts do 01 e do 02 em vez de reagregar o FATO_VENDAS a cada execução
+if USAR_PAINEL_FORECAST:
+    gerar_painel_forecast(pasta_staging_parquet)
+
 # %%
 # 🦆 Exportação de Dados Vendas para Planejamento Colaborativo
 # 🎯 Objetivo: Exportar CSV para o Plano Colaborativo
 
-# Carregando o df_vendas_krona
-df_vendas_krona = pd.read_parquet(pasta_staging_parquet / "df_vendas_krona.parquet")
-
-df_vendas_krona['NIVEL_PLAN_DEMANDA'] = np.where(
-    df_vendas_krona['COD_GRUPO_CLIENTE'].isin(lista_clientes_plan_demanda),
-    'CLIENTE',
-    'PRODUTO'
-)
+chaves_hist_vend_PRODUTO = ['REGIONAL_GESTOR', 'REGIONAL', 'FAMILIA', 'PERIODO']
+chaves_hist_vend_CLIENTE = ["COD_GRUPO_CLIENTE", "DESC_GRUPO_E_CLIENTE", "REGIONAL_GESTOR", 'REGIONAL', "FAMILIA", "PERIODO"]
 
-# Separa os DataFrames
-df_hist_vend_PRODUTO = df_vendas_krona[df_vendas_krona['NIVEL_PLAN_DEMANDA'] == 'PRODUTO']
-df_hist_vend_CLIENTE = df_vendas_krona[df_vendas_krona['NIVEL_PLAN_DEMANDA'] == 'CLIENTE']
 
-# Eliminar coluna NIVEL_PLAN_DEMANDA
-df_hist_vend_PRODUTO = df_hist_vend_PRODUTO.drop(columns=['NIVEL_PLAN_DEMANDA'])
-df_hist_vend_CLIENTE = df_hist_vend_CLIENTE.drop(columns=['NIVEL_PLAN_DEMANDA'])
+def agregar_hist_vend_colaborativo(df_vendas_krona):
+    """Separa o histórico em PRODUTO / CLIENTE (NIVEL_PLAN_DEMANDA) e soma VOL_VENDA nas chaves de cada exportação."""
+    df_vendas_krona['NIVEL_PLAN_DEMANDA'] = np.where(
+        df_vendas_krona['COD_GRUPO_CLIENTE'].isin(lista_clientes_plan_demanda),
+        'CLIENTE',
+        'PRODUTO'
+    )
 
-# Agrupar df_hist_vend_PRODUTO por REGIONAL_GESTOR, FAMILIA, PERIODO, VOL_VENDA
-df_hist_vend_PRODUTO = df_hist_vend_PRODUTO.groupby(
-    ['REGIONAL_GESTOR', 'REGIONAL', 'FAMILIA', 'PERIODO'],
-    as_index=False
-).agg({'VOL_VENDA': 'sum'}).reset_index(drop=True)
+    # Separa os DataFrames
+    df_hist_vend_PRODUTO = df_vendas_krona[df_vendas_krona['NIVEL_PLAN_DEMANDA'] == 'PRODUTO']
+    df_hist_vend_CLIENTE = df_vendas_krona[df_vendas_krona['NIVEL_PLAN_DEMANDA'] == 'CLIENTE']
+
+    # Eliminar coluna NIVEL_PLAN_DEMANDA
+    df_hist_vend_PRODUTO = df_hist_vend_PRODUTO.drop(columns=['NIVEL_PLAN_DEMANDA'])
+    df_hist_vend_CLIENTE = df_hist_vend_CLIENTE.drop(columns=['NIVEL_PLAN_DEMANDA'])
+
+    # Agrupar df_hist_vend_PRODUTO por REGIONAL_GESTOR, FAMILIA, PERIODO, VOL_VENDA
+    df_hist_vend_PRODUTO = df_hist_vend_PRODUTO.groupby(
+        chaves_hist_vend_PRODUTO,
+        as_index=False,
+        observed=True
+    ).agg({'VOL_VENDA': 'sum'}).reset_index(drop=True)
+
+    # Agrupar df_hist_vend_CLIENTE por COD_GRUPO_CLIENTE, DESC_GRUPO_E_CLIENTE, REGIONAL_GESTOR, FAMILIA, PERIODO, VOL_VENDA
+    df_hist_vend_CLIENTE = df_hist_vend_CLIENTE.groupby(
+        chaves_hist_vend_CLIENTE,
+        as_index=False,
+        observed=True
+    ).agg({'VOL_VENDA': 'sum'}).reset_index(drop=True)
+
+    return df_hist_vend_PRODUTO, df_hist_vend_CLIENTE
+
+
+# Somente as colunas usadas nas exportações colaborativas
+colunas_colaborativo = ["COD_GRUPO_CLIENTE", "DESC_GRUPO_E_CLIENTE", "REGIONAL_GESTOR", "REGIONAL", "FAMILIA", "PERIODO", "VOL_VENDA"]
+
+if camada_fria_disponivel(pasta_staging_parquet, "COLABORATIVO"):
+    # Histórico em camadas: meses fechados antigos já somados nas chaves do CLIENTE + últimos meses no grão completo
+    df_vendas_krona = ler_historico_em_camadas(pasta_staging_parquet, "COLABORATIVO")
+    relatorio_memoria(df_vendas_krona, "df_vendas_krona (colaborativo, camadas)")
+    df_hist_vend_PRODUTO, df_hist_vend_CLIENTE = agregar_hist_vend_colaborativo(df_vendas_krona)
+    del df_vendas_krona
+elif MODO_MEMORIA_LIMITADA:
+    # Memória limitada: lotes de meses (PERIODO é chave dos dois agrupamentos, então cada soma fica inteira em um lote)
+    partes_PRODUTO, partes_CLIENTE = [], []
+    for df_lote in iterar_lotes_periodo(pasta_staging_parquet, "df_vendas_krona", colunas_colaborativo):
+        parte_PRODUTO, parte_CLIENTE = agregar_hist_vend_colaborativo(df_lote)
+        partes_PRODUTO.append(parte_PRODUTO)
+        partes_CLIENTE.append(parte_CLIENTE)
+        del df_lote
+    df_hist_vend_PRODUTO = concatenar_categorias(partes_PRODUTO).sort_values(chaves_hist_vend_PRODUTO).reset_index(drop=True)
+    df_hist_vend_CLIENTE = concatenar_categorias(partes_CLIENTE).sort_values(chaves_hist_vend_CLIENTE).reset_index(drop=True)
+    del partes_PRODUTO, partes_CLIENTE
+else:
+    df_vendas_krona = ler_dataset_staging(pasta_staging_parquet, "df_vendas_krona", colunas=colunas_colaborativo)
+    relatorio_memoria(df_vendas_krona, "df_vendas_krona (colaborativo)")
+    df_hist_vend_PRODUTO, df_hist_vend_CLIENTE = agregar_hist_vend_colaborativo(df_vendas_krona)
+    del df_vendas_krona
+gc.collect()
 
 # Salva como CSV
 df_hist_vend_PRODUTO.to_csv(
@@ -1025,12 +1335,6 @@ df_hist_vend_PRODUTO.to_csv(
     float_format="%.2f"
 )
 
-# Agrupar df_hist_vend_CLIENTE por COD_GRUPO_CLIENTE, DESC_GRUPO_E_CLIENTE, REGIONAL_GESTOR, FAMILIA, PERIODO, VOL_VENDA
-df_hist_vend_CLIENTE = df_hist_vend_CLIENTE.groupby(
-    ["COD_GRUPO_CLIENTE","DESC_GRUPO_E_CLIENTE", "REGIONAL_GESTOR", 'REGIONAL', "FAMILIA", "PERIODO"],
-    as_index=False
-).agg({'VOL_VENDA': 'sum'}).reset_index(drop=True)
-
 # Salva como CSV
 df_hist_vend_CLIENTE.to_csv(
     pasta_input_painel / 'HIST_VENDA_KRONA_CLIENTE.csv',
@@ -1070,14 +1374,14 @@ meses_recentes = sorted(df_3_meses_mais_recentes['PERIODO'].unique())[-3:]
 df_3_meses_mais_recentes = df_3_meses_mais_recentes[df_3_meses_mais_recentes['PERIODO'].isin(meses_recentes)].copy()
 
 # Agrupa pelas colunas desejadas e calcula a média das colunas numéricas
-df_3_meses_mais_recentes_media = df_3_meses_mais_recentes.groupby(colunas_agregadas).mean(numeric_only=True).reset_index()
+df_3_meses_mais_recentes_media = df_3_meses_mais_recentes.groupby(colunas_agregadas, observed=True).mean(numeric_only=True).reset_index()
 
 # Adicionar coluna MEDIA informando 'MÉDIA 3 MESES' na coluna
 df_3_meses_mais_recentes_media['MEDIA'] = 'MÉDIA 3 MESES'
 
 # Agrupamento fazendo média dos 6 meses
 df_6_meses_mais_recentes_media = df_hist_vend_PRODUTO_ultimos_6_meses.copy()
-df_6_meses_mais_recentes_media = df_6_meses_mais_recentes_media.groupby(colunas_agregadas).mean(numeric_only=True).reset_index()
+df_6_meses_mais_recentes_media = df_6_meses_mais_recentes_media.groupby(colunas_agregadas, observed=True).mean(numeric_only=True).reset_index()
 
 # Adicionar coluna MEDIA informando 'MÉDIA 6 MESES' na coluna
 df_6_meses_mais_recentes_media['MEDIA'] = 'MÉDIA 6 MESES'
@@ -1091,7 +1395,8 @@ df_media_vendas_PRODUTO = df_media_vendas_PRODUTO.pivot_table(
     columns='MEDIA',
     values='VOL_VENDA',
     aggfunc='sum',
-    fill_value=0
+    fill_value=0,
+    observed=True
 ).reset_index()
 
 # Gerar o arquivo CSV
@@ -1133,14 +1438,14 @@ meses_recentes = sorted(df_3_meses_mais_recentes['PERIODO'].unique())[-3:]
 df_3_meses_mais_recentes = df_3_meses_mais_recentes[df_3_meses_mais_recentes['PERIODO'].isin(meses_recentes)].copy()
 
 # Agrupa pelas colunas desejadas e calcula a média das colunas numéricas
-df_3_meses_mais_recentes_media = df_3_meses_mais_recentes.groupby(colunas_agrupadas).mean(numeric_only=True).reset_index()
+df_3_meses_mais_recentes_media = df_3_meses_mais_recentes.groupby(colunas_agrupadas, observed=True).mean(numeric_only=True).reset_index()
 
 # Adicionar coluna MEDIA informando 'MÉDIA 3 MESES' na coluna
 df_3_meses_mais_recentes_media['MEDIA'] = 'MÉDIA 3 MESES'
 
 # Agrupamento fazendo média dos 6 meses
 df_6_meses_mais_recentes_media = df_hist_vend_CLIENTE_ultimos_6_meses.copy()
-df_6_meses_mais_recentes_media = df_6_meses_mais_recentes_media.groupby(colunas_agrupadas).mean(numeric_only=True).reset_index()
+df_6_meses_mais_recentes_media = df_6_meses_mais_recentes_media.groupby(colunas_agrupadas, observed=True).mean(numeric_only=True).reset_index()
 
 # Adicionar coluna MEDIA informando 'MÉDIA 6 MESES' na coluna
 df_6_meses_mais_recentes_media['MEDIA'] = 'MÉDIA 6 MESES'
@@ -1154,7 +1459,8 @@ df_media_vendas_CLIENTE = df_media_vendas_CLIENTE.pivot_table(
     columns='MEDIA',
     values='VOL_VENDA',
     aggfunc='sum',
-    fill_value=0
+    fill_value=0,
+    observed=True
 ).reset_index()
 
 # Validar se as colunas 'MÉDIA 3 MESES' e 'MÉDIA 6 MESES' existem, caso contrário, criar com valor 0
@@ -1173,7 +1479,7 @@ df_media_vendas_CLIENTE.to_csv(
     float_format="%.2f"
 )
 
-del df_hist_vend_PRODUTO, df_hist_vend_CLIENTE, df_vendas_krona, produtos_a_eliminar
+del df_hist_vend_PRODUTO, df_hist_vend_CLIENTE, produtos_a_eliminar
 gc.collect()
 
 print("✅ Bases de Vendas para Planejamento Colaborativo geradas com sucesso!")
@@ -1501,19 +1807,12 @@ print("✅ Bases de Vendas para Planejamento Colaborativo geradas com sucesso!")
 # %%
 timer.iniciar()
 
-# ===========================
-# PROTECOES (Windows / Notebook)
-# ===========================
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
-os.environ["OPENBLAS_NUM_THREADS"] = "1"
-os.environ["NUMEXPR_NUM_THREADS"] = "1"
-
 # ============================================================
-# PARAMETRO DE NUCLEOS (ajuste aqui)
+# PARALELISMO: perfil da máquina (functions.py)
+# Workers, batch_size e threads BLAS/DuckDB vêm do perfil detectado e calibrado
+# (PERFIL_MAQUINA.json). Para forçar os workers use N_NUCLEOS_MANUAL no functions.py.
 # ============================================================
-N_NUCLEOS = 8   # sua máquina
-# N_NUCLEOS = 4 # cliente
+arquivo_perfil_maquina = pasta_staging_raiz / "PERFIL_MAQUINA.json"
 
 PRINT_EVERY = 50
 
@@ -1566,7 +1865,10 @@ def pred_hw(y_train, steps):
             m = ExponentialSmoothing(y_train, trend="add", seasonal=None).fit()
             return np.maximum(m.forecast(steps), 0)
 
-def pred_lr(y_train, steps):
+def pred_lr(y_train, steps, lr_lote=None):
+    # lr_lote: previsões já calculadas em lote pelo tamanho do treino (USAR_TENDENCIA_LINEAR_LOTE)
+    if lr_lote is not None and len(y_train) in lr_lote:
+        return lr_lote[len(y_train)][:steps].copy()
     y_train = np.asarray(y_train, dtype=float)
     t = np.arange(len(y_train)).reshape(-1, 1)
     lr = LinearRegression().fit(t, y_train)
@@ -1652,7 +1954,7 @@ def limitar_forecast(fc, y, fator_media=3.0, fator_p75=2.0):
 # ============================================================
 # WORKERS (joblib loky)
 # ============================================================
-def _worker_forecast_serie(cod_prod, regional, periodos_np, y_np, future_dates_np, horizon, janela_validacao):
+def _worker_forecast_serie(cod_prod, regional, periodos_np, y_np, future_dates_np, horizon, janela_validacao, lr_lote=None):
     df_serie_periodos = pd.DatetimeIndex(periodos_np)
     y = y_np.astype(float)
 
@@ -1685,7 +1987,7 @@ def _worker_forecast_serie(cod_prod, regional, periodos_np, y_np, future_dates_n
         pass
 
     try:
-        pred_val = pred_lr(y_train, J)
+        pred_val = pred_lr(y_train, J, lr_lote)
         scores["LinearRegression"] = metric(y_val, pred_val)
     except Exception:
         pass
@@ -1704,13 +2006,13 @@ def _worker_forecast_serie(cod_prod, regional, periodos_np, y_np, future_dates_n
 
     if not scores:
         best = "LinearRegression_Fallback"
-        fc = pred_lr(y, horizon)
+        fc = pred_lr(y, horizon, lr_lote)
     else:
         best = min(scores.items(), key=lambda x: x[1])[0]
         if best == "HoltWinters":
             fc = pred_hw(y, horizon)
         elif best == "LinearRegression":
-            fc = pred_lr(y, horizon)
+            fc = pred_lr(y, horizon, lr_lote)
         elif best == "RandomForest":
             fc = pred_rf(df_serie_periodos, y, pd.DatetimeIndex(future_dates_np))
         else:
@@ -1725,7 +2027,7 @@ def _worker_forecast_serie(cod_prod, regional, periodos_np, y_np, future_dates_n
     ]
     return registros_local, (cod_prod, regional), best
 
-def _worker_backtest_serie(cod_prod, regional, periodos_np, y_np, best, min_treino, step_backtest):
+def _worker_backtest_serie(cod_prod, regional, periodos_np, y_np, best, min_treino, step_backtest, lr_lote=None):
     idx = pd.DatetimeIndex(periodos_np)
     y = y_np.astype(float)
 
@@ -1745,7 +2047,7 @@ def _worker_backtest_serie(cod_prod, regional, periodos_np, y_np, best, min_trei
                 y_preds = pred_hw(y_train, steps)
 
             elif best in ("LinearRegression", "LinearRegression_Fallback"):
-                y_preds = pred_lr(y_train, steps)
+                y_preds = pred_lr(y_train, steps, lr_lote)
 
             elif best == "Media12_Intermitente":
                 y_preds = pred_intermitente(y_train, steps)
@@ -1780,36 +2082,6 @@ def _worker_backtest_serie(cod_prod, regional, periodos_np, y_np, best, min_trei
 
     return (cod_prod, regional), preds, ape, float(mape_serie), best
 
-def completar_calendario_mensal(df_hist_base, ultimo_mes_hist):
-    df_hist_base = df_hist_base.copy()
-    df_hist_base["PERIODO"] = pd.to_datetime(df_hist_base["PERIODO"]).dt.to_period("M").dt.to_timestamp()
-
-    partes = []
-
-    for (cod_prod, regional), g in df_hist_base.groupby(["COD_PROD", "REGIONAL"], sort=False):
-        g = g.sort_values("PERIODO")
-
-        calendario = pd.date_range(
-            start=g["PERIODO"].min(),
-            end=ultimo_mes_hist,
-            freq="MS"
-        )
-
-        g2 = (
-            g.set_index("PERIODO")
-             .reindex(calendario)
-             .rename_axis("PERIODO")
-             .reset_index()
-        )
-
-        g2["COD_PROD"] = cod_prod
-        g2["REGIONAL"] = regional
-        g2["VOL_VENDA"] = g2["VOL_VENDA"].fillna(0)
-
-        partes.append(g2[["COD_PROD", "REGIONAL", "PERIODO", "VOL_VENDA"]])
-
-    return pd.concat(partes, ignore_index=True)
-
 # ============================================================
 # MAIN
 # ============================================================
@@ -1818,22 +2090,11 @@ def main():
     print("🔄 Iniciando processo de previsão estatística...")
 
     # ============================================================
-    # 0) CARREGAR df_vendas_krona DO PARQUET
-    # ============================================================
-    df_vendas_krona = pd.read_parquet(pasta_staging_parquet / "df_vendas_krona.parquet")
-    print(f"📦 df_vendas_krona carregado | Linhas: {len(df_vendas_krona):,}")
-
-    # ============================================================
-    # FILTRO OPCIONAL PARA TESTE DE UM OU MAIS PRODUTOS
+    # 0) FILTRO OPCIONAL PARA TESTE DE UM OU MAIS PRODUTOS
     # ============================================================
+    codigos_teste = None
     if MODO_TESTE_COD_PROD:
 
-        df_vendas_krona["COD_PROD"] = (
-            df_vendas_krona["COD_PROD"]
-            .astype(str)
-            .str.strip()
-        )
-
         # Aceita tanto um único código string quanto uma lista de códigos
         if isinstance(COD_PROD_TESTE, (list, tuple, set)):
             codigos_base = [str(cod).strip() for cod in COD_PROD_TESTE]
@@ -1846,39 +2107,11 @@ def main():
             codigos_teste.add(cod)
             codigos_teste.add(cod.lstrip("0"))
 
-        df_vendas_krona = df_vendas_krona[
-            df_vendas_krona["COD_PROD"].isin(codigos_teste)
-        ].copy()
-
-        print(
-            f"🧪 MODO TESTE ATIVO | Produtos base={codigos_base} | "
-            f"Linhas após filtro: {len(df_vendas_krona):,}"
-        )
-
-        if df_vendas_krona.empty:
-            raise ValueError(f"Nenhuma linha encontrada para COD_PROD em {codigos_base}")
-
     else:
         print("🏭 MODO COMPLETO ATIVO | Processando todos os produtos.")
 
     # ============================================================
-    # 1) AGRUPAMENTO PADRÃO (COD_PROD + REGIONAL + PERIODO)
-    # ============================================================
-    df_group = (
-        df_vendas_krona
-        .groupby(["COD_PROD", "REGIONAL", "PERIODO"], as_index=False, sort=False)
-        .agg(VOL_VENDA=("VOL_VENDA", "sum"))
-        .sort_values(["COD_PROD", "REGIONAL", "PERIODO"])
-    )
-
-    print(
-        f"📊 Dados agregados | Séries (COD_PROD,REGIONAL): "
-        f"{df_group[['COD_PROD','REGIONAL']].drop_duplicates().shape[0]:,} | "
-        f"Períodos: {df_group['PERIODO'].nunique():,}"
-    )
-
-    # ============================================================
-    # 2) CALENDÁRIO FUTURO
+    # 1) CALENDÁRIO FUTURO
     # ============================================================
     future_dates = pd.DatetimeIndex(
         df_periodo_previsao["PERIODO_PROJECAO"].drop_duplicates().sort_values()
@@ -1897,17 +2130,37 @@ def main():
     # - qualquer PERIODO maior que esse é mês fatiado/incompleto
     # ============================================================
     hoje = pd.Timestamp.today().normalize()
+    ultimo_mes_hist = ultimo_periodo_fechado_data_cota(hoje)
 
-    if hoje.day >= 21:
-        ultimo_mes_hist = hoje.to_period("M").to_timestamp()
-    else:
-        ultimo_mes_hist = (hoje - pd.offsets.MonthBegin(1)).to_period("M").to_timestamp()
+    # ============================================================
+    # 2) SÉRIES (COD_PROD + REGIONAL) COM CALENDÁRIO COMPLETO
+    # Painel de forecast gravado na ingestão (séries x meses, memory-map):
+    # cada série é uma fatia da matriz até o último mês completo, com
+    # zero nos meses sem venda. Com USAR_PAINEL_FORECAST = False o
+    # FATO_VENDAS é agregado por ID_SERIE + PERIODO na hora (DuckDB).
+    # ============================================================
+    iniciar_perfil_sql(pasta_staging_raiz, "serie_forecast_01")
+    df_series, df_hist_base, tasks = carregar_series_forecast(
+        pasta_staging_parquet, ultimo_mes_hist, codigos_prod=codigos_teste
+    )
+    resumo_perfil_sql("serie_forecast_01")
 
-    df_hist_base = df_group[df_group["PERIODO"] <= ultimo_mes_hist].copy()
+    if MODO_TESTE_COD_PROD:
+        print(
+            f"🧪 MODO TESTE ATIVO | Produtos base={codigos_base} | "
+            f"Séries após filtro: {len(df_series):,}"
+        )
+
+        if df_series.empty:
+            raise ValueError(f"Nenhuma linha encontrada para COD_PROD em {codigos_base}")
 
     if df_hist_base.empty:
         raise ValueError("Histórico vazio após corte pelo último mês completo da data cota.")
 
+    print(
+        f"📊 Dados agregados | Séries (COD_PROD,REGIONAL): {len(df_series):,} | "
+        f"Períodos: {df_hist_base['PERIODO'].nunique():,}"
+    )
     print(
         f"📌 Corte histórico pela data cota | "
         f"Hoje: {hoje.date()} | "
@@ -1915,8 +2168,6 @@ def main():
     )
     # ============================================================
 
-    df_hist_base = completar_calendario_mensal(df_hist_base, ultimo_mes_hist)
-
     horizon = len(future_dates)
 
     print(
@@ -1929,28 +2180,34 @@ def main():
     # ============================================================
     JANELA_VALIDACAO = 12
 
-    tasks = []
-    for (cod_prod, regional), df_serie in df_hist_base.groupby(["COD_PROD", "REGIONAL"], sort=False):
-        df_serie = df_serie.sort_values("PERIODO")
-        periodos_np = df_serie["PERIODO"].to_numpy(dtype="datetime64[ns]")
-        y_np = df_serie["VOL_VENDA"].to_numpy(dtype=float)
-        tasks.append((cod_prod, regional, periodos_np, y_np))
-
+    # tasks: arrays de cada série como fatias do painel (sem cópia por série)
     total_series = len(tasks)
     print(f"🚀 Iniciando previsão por série | Total: {total_series:,}")
 
     future_dates_np = future_dates.to_numpy(dtype="datetime64[ns]")
 
+    # Tendência linear de todas as séries (treino da validação e histórico completo) num lote só
+    lr_lote = [None] * total_series
+    if USAR_TENDENCIA_LINEAR_LOTE:
+        lr_lote = previsoes_tendencia_linear(
+            [y_np for (_, _, _, y_np) in tasks],
+            [[len(y_np) - min(JANELA_VALIDACAO, max(3, len(y_np) // 3)), len(y_np)] for (_, _, _, y_np) in tasks],
+            max(JANELA_VALIDACAO, horizon),
+        )
+
     # executa em paralelo e coleta resultados
     t0 = time.time()
     registros = []
     best_model_por_serie = {}
 
-    results = Parallel(n_jobs=N_NUCLEOS, backend="loky", batch_size="auto", verbose=0)(
-        delayed(_worker_forecast_serie)(
-            cod_prod, regional, periodos_np, y_np, future_dates_np, horizon, JANELA_VALIDACAO
-        )
-        for (cod_prod, regional, periodos_np, y_np) in tasks
+    results = executar_paralelo(
+        _worker_forecast_serie,
+        [
+            (cod_prod, regional, periodos_np, y_np, future_dates_np, horizon, JANELA_VALIDACAO, lr_serie)
+            for (cod_prod, regional, periodos_np, y_np), lr_serie in zip(tasks, lr_lote)
+        ],
+        "forecast_01",
+        arquivo_perfil_maquina
     )
 
     for i, (registros_local, key, best) in enumerate(results, start=1):
@@ -2016,20 +2273,34 @@ def main():
         .groups
     )
 
-    tasks_bt = []
-    for (cod_prod, regional), d in df_hist_all.groupby(["COD_PROD","REGIONAL"], sort=False):
-        d = d.sort_values("PERIODO")
-        periodos_np = d["PERIODO"].to_numpy(dtype="datetime64[ns]")
-        y_np = d["VOL_VENDA_REAL"].to_numpy(dtype=float)
-        best = best_model_por_serie.get((cod_prod, regional), "LinearRegression_Fallback")
-        tasks_bt.append((cod_prod, regional, periodos_np, y_np, best))
+    # O histórico do backtest é o mesmo da previsão: reaproveita os arrays já fatiados
+    tasks_bt = [
+        (cod_prod, regional, periodos_np, y_np, best_model_por_serie.get((cod_prod, regional), "LinearRegression_Fallback"))
+        for (cod_prod, regional, periodos_np, y_np) in tasks
+    ]
 
-    t1 = time.time()
-    results_bt = Parallel(n_jobs=N_NUCLEOS, backend="loky", batch_size="auto", verbose=0)(
-        delayed(_worker_backtest_serie)(
-            cod_prod, regional, periodos_np, y_np, best, MIN_TREINO, STEP_BACKTEST
+    # Dobras walk-forward das séries com tendência linear calculadas num lote só
+    lr_lote_bt = [None] * len(tasks_bt)
+    if USAR_TENDENCIA_LINEAR_LOTE:
+        lr_lote_bt = previsoes_tendencia_linear(
+            [y_np for (_, _, _, y_np, _) in tasks_bt],
+            [
+                treinos_walk_forward(len(y_np), MIN_TREINO, STEP_BACKTEST)
+                if best in ("LinearRegression", "LinearRegression_Fallback") else []
+                for (_, _, _, y_np, best) in tasks_bt
+            ],
+            STEP_BACKTEST,
         )
-        for (cod_prod, regional, periodos_np, y_np, best) in tasks_bt
+
+    t1 = time.time()
+    results_bt = executar_paralelo(
+        _worker_backtest_serie,
+        [
+            (cod_prod, regional, periodos_np, y_np, best, MIN_TREINO, STEP_BACKTEST, lr_serie)
+            for (cod_prod, regional, periodos_np, y_np, best), lr_serie in zip(tasks_bt, lr_lote_bt)
+        ],
+        "backtest_01",
+        arquivo_perfil_maquina
     )
 
     mape_por_serie_final = {}
@@ -2145,9 +2416,15 @@ finally:
 # =========================
 # START
 # =========================
-df_vendas_krona = pd.read_parquet(pasta_staging_parquet / "df_vendas_krona.parquet")
+chaves_desagregacao = [
+    "EMPRESA","COD_CLIENTE","NOME_CLIENTE","COD_GRUPO_CLIENTE","DESC_GRUPO_E_CLIENTE",
+    "COD_PROD","DESC_PRODUTO","FAMILIA","LINHA","REGIONAL","REGIONAL_GESTOR"
+]
+
+meses_hist_desagregacao = 12
+
 print("🔄 Iniciando processo de desagregação (histórico + futuro)...")
-print(f"📦 df_vendas_krona em memória | Linhas: {len(df_vendas_krona):,}".replace(",", "."))
+df_dim_serie = ler_dimensao_estrela(pasta_staging_parquet, "DIM_SERIE", colunas=["ID_SERIE", "COD_PROD", "REGIONAL"])
 
 # =========================
 # LER FORECAST
@@ -2165,27 +2442,25 @@ df_forecast_estatistico_krona = pd.read_csv(
     dayfirst=True
 )
 
-df_forecast_estatistico_krona["PERIODO"] = pd.to_datetime(df_forecast_estatistico_krona["PERIODO"])
 df_forecast_estatistico_krona = df_forecast_estatistico_krona[df_forecast_estatistico_krona["PREVISAO_FINAL"].notna()].copy()
 
-df_vendas_krona["PERIODO"] = pd.to_datetime(df_vendas_krona["PERIODO"])
+# PERIODO do CSV vira MES_ID (só os textos distintos são convertidos)
+df_forecast_estatistico_krona["MES_ID"] = mes_id(df_forecast_estatistico_krona["PERIODO"])
 
 # Eliminar colunas desnecessárias no df_forecast_estatistico_krona
 df_forecast_estatistico_krona = df_forecast_estatistico_krona.drop(
-    columns=["MODELO_ESCOLHIDO", "PREVISAO_BACKTEST", "MODELO_BACKTEST", "APE", "MAPE_SKU", "VOL_VENDA_REAL"]
+    columns=["PERIODO", "MODELO_ESCOLHIDO", "PREVISAO_BACKTEST", "MODELO_BACKTEST", "APE", "MAPE_SKU", "VOL_VENDA_REAL"]
 )
 
-# Manter somente PERIODO conforme variável df_periodo_previsao
+# Manter somente os meses conforme variável df_periodo_previsao
 df_forecast_estatistico_krona = df_forecast_estatistico_krona[
-    df_forecast_estatistico_krona["PERIODO"].isin(
-        pd.to_datetime(df_periodo_previsao["PERIODO_PROJECAO"].unique())
-    )
+    df_forecast_estatistico_krona["MES_ID"].isin(meses_previsao)
 ].copy().reset_index(drop=True)
 
 n_combinacoes = df_forecast_estatistico_krona[["COD_PROD", "REGIONAL"]].drop_duplicates().shape[0]
-n_periodos = df_forecast_estatistico_krona["PERIODO"].nunique()
-p_min = df_forecast_estatistico_krona["PERIODO"].min()
-p_max = df_forecast_estatistico_krona["PERIODO"].max()
+n_periodos = df_forecast_estatistico_krona["MES_ID"].nunique()
+p_min = periodo_de_mes_id(df_forecast_estatistico_krona["MES_ID"].min())
+p_max = periodo_de_mes_id(df_forecast_estatistico_krona["MES_ID"].max())
 
 print(f"📊 Forecast carregado | Combinações: {n_combinacoes:,} | Períodos: {n_periodos}".replace(",", "."))
 print(f"🗓️ Horizonte de previsão | Meses: {n_periodos} | {p_min.date()} → {p_max.date()}")
@@ -2194,87 +2469,126 @@ print(f"🗓️ Horizonte de previsão | Meses: {n_periodos} | {p_min.date()} 
 # DEFINIR HISTÓRICO PARA DESAGREGAÇÃO DO FORECAST
 # =========================
 print("📦 Montando base df_prev_krona (histórico)...")
-meses_hist_desagregacao = 12
 
-# df_prev_krona deve ser cópia de df_vendas_krona, filtrando PERIODO pela variavel meses_hist_desagregacao, retornar os ultimos 12 que constam no arquivo df_vendas_krona
-periodos_disponiveis = sorted(df_vendas_krona["PERIODO"].unique())
-periodos_para_manter = periodos_disponiveis[-meses_hist_desagregacao:]
-df_prev_krona = df_vendas_krona[df_vendas_krona["PERIODO"].isin(periodos_para_manter)].copy().reset_index(drop=True)
+# df_prev_krona deve ser cópia de df_vendas_krona, filtrando PERIODO pela variavel meses_hist_desagregacao, retornar os ultimos 12 que constam no arquivo df_vendas_krona.
+# O percentual de cada cliente sai do grão das 11 chaves de texto do histórico (variações antigas de descrição / nome
+# continuam em linhas próprias e linhas com alguma chave nula ficam fora, como no groupby do pandas); por isso a base
+# vem do df_vendas_krona e não do FATO_VENDAS, que só guarda o texto mais recente de cada membro nas dimensões.
+# Só as partições dos últimos meses são lidas e a soma roda no DuckDB (FSUM = mesmo resultado do groupby().sum()).
+df_vendas_desagregacao = ler_dataset_staging(
+    pasta_staging_parquet,
+    "df_vendas_krona",
+    colunas=chaves_desagregacao + ["VOL_VENDA"],
+    arrow=True,
+    ultimos_meses=meses_hist_desagregacao
+)
+print(f"📦 df_vendas_krona (últimos {meses_hist_desagregacao} meses) | Linhas: {df_vendas_desagregacao.num_rows:,}".replace(",", "."))
 
-# Agrupar dados somando as VOL_VENDA
-chaves_desagregacao = [
-    "EMPRESA","COD_CLIENTE","NOME_CLIENTE","COD_GRUPO_CLIENTE","DESC_GRUPO_E_CLIENTE",
-    "COD_PROD","DESC_PRODUTO","FAMILIA","LINHA","REGIONAL","REGIONAL_GESTOR"
+chaves_sql = ", ".join(f'v."{c}"' for c in chaves_desagregacao)
+con = conectar_duckdb()
+try:
+    con.register("vendas", df_vendas_desagregacao)
+    con.register("dim_serie", df_dim_serie)
+    # Série (ID_SERIE) junta por inteiro com o forecast
+    df_prev_krona = con.execute(f"""
+        SELECT s.ID_SERIE, {chaves_sql}, FSUM(v.VOL_VENDA) AS VOL_VENDA
+        FROM vendas v
+        JOIN dim_serie s ON v.COD_PROD = s.COD_PROD AND v.REGIONAL = s.REGIONAL
+        WHERE {" AND ".join(f'v."{c}" IS NOT NULL' for c in chaves_desagregacao)}
+        GROUP BY ALL
+    """).df()
+finally:
+    con.close()
+del df_vendas_desagregacao
+
+# Forecast vem por COD_PROD + REGIONAL: traduz para ID_SERIE e junta por inteiro
+df_forecast_estatistico_krona = df_forecast_estatistico_krona.merge(
+    df_dim_serie,
+    on=["COD_PROD", "REGIONAL"],
+    how="inner"
+).drop(columns=["COD_PROD", "REGIONAL"])
+
+# Carregar df_dim_peso_unit_vendas
+df_dim_peso_unit_vendas = ler_dataset_staging(pasta_staging_parquet, "DIM_PRODUTOS_KRONA", colunas=["COD_PROD", "PESO_UNIT"])
+
+# Selecionar colunas finais e ordenar
+colunas_finais = [
+    "EMPRESA","COD_CLIENTE","NOME_CLIENTE","COD_GRUPO_CLIENTE", "DESC_GRUPO_E_CLIENTE","COD_PROD",
+    "DESC_PRODUTO","FAMILIA", "LINHA","REGIONAL","REGIONAL_GESTOR","PERIODO", "MES_ID", "VOL_PREV", "QTD_PREV"
 ]
 
-chaves_sem_periodo = chaves_desagregacao[:]
-df_prev_krona = df_prev_krona.groupby(
-    chaves_desagregacao,
-    as_index=False
-).agg({'VOL_VENDA': 'sum'}).reset_index(drop=True)
 
-print("🚀 Gerando percentuais de desagregação")
+def desagregar_forecast(df_prev_krona, df_forecast_estatistico_krona):
+    """Aplica o percentual de cada cliente no histórico da série à previsão da série (peso no fim)."""
+    # Criar coluna TOTAL_VOL_VENDA por série (COD_PROD e REGIONAL)
+    total_vol_venda_por_prod = df_prev_krona.groupby('ID_SERIE')['VOL_VENDA'].transform('sum')
+    df_prev_krona = df_prev_krona.assign(TOTAL_VOL_VENDA=total_vol_venda_por_prod)
 
-# Criar coluna TOTAL_VOL_VENDA por COD_PROD e REGIONAL
-total_vol_venda_por_prod = df_prev_krona.groupby(['COD_PROD', 'REGIONAL'])['VOL_VENDA'].transform('sum')
-df_prev_krona["TOTAL_VOL_VENDA"] = total_vol_venda_por_prod
+    # Criar coluna PERC_DESAGR
+    df_prev_krona["PERC_DESAGR"] = df_prev_krona["VOL_VENDA"] / df_prev_krona["TOTAL_VOL_VENDA"]
 
-# Criar coluna PERC_DESAGR
-df_prev_krona["PERC_DESAGR"] = df_prev_krona["VOL_VENDA"] / df_prev_krona["TOTAL_VOL_VENDA"]
+    df_prev_explodido = (
+        df_prev_krona
+        .merge(
+            df_forecast_estatistico_krona,
+            on="ID_SERIE",
+            how="inner"   # só explode onde existe forecast
+        )
+    )
 
-df_prev_explodido = (
-    df_prev_krona
-    .merge(
-        df_forecast_estatistico_krona,
-        on=["COD_PROD", "REGIONAL"],
-        how="inner"   # só explode onde existe forecast
+    df_prev_explodido["VOL_PREV"] = (
+        df_prev_explodido["PREVISAO_FINAL"] * df_prev_explodido["PERC_DESAGR"]
     )
-)
 
-print("🚀 Aplicando percentuais para desagregar o forecast estatístico...")
+    df_prev_krona = df_prev_explodido
+    del df_prev_explodido
 
-df_prev_explodido["VOL_PREV"] = (
-    df_prev_explodido["PREVISAO_FINAL"] * df_prev_explodido["PERC_DESAGR"]
-)
+    # Adicionar coluna PESO_UNITÁRIO
+    df_prev_krona = df_prev_krona.merge(
+        df_dim_peso_unit_vendas[["COD_PROD", "PESO_UNIT"]],
+        on=["COD_PROD"],
+        how="left"
+    )
 
-df_prev_krona = df_prev_explodido.copy()
+    # Criar coluna QTD_PREV
+    df_prev_krona["QTD_PREV"] = df_prev_krona["VOL_PREV"] / df_prev_krona["PESO_UNIT"]
 
-# Carregar df_dim_peso_unit_vendas
-df_dim_peso_unit_vendas = pd.read_parquet(pasta_staging_parquet / "DIM_PRODUTOS_KRONA.parquet")
+    # PERIODO (data) só para a exportação; o MES_ID segue no staging para os filtros e juntas seguintes
+    df_prev_krona["PERIODO"] = periodo_de_mes_id(df_prev_krona["MES_ID"])
 
-# Adicionar coluna PESO_UNITÁRIO
-df_prev_krona = df_prev_krona.merge(
-    df_dim_peso_unit_vendas[["COD_PROD", "PESO_UNIT"]],
-    on=["COD_PROD"],
-    how="left"
-)
+    return df_prev_krona[colunas_finais]
 
 
-# Criar coluna QTD_PREV
-df_prev_krona["QTD_PREV"] = df_prev_krona["VOL_PREV"] / df_prev_krona["PESO_UNIT"]
+print("🚀 Gerando percentuais de desagregação")
+print("🚀 Aplicando percentuais para desagregar o forecast estatístico...")
 
-# Selecionar colunas finais e ordenar
-colunas_finais = [
-    "EMPRESA","COD_CLIENTE","NOME_CLIENTE","COD_GRUPO_CLIENTE", "DESC_GRUPO_E_CLIENTE","COD_PROD",
-    "DESC_PRODUTO","FAMILIA", "LINHA","REGIONAL","REGIONAL_GESTOR","PERIODO", "VOL_PREV", "QTD_PREV"
-]
+if MODO_MEMORIA_LIMITADA:
+    # Memória limitada: lotes de COD_PROD (todas as séries de um produto ficam no mesmo lote)
+    partes = []
+    for lote_prod in lotes_de_valores(df_dim_serie["COD_PROD"].drop_duplicates().tolist(), PRODUTOS_POR_LOTE):
+        ids_lote = df_dim_serie.loc[df_dim_serie["COD_PROD"].isin(lote_prod), "ID_SERIE"]
+        partes.append(categorizar_colunas(desagregar_forecast(
+            df_prev_krona[df_prev_krona["ID_SERIE"].isin(ids_lote)],
+            df_forecast_estatistico_krona[df_forecast_estatistico_krona["ID_SERIE"].isin(ids_lote)]
+        )))
+    df_prev_krona = concatenar_categorias(partes)
+    del partes
+else:
+    df_prev_krona = desagregar_forecast(df_prev_krona, df_forecast_estatistico_krona)
 
-df_prev_krona = df_prev_krona[colunas_finais].copy()
+df_prev_krona = categorizar_colunas(
+    df_prev_krona.sort_values(chaves_desagregacao + ["MES_ID"]).reset_index(drop=True)
+)
 
 # FIXME
-del df_prev_explodido, df_forecast_estatistico_krona, df_vendas_krona, df_dim_peso_unit_vendas
+del df_forecast_estatistico_krona, df_dim_peso_unit_vendas, df_dim_serie
 gc.collect()
 
 print(f"✅ df_prev_krona pronto | Linhas: {len(df_prev_krona):,}".replace(",", "."))
 
 print("💾 Salvando df_prev_krona completo em Parquet...")
 
-df_prev_krona.to_parquet(
-    pasta_staging_parquet / "df_prev_krona.parquet",
-    engine="pyarrow",
-    compression="snappy",
-    index=False
-)
+salvar_dataset_staging(pasta_staging_parquet, "df_prev_krona", df_prev_krona)
 
 print("✅ Parquet salvo com sucesso: df_prev_krona.parquet")
 
@@ -2290,10 +2604,11 @@ gc.collect()
 print("🔄 Gerando arquivos Forecast para Painel S&OP...")
 
 # Ler df_prev_krona do Parquet
-df_prev_krona = pd.read_parquet(pasta_staging_parquet / "df_prev_krona.parquet")
+df_prev_krona = ler_dataset_staging(pasta_staging_parquet, "df_prev_krona")
+relatorio_memoria(df_prev_krona, "df_prev_krona")
 
 df_forecast_vendas_krona = df_prev_krona[
-    df_prev_krona["PERIODO"].isin(df_periodo_previsao["PERIODO_PROJECAO"])
+    df_prev_krona["MES_ID"].isin(meses_previsao)
 ].copy()
 
 # Se lista_clientes_plan_demanda estiver vazio → todos são PRODUTO
@@ -2326,20 +2641,22 @@ df_forecast_vendas_krona_PRODUTO.drop(columns=['COD_CLIENTE', 'NOME_CLIENTE', 'C
 
 # Sumarizar df_forecast_vendas_krona_PRODUTO por EMPRESA, COD_PROD, DESC_PRODUTO, FAMILIA, LINHA, REGIONAL, PERIODO
 df_forecast_vendas_krona_PRODUTO = df_forecast_vendas_krona_PRODUTO.groupby(
-    ['EMPRESA', 'COD_PROD', 'DESC_PRODUTO', 'FAMILIA', 'LINHA', 'REGIONAL', 'REGIONAL_GESTOR', 'PERIODO'],
-    as_index=False
+    ['EMPRESA', 'COD_PROD', 'DESC_PRODUTO', 'FAMILIA', 'LINHA', 'REGIONAL', 'REGIONAL_GESTOR', 'PERIODO', 'MES_ID'],
+    as_index=False,
+    observed=True
 ).agg({'VOL_PREV': 'sum'}).reset_index(drop=True)
 
 # Gerar arquivos em PARQUET
-df_forecast_vendas_krona_PRODUTO.to_parquet(pasta_staging_parquet / 'df_forecast_vendas_krona_PRODUTO.parquet', index=False)
-df_forecast_vendas_krona_CLIENTE.to_parquet(pasta_staging_parquet / 'df_forecast_vendas_krona_CLIENTE.parquet', index=False)
+salvar_dataset_staging(pasta_staging_parquet, 'df_forecast_vendas_krona_PRODUTO', df_forecast_vendas_krona_PRODUTO)
+salvar_dataset_staging(pasta_staging_parquet, 'df_forecast_vendas_krona_CLIENTE', df_forecast_vendas_krona_CLIENTE)
 
 # 📤 Exportação de Dados Forecast para Planejamento Colaborativo
 # 📊 Nível de agregação: REGIONAL_GESTOR, 'REGIONAL', 'FAMILIA', 'PERIODO'
 
 df_Forecast_PRODUTO = df_forecast_vendas_krona_PRODUTO.groupby(
     ['REGIONAL_GESTOR', 'REGIONAL', 'FAMILIA', 'PERIODO'],
-    as_index=False
+    as_index=False,
+    observed=True
 ).agg({'VOL_PREV': 'sum'}).reset_index(drop=True)
 
 df_Forecast_PRODUTO.to_csv(
@@ -2362,7 +2679,8 @@ print("✅ Arquivo FORECAST_KRONA_AGREGADO.csv gerado com sucesso!")
 
 df_Forecast_CLIENTE = df_forecast_vendas_krona_CLIENTE.groupby(
     ['REGIONAL_GESTOR', 'REGIONAL', 'COD_GRUPO_CLIENTE', 'DESC_GRUPO_E_CLIENTE', 'FAMILIA', 'PERIODO'],
-    as_index=False
+    as_index=False,
+    observed=True
 ).agg({'VOL_PREV': 'sum'}).reset_index(drop=True)
 
 df_Forecast_CLIENTE.to_csv(
@@ -2379,7 +2697,10 @@ print("✅ Arquivo FORECAST_KRONA_CLIENTE.csv gerado com sucesso!")
 del df_forecast_vendas_krona_PRODUTO, df_forecast_vendas_krona_CLIENTE, df_prev_krona
 gc.collect()
 
+fechar_staging()
+
 timer.finalizar()
+verificar_pico_rss("script 01")
 print("🎯 Processo concluído com sucesso!")
 
 
@@ -2,14 +2,8 @@
 # ============================================================
 # SETUP - Forecast Estatístico BI
 # ============================================================
-import os
-
-# Limita threads internas para evitar briga com joblib/Power BI
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
-os.environ["OPENBLAS_NUM_THREADS"] = "1"
-os.environ["NUMEXPR_NUM_THREADS"] = "1"
-
+# functions.py limita as threads internas (BLAS/OpenMP) antes do numpy/sklearn serem
+# importados, para evitar briga com joblib/Power BI: deve ser o primeiro import
 from functions import *
 
 import pandas as pd
@@ -21,7 +15,6 @@ import time
 
 from pathlib import Path
 from datetime import datetime
-from joblib import Parallel, delayed
 
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
@@ -53,36 +46,37 @@ except NameError:
     caminho_base = Path.cwd()
 
 pasta_input_parquet = caminho_base.parent / '01_INPUT_PIPELINE/01_BD_PARQUET'
-arquivo_input_regras_negocio = caminho_base.parent / '01_INPUT_PIPELINE/02_REGRAS_NEGOCIO/KRONA_REGRAS.xlsm'
-pasta_staging_parquet = caminho_base.parent / '02_STAGING_PARQUET'
-pasta_input_painel = caminho_base.parent / '03_INPUT_PAINEL'
+pasta_input_regras = caminho_base.parent / '01_INPUT_PIPELINE/02_REGRAS_NEGOCIO'
+# Planilha de regras da empresa planejada (PLANILHAS_REGRAS_EMPRESA no functions.py)
+arquivo_input_regras_negocio = arquivo_regras_empresa(pasta_input_regras, EMPRESA_PLANO)
+pasta_staging_raiz = caminho_base.parent / '02_STAGING_PARQUET'
+pasta_input_painel_raiz = caminho_base.parent / '03_INPUT_PAINEL'
+# Staging e saídas do painel da empresa planejada (EMPRESA=<NOME>/ com MODO_MULTIEMPRESA; a própria pasta sem ele)
+pasta_staging_parquet = pasta_empresa(pasta_staging_raiz, EMPRESA_PLANO)
+pasta_input_painel = pasta_empresa(pasta_input_painel_raiz, EMPRESA_PLANO)
 pasta_painel = caminho_base.parent / '05_PAINEL'
 pasta_validacao_anna = caminho_base.parent / '06_VALIDACAO_ANNA'
 
 print("✅ Setup e mapeamento de pastas concluídos com sucesso!")
 
 # %%
-# Carregar dados arquivo KRONA_REGRAS
-caminho_arquivo = arquivo_input_regras_negocio
+# Carregar dados arquivo KRONA_REGRAS (cache CACHE_REGRAS compartilhado com o script 01)
+regras_negocio = carregar_regras_negocio(
+    arquivo_input_regras_negocio,
+    pasta_cache_regras(pasta_staging_raiz, EMPRESA_PLANO),
+    abas=['REGIONAIS_GESTOR', 'PERIODO_PREVISAO']
+)
 
 #-----------------------------------------------------------------------#
 #---------------Carregar Regionais Gestor ------------------------------#
 #-----------------------------------------------------------------------#
-guia_excel = 'REGIONAIS_GESTOR'
-df_regionais_gestor = pd.read_excel(caminho_arquivo, sheet_name=guia_excel, engine='calamine')
-df_regionais_gestor = df_regionais_gestor.drop_duplicates(subset=['REGIONAL', 'REGIONAL_GESTOR'])
-df_regionais_gestor = df_regionais_gestor[df_regionais_gestor['REGIONAL'].notna()].reset_index(drop=True)
+df_regionais_gestor = regras_negocio['REGIONAIS_GESTOR']
 
 #-----------------------------------------------------------------------#
 #---------------Carregar PERIODO_PREVISAO-------------------------------#
 #-----------------------------------------------------------------------#
-guia_excel = 'PERIODO_PREVISAO'
-df_periodo_previsao = pd.read_excel(caminho_arquivo, sheet_name=guia_excel, engine='calamine')
-df_periodo_previsao = df_periodo_previsao[df_periodo_previsao['PERIODO_PROJECAO'].notna()].reset_index(drop=True)
-df_periodo_previsao = df_periodo_previsao.drop_duplicates(subset=['PERIODO_PROJECAO'])
-
-# Classificar o df_periodo_previsao em ordem crescente de PERIODO_PROJECAO
-df_periodo_previsao = df_periodo_previsao.sort_values(by='PERIODO_PROJECAO').reset_index(drop=True)
+# Sem nulos/duplicados e em ordem crescente de PERIODO_PROJECAO
+df_periodo_previsao = regras_negocio['PERIODO_PREVISAO']
 
 print("✅ Importação e tratamento de dados do arquivo KRONA_REGRAS, concluídos com sucesso!")
 
@@ -91,38 +85,40 @@ print("✅ Importação e tratamento de dados do arquivo KRONA_REGRAS, concluíd
 # VALIDAÇÃO DAS FONTES MÍNIMAS DO FORECAST
 # ============================================================
 
-arquivo_vendas = pasta_staging_parquet / "df_vendas_krona.parquet"
+arquivo_vendas = caminho_dataset_staging(pasta_staging_parquet, "ESTRELA/FATO_VENDAS")
+arquivo_dim_serie_estrela = pasta_staging_parquet / "ESTRELA" / "DIM_SERIE.parquet"
 arquivo_dim_produtos = pasta_staging_parquet / "DIM_PRODUTOS_KRONA.parquet"
 arquivo_dim_produtos_origem = pasta_staging_parquet / "Dim_Produtos_Vendas_Krona.parquet"
 
-if not arquivo_vendas.exists():
-    raise FileNotFoundError(
-        f"Fonte obrigatória não encontrada: {arquivo_vendas}\n"
-        "Este notebook isolado espera que o tratamento de vendas já tenha gerado df_vendas_krona.parquet."
-    )
+for arquivo_estrela in [arquivo_vendas, arquivo_dim_serie_estrela]:
+    if not arquivo_estrela.exists():
+        raise FileNotFoundError(
+            f"Fonte obrigatória não encontrada: {arquivo_estrela}\n"
+            "Este notebook isolado espera que o tratamento de vendas já tenha gerado o modelo estrela (ESTRELA/FATO_VENDAS e ESTRELA/DIM_SERIE)."
+        )
+
+# Schema das fontes conferido agora (só o rodapé dos parquets), e não no meio do forecast
+validar_schema_staging(pasta_staging_parquet, "ESTRELA/FATO_VENDAS")
+validar_schema_staging(pasta_staging_parquet, "ESTRELA/DIM_SERIE")
 
 if not arquivo_dim_produtos.exists():
     if arquivo_dim_produtos_origem.exists():
         print("⚠️ DIM_PRODUTOS_KRONA.parquet não encontrada. Criando a partir de Dim_Produtos_Vendas_Krona.parquet...")
 
-        dim_produtos_origem = pd.read_parquet(arquivo_dim_produtos_origem)
-
-        colunas_necessarias = ["COD_PROD", "DESC_PROD", "PESO_UNIT", "FAMILIA", "LINHA"]
-        colunas_faltantes = [c for c in colunas_necessarias if c not in dim_produtos_origem.columns]
-
-        if colunas_faltantes:
-            raise ValueError(
-                "Não foi possível criar DIM_PRODUTOS_KRONA.parquet. "
-                f"Colunas faltantes em {arquivo_dim_produtos_origem.name}: {colunas_faltantes}"
-            )
+        # A origem alternativa precisa seguir o schema da DIM_PRODUTOS_KRONA no catálogo de staging
+        validar_schema_staging(pasta_staging_parquet, "DIM_PRODUTOS_KRONA", arquivo=arquivo_dim_produtos_origem)
 
         dim_produtos = (
-            dim_produtos_origem[colunas_necessarias]
+            pd.read_parquet(
+                arquivo_dim_produtos_origem,
+                columns=list(CATALOGO_STAGING["DIM_PRODUTOS_KRONA"]["colunas"])
+            )
             .drop_duplicates(subset=["COD_PROD"])
             .reset_index(drop=True)
         )
+        dim_produtos = aplicar_tipos_catalogo(dim_produtos, "DIM_PRODUTOS_KRONA")
 
-        dim_produtos.to_parquet(arquivo_dim_produtos, index=False)
+        salvar_dataset_staging(pasta_staging_parquet, "DIM_PRODUTOS_KRONA", dim_produtos)
         print(f"✅ DIM_PRODUTOS_KRONA.parquet criada | Linhas: {len(dim_produtos):,}")
     else:
         raise FileNotFoundError(
@@ -131,6 +127,7 @@ if not arquivo_dim_produtos.exists():
             "Gere/copiei a dimensão de produtos antes de rodar o forecast."
         )
 else:
+    validar_schema_staging(pasta_staging_parquet, "DIM_PRODUTOS_KRONA")
     print(f"✅ DIM_PRODUTOS_KRONA.parquet encontrada: {arquivo_dim_produtos}")
 
 # %%
@@ -145,7 +142,8 @@ else:
 # ============================================================
 # PARÂMETROS
 # ============================================================
-N_NUCLEOS = 8
+# Paralelismo (workers, batch_size, threads BLAS/DuckDB): perfil da máquina do functions.py
+arquivo_perfil_maquina = pasta_staging_raiz / "PERFIL_MAQUINA.json"
 PRINT_EVERY = 50
 METRICA_USADA = "WAPE"   # "WAPE" ou "MAPE"
 MIN_TREINO = 12
@@ -204,7 +202,10 @@ def pred_hw(y_train, steps):
             return np.maximum(m.forecast(steps), 0)
 
 
-def pred_lr(y_train, steps):
+def pred_lr(y_train, steps, lr_lote=None):
+    # lr_lote: previsões já calculadas em lote pelo tamanho do treino (USAR_TENDENCIA_LINEAR_LOTE)
+    if lr_lote is not None and len(y_train) in lr_lote:
+        return lr_lote[len(y_train)][:steps].copy()
     y_train = np.asarray(y_train, dtype=float)
     t = np.arange(len(y_train)).reshape(-1, 1)
     lr = LinearRegression().fit(t, y_train)
@@ -303,42 +304,11 @@ def limitar_forecast(fc, y, fator_media=3.0, fator_p75=2.0):
     return np.minimum(np.maximum(fc, 0), cap)
 
 
-def completar_calendario_mensal(df_hist_base, ultimo_mes_hist, coluna_valor):
-    df_hist_base = df_hist_base.copy()
-    df_hist_base["PERIODO"] = pd.to_datetime(df_hist_base["PERIODO"]).dt.to_period("M").dt.to_timestamp()
-
-    partes = []
-
-    for (cod_prod, regional), g in df_hist_base.groupby(["COD_PROD", "REGIONAL"], sort=False):
-        g = g.sort_values("PERIODO")
-
-        calendario = pd.date_range(
-            start=g["PERIODO"].min(),
-            end=ultimo_mes_hist,
-            freq="MS"
-        )
-
-        g2 = (
-            g.set_index("PERIODO")
-             .reindex(calendario)
-             .rename_axis("PERIODO")
-             .reset_index()
-        )
-
-        g2["COD_PROD"] = cod_prod
-        g2["REGIONAL"] = regional
-        g2[coluna_valor] = g2[coluna_valor].fillna(0)
-
-        partes.append(g2[["COD_PROD", "REGIONAL", "PERIODO", coluna_valor]])
-
-    return pd.concat(partes, ignore_index=True)
-
-
-def run_model(model_name, idx_train, y_train, idx_pred, steps):
+def run_model(model_name, idx_train, y_train, idx_pred, steps, lr_lote=None):
     if model_name == "HoltWinters":
         return pred_hw(y_train, steps)
     if model_name == "LinearRegression":
-        return pred_lr(y_train, steps)
+        return pred_lr(y_train, steps, lr_lote)
     if model_name == "RandomForest":
         return pred_rf(idx_train, y_train, idx_pred)
     if model_name == "GradientBoosting":
@@ -361,7 +331,7 @@ MODEL_ID_MAP = {m: i + 1 for i, m in enumerate(MODEL_ORDER)}
 # ============================================================
 # WORKERS
 # ============================================================
-def _worker_forecast_all_models(cod_prod, regional, periodos_np, y_np, future_dates_np, horizon):
+def _worker_forecast_all_models(cod_prod, regional, periodos_np, y_np, future_dates_np, horizon, lr_lote=None):
     idx_hist = pd.DatetimeIndex(periodos_np)
     y = y_np.astype(float)
     idx_future = pd.DatetimeIndex(future_dates_np)
@@ -376,7 +346,7 @@ def _worker_forecast_all_models(cod_prod, regional, periodos_np, y_np, future_da
                 fc = pred_intermitente(y, horizon)
                 model_exec = f"{model_name}_FallbackMedia12_Intermitente"
             else:
-                fc = run_model(model_name, idx_hist, y, idx_future, horizon)
+                fc = run_model(model_name, idx_hist, y, idx_future, horizon, lr_lote)
                 fc = limitar_forecast(fc, y)
                 model_exec = model_name
         except Exception:
@@ -394,7 +364,7 @@ def _worker_forecast_all_models(cod_prod, regional, periodos_np, y_np, future_da
     return rows, (cod_prod, regional)
 
 
-def _worker_metricas_all_models(cod_prod, regional, periodos_np, y_np, min_treino, step_backtest):
+def _worker_metricas_all_models(cod_prod, regional, periodos_np, y_np, min_treino, step_backtest, lr_lote=None):
     idx = pd.DatetimeIndex(periodos_np)
     y = y_np.astype(float)
 
@@ -420,7 +390,7 @@ def _worker_metricas_all_models(cod_prod, regional, periodos_np, y_np, min_trein
                     y_preds = pred_intermitente(y_train, steps)
                     model_exec = f"{model_name}_FallbackMedia12_Intermitente"
                 else:
-                    y_preds = run_model(model_name, idx_train, y_train, idx_pred, steps)
+                    y_preds = run_model(model_name, idx_train, y_train, idx_pred, steps, lr_lote)
                     y_preds = limitar_forecast(y_preds, y_train)
                     model_exec = model_name
             except Exception:
@@ -459,13 +429,16 @@ def _worker_metricas_all_models(cod_prod, regional, periodos_np, y_np, min_trein
 # UTILITÁRIOS DE DIMENSÃO/CHAVE
 # ============================================================
 def construir_dim_serie(df_group):
+    # Usa o ID_SERIE conformado do modelo estrela quando a base já traz a chave
+    colunas = ["COD_PROD", "REGIONAL"] + (["ID_SERIE"] if "ID_SERIE" in df_group.columns else [])
     dim_serie = (
-        df_group[["COD_PROD", "REGIONAL"]]
+        df_group[colunas]
         .drop_duplicates()
         .sort_values(["COD_PROD", "REGIONAL"])
         .reset_index(drop=True)
     )
-    dim_serie["ID_SERIE"] = np.arange(1, len(dim_serie) + 1, dtype=np.int64)
+    if "ID_SERIE" not in dim_serie.columns:
+        dim_serie["ID_SERIE"] = np.arange(1, len(dim_serie) + 1, dtype=np.int64)
     return dim_serie[["ID_SERIE", "COD_PROD", "REGIONAL"]]
 
 
@@ -488,13 +461,13 @@ def safe_divide(series_num, series_den):
 # ============================================================
 # PÓS-PROCESSAMENTO BI
 # ============================================================
-def enriquecer_dim_serie(out_dir):
+def enriquecer_dim_serie(pasta_staging):
     print("🧩 Enriquecendo DIM_SERIE...")
 
-    dim_serie = pd.read_parquet(out_dir / "DIM_SERIE.parquet")
+    dim_serie = ler_dataset_staging(pasta_staging, "FORECAST_BI/DIM_SERIE")
     dim_serie = dim_serie.merge(df_regionais_gestor, on="REGIONAL", how="left")
 
-    dim_produtos = pd.read_parquet(pasta_staging_parquet / "DIM_PRODUTOS_KRONA.parquet")
+    dim_produtos = ler_dataset_staging(pasta_staging, "DIM_PRODUTOS_KRONA")
     dim_serie = dim_serie.merge(dim_produtos, on="COD_PROD", how="left")
 
     colunas_ordenadas = [
@@ -509,28 +482,29 @@ def enriquecer_dim_serie(out_dir):
     ]
     dim_serie = dim_serie[colunas_ordenadas]
 
-    dim_serie.to_parquet(out_dir / "DIM_SERIE_COMPLETA.parquet", index=False)
+    salvar_dataset_staging(pasta_staging, "FORECAST_BI/DIM_SERIE_COMPLETA", dim_serie)
     print(f"✅ DIM_SERIE_COMPLETA salva | Linhas: {len(dim_serie):,}")
 
 
-def enriquecer_fatos_com_qtd(out_dir):
+def enriquecer_fatos_com_qtd(pasta_staging):
     print("📦 Enriquecendo fatos com PESO_UNIT e quantidade...")
 
-    fato_historico = pd.read_parquet(out_dir / "FATO_HISTORICO.parquet")
-    fato_previsao_modelo = pd.read_parquet(out_dir / "FATO_PREVISAO_MODELO.parquet")
+    fato_historico = ler_dataset_staging(pasta_staging, "FORECAST_BI/FATO_HISTORICO")
+    fato_previsao_modelo = ler_dataset_staging(pasta_staging, "FORECAST_BI/FATO_PREVISAO_MODELO")
 
-    dim_serie_completa = pd.read_parquet(
-        out_dir / "DIM_SERIE_COMPLETA.parquet",
-        columns=["ID_SERIE", "PESO_UNIT"],
+    dim_serie_completa = ler_dataset_staging(
+        pasta_staging,
+        "FORECAST_BI/DIM_SERIE_COMPLETA",
+        colunas=["ID_SERIE", "PESO_UNIT"],
     )
 
     fato_historico = fato_historico.merge(dim_serie_completa, on="ID_SERIE", how="left")
     fato_historico["QTD_REAL"] = safe_divide(fato_historico["VOL_REAL"], fato_historico["PESO_UNIT"])
-    fato_historico.to_parquet(out_dir / "FATO_HISTORICO_COMPLETA.parquet", index=False)
+    salvar_dataset_staging(pasta_staging, "FORECAST_BI/FATO_HISTORICO_COMPLETA", fato_historico)
 
     fato_previsao_modelo = fato_previsao_modelo.merge(dim_serie_completa, on="ID_SERIE", how="left")
     fato_previsao_modelo["QTD_PREV"] = safe_divide(fato_previsao_modelo["VOL_PREV"], fato_previsao_modelo["PESO_UNIT"])
-    fato_previsao_modelo.to_parquet(out_dir / "FATO_PREVISAO_MODELO_COMPLETA.parquet", index=False)
+    salvar_dataset_staging(pasta_staging, "FORECAST_BI/FATO_PREVISAO_MODELO_COMPLETA", fato_previsao_modelo)
 
     print(f"✅ FATO_HISTORICO_COMPLETA salva | Linhas: {len(fato_historico):,}")
     print(f"✅ FATO_PREVISAO_MODELO_COMPLETA salva | Linhas: {len(fato_previsao_modelo):,}")
@@ -545,25 +519,8 @@ def main():
     # ============================================================
     # 0) CARGA
     # ============================================================
-    df_vendas_krona = pd.read_parquet(pasta_staging_parquet / "df_vendas_krona.parquet")
-    print(f"📦 df_vendas_krona carregado | Linhas: {len(df_vendas_krona):,}")
-
-    # ============================================================
-    # 1) AGRUPAMENTO BASE
     # ============================================================
-    df_group = (
-        df_vendas_krona
-        .groupby(["COD_PROD", "REGIONAL", "PERIODO"], as_index=False, sort=False)
-        .agg(VOL_REAL=("VOL_VENDA", "sum"))
-        .sort_values(["COD_PROD", "REGIONAL", "PERIODO"])
-        .reset_index(drop=True)
-    )
-
-    qtd_series = df_group[["COD_PROD", "REGIONAL"]].drop_duplicates().shape[0]
-    print(f"📊 Séries identificadas: {qtd_series:,}")
-
-    # ============================================================
-    # 2) CALENDÁRIO FUTURO (somente para recorte e previsão)
+    # 1) CALENDÁRIO FUTURO (somente para recorte e previsão)
     # ============================================================
     future_dates = pd.DatetimeIndex(
         df_periodo_previsao["PERIODO_PROJECAO"].drop_duplicates().sort_values()
@@ -574,13 +531,23 @@ def main():
     primeiro_mes_previsao = future_dates.min()
     ultimo_mes_hist = primeiro_mes_previsao - pd.offsets.MonthBegin(1)
 
-    df_hist_base = df_group[df_group["PERIODO"] <= ultimo_mes_hist].copy()
+    # ============================================================
+    # 2) SÉRIES BASE (painel de forecast da ingestão, memory-map; com
+    # USAR_PAINEL_FORECAST = False, DuckDB sobre o FATO_VENDAS do modelo
+    # estrela agregado por ID_SERIE + PERIODO). df_series_hist traz o
+    # ID_SERIE conformado; o calendário completo só traz COD_PROD/REGIONAL.
+    # Correção estatística: meses sem venda entram com zero. Sem isso, uma
+    # venda isolada pode virar série curta artificial e ser repetida no futuro.
+    # ============================================================
+    iniciar_perfil_sql(pasta_staging_raiz, "serie_forecast_02")
+    df_series_hist, df_hist_base, tasks = carregar_series_forecast(
+        pasta_staging_parquet, ultimo_mes_hist, coluna_valor="VOL_REAL"
+    )
+    resumo_perfil_sql("serie_forecast_02")
+
     if df_hist_base.empty:
         raise ValueError("Histórico vazio após corte pelo calendário futuro.")
-
-    # Correção estatística: completa meses sem venda com zero.
-    # Sem isso, uma venda isolada pode virar série curta artificial e ser repetida no futuro.
-    df_hist_base = completar_calendario_mensal(df_hist_base, ultimo_mes_hist, coluna_valor="VOL_REAL")
+    print(f"📊 Séries identificadas: {len(df_series_hist):,}")
 
     horizon = len(future_dates)
     print(
@@ -591,7 +558,7 @@ def main():
     # ============================================================
     # 3) DIMENSÕES
     # ============================================================
-    dim_serie = construir_dim_serie(df_hist_base)
+    dim_serie = construir_dim_serie(df_series_hist)
     dim_modelo = construir_dim_modelo()
 
     serie_map = dim_serie.set_index(["COD_PROD", "REGIONAL"])["ID_SERIE"].to_dict()
@@ -607,28 +574,34 @@ def main():
     # ============================================================
     # 5) PREVISÃO FUTURA - TODOS OS MODELOS
     # ============================================================
-    tasks = []
-    for (cod_prod, regional), df_serie in df_hist_base.groupby(["COD_PROD", "REGIONAL"], sort=False):
-        df_serie = df_serie.sort_values("PERIODO")
-        tasks.append((
-            cod_prod,
-            regional,
-            df_serie["PERIODO"].to_numpy(dtype="datetime64[ns]"),
-            df_serie["VOL_REAL"].to_numpy(dtype=float),
-        ))
-
+    # tasks: arrays de cada série como fatias do painel (sem cópia por série)
     total_series = len(tasks)
     future_dates_np = future_dates.to_numpy(dtype="datetime64[ns]")
 
+    # Tendência linear de todas as séries (histórico completo + dobras walk-forward das métricas) num lote só
+    lr_lote = [None] * total_series
+    if USAR_TENDENCIA_LINEAR_LOTE:
+        lr_lote = previsoes_tendencia_linear(
+            [y_np for (_, _, _, y_np) in tasks],
+            [
+                [len(y_np)] + (treinos_walk_forward(len(y_np), MIN_TREINO, STEP_BACKTEST) if CALCULAR_METRICAS else [])
+                for (_, _, _, y_np) in tasks
+            ],
+            max(horizon, STEP_BACKTEST),
+        )
+
     print(f"🚀 Gerando previsão futura para todos os modelos | Séries: {total_series:,}")
     t0 = time.time()
     rows_forecast = []
 
-    results = Parallel(n_jobs=N_NUCLEOS, backend="loky", batch_size="auto", verbose=0)(
-        delayed(_worker_forecast_all_models)(
-            cod_prod, regional, periodos_np, y_np, future_dates_np, horizon
-        )
-        for cod_prod, regional, periodos_np, y_np in tasks
+    results = executar_paralelo(
+        _worker_forecast_all_models,
+        [
+            (cod_prod, regional, periodos_np, y_np, future_dates_np, horizon, lr_serie)
+            for (cod_prod, regional, periodos_np, y_np), lr_serie in zip(tasks, lr_lote)
+        ],
+        "forecast_02",
+        arquivo_perfil_maquina
     )
 
     for i, (rows_local, key) in enumerate(results, start=1):
@@ -662,11 +635,14 @@ def main():
         t1 = time.time()
         rows_metricas = []
 
-        results_metricas = Parallel(n_jobs=N_NUCLEOS, backend="loky", batch_size="auto", verbose=0)(
-            delayed(_worker_metricas_all_models)(
-                cod_prod, regional, periodos_np, y_np, MIN_TREINO, STEP_BACKTEST
-            )
-            for cod_prod, regional, periodos_np, y_np in tasks
+        results_metricas = executar_paralelo(
+            _worker_metricas_all_models,
+            [
+                (cod_prod, regional, periodos_np, y_np, MIN_TREINO, STEP_BACKTEST, lr_serie)
+                for (cod_prod, regional, periodos_np, y_np), lr_serie in zip(tasks, lr_lote)
+            ],
+            "metricas_02",
+            arquivo_perfil_maquina
         )
 
         for i, (rows_local, key) in enumerate(results_metricas, start=1):
@@ -728,11 +704,11 @@ def main():
     out_dir = pasta_staging_parquet / "FORECAST_BI"
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    dim_serie.to_parquet(out_dir / "DIM_SERIE.parquet", index=False)
-    dim_modelo.to_parquet(out_dir / "DIM_MODELO.parquet", index=False)
-    fato_historico.to_parquet(out_dir / "FATO_HISTORICO.parquet", index=False)
-    fato_previsao_modelo.to_parquet(out_dir / "FATO_PREVISAO_MODELO.parquet", index=False)
-    fato_metricas_modelo.to_parquet(out_dir / "FATO_METRICAS_MODELO.parquet", index=False)
+    salvar_dataset_staging(pasta_staging_parquet, "FORECAST_BI/DIM_SERIE", dim_serie)
+    salvar_dataset_staging(pasta_staging_parquet, "FORECAST_BI/DIM_MODELO", dim_modelo)
+    salvar_dataset_staging(pasta_staging_parquet, "FORECAST_BI/FATO_HISTORICO", fato_historico)
+    salvar_dataset_staging(pasta_staging_parquet, "FORECAST_BI/FATO_PREVISAO_MODELO", fato_previsao_modelo)
+    salvar_dataset_staging(pasta_staging_parquet, "FORECAST_BI/FATO_METRICAS_MODELO", fato_metricas_modelo)
 
     print("✅ Parquets base salvos com sucesso:")
     print(f"   - {out_dir / 'DIM_SERIE.parquet'}")
@@ -744,8 +720,8 @@ def main():
     # ============================================================
     # 8) ENRIQUECIMENTOS PÓS-SALVAMENTO
     # ============================================================
-    enriquecer_dim_serie(out_dir)
-    enriquecer_fatos_com_qtd(out_dir)
+    enriquecer_dim_serie(pasta_staging_parquet)
+    enriquecer_fatos_com_qtd(pasta_staging_parquet)
 
     print("🏁 Processamento concluído.")
 
@@ -776,6 +752,15 @@ if __name__ == "__main__":
             pass
 
 # %%
+# Benchmark da política de gravação do staging (opcional): mede codec / row group / dicionário / ordenação
+# sobre os datasets já gerados, com as leituras que os scripts registraram (LEITURAS_STAGING.json),
+# e grava a escolhida de cada um para as próximas execuções
+if EXECUTAR_BENCHMARK_GRAVACAO:
+    benchmark_gravacao_staging(pasta_staging_parquet)
+
+# %%
+fechar_staging()
+
 timer.finalizar()
 print("🎯 Processo concluído com sucesso!")
 
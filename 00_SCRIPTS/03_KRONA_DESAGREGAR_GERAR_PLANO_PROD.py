@@ -71,7 +71,8 @@ df_plano_consenso_regional = (
     .copy()
 )
 
-df_plano_consenso_regional['PERIODO'] = pd.to_datetime(
+# Os planos juntam com a previsão pela chave inteira do mês (PERIODO nulo vira MES_ID <NA> e sai no groupby, como o NaT)
+df_plano_consenso_regional['MES_ID'] = mes_id(
     df_plano_consenso_regional['PERIODO']
 )
 
@@ -80,7 +81,7 @@ colunas_agrupamento_regional = [
     'REGIONAL_GESTOR',
     'REGIONAL',
     'FAMILIA',
-    'PERIODO',
+    'MES_ID',
     'CICLO'
 ]
 
@@ -116,10 +117,6 @@ if arquivo_plano_cliente.exists():
 
     if not df_plano_consenso_cliente.empty:
 
-        df_plano_consenso_cliente['PERIODO'] = pd.to_datetime(
-            df_plano_consenso_cliente['PERIODO']
-        )
-
         # Utilizar o mesmo ciclo e revisão selecionados no regional
         df_plano_consenso_cliente = (
             df_plano_consenso_cliente[
@@ -136,12 +133,16 @@ if arquivo_plano_cliente.exists():
         # para o ciclo/revisão atual
         if not df_plano_consenso_cliente.empty:
 
+            df_plano_consenso_cliente['MES_ID'] = mes_id(
+                df_plano_consenso_cliente['PERIODO']
+            )
+
             colunas_agrupamento_cliente = [
                 'COD_CLIENTE',
                 'REGIONAL_GESTOR',
                 'REGIONAL',
                 'FAMILIA',
-                'PERIODO',
+                'MES_ID',
                 'CICLO'
             ]
 
@@ -161,14 +162,11 @@ if arquivo_plano_cliente.exists():
 # -------------------------------------------------------------------------
 # PREVISÃO ESTATÍSTICA POR PRODUTO
 # -------------------------------------------------------------------------
+# PERIODO já vem como data (usado só na exportação) e MES_ID como chave do mês
 
-df_forecast_vendas_krona_PRODUTO = pd.read_parquet(
-    pasta_staging_parquet /
-    'df_forecast_vendas_krona_PRODUTO.parquet'
-)
-
-df_forecast_vendas_krona_PRODUTO['PERIODO'] = pd.to_datetime(
-    df_forecast_vendas_krona_PRODUTO['PERIODO']
+df_forecast_vendas_krona_PRODUTO = ler_dataset_staging(
+    pasta_staging_parquet,
+    'df_forecast_vendas_krona_PRODUTO'
 )
 
 # Criar identificador único para preservar exatamente a mesma linha
@@ -187,9 +185,10 @@ df_forecast_vendas_krona_PRODUTO['ID_LINHA_DESAG'] = (
 # ATUALIZAR DADOS DOS PRODUTOS
 # -------------------------------------------------------------------------
 
-df_dim_produtos = pd.read_parquet(
-    pasta_staging_parquet /
-    'DIM_PRODUTOS_KRONA.parquet'
+df_dim_produtos = ler_dataset_staging(
+    pasta_staging_parquet,
+    'DIM_PRODUTOS_KRONA',
+    colunas=['COD_PROD', 'DESC_PROD', 'FAMILIA', 'LINHA']
 )
 
 dim_idx = (
@@ -249,7 +248,7 @@ chaves_regional = [
     'REGIONAL_GESTOR',
     'REGIONAL',
     'FAMILIA',
-    'PERIODO'
+    'MES_ID'
 ]
 
 # Total estatístico dentro da regional, família e período
@@ -257,7 +256,8 @@ df_volume_desag_regional['TOTAL_REGIONAL'] = (
     df_volume_desag_regional
     .groupby(
         chaves_regional,
-        dropna=False
+        dropna=False,
+        observed=True
     )['VOL_PREV']
     .transform('sum')
 )
@@ -317,7 +317,7 @@ chaves_cliente = [
     'REGIONAL_GESTOR',
     'REGIONAL',
     'FAMILIA',
-    'PERIODO'
+    'MES_ID'
 ]
 
 # Criar colunas padrão
@@ -347,7 +347,8 @@ if existe_plano_cliente:
         df_volume_desag_cliente
         .groupby(
             chaves_cliente,
-            dropna=False
+            dropna=False,
+            observed=True
         )['VOL_PREV']
         .transform('sum')
     )
@@ -512,9 +513,10 @@ df_plano_final_krona['ORIGEM_DEMANDA'] = np.where(
 # CONVERTER VOLUME PARA PEÇAS
 # -------------------------------------------------------------------------
 
-df_dim_produtos = pd.read_parquet(
-    pasta_staging_parquet /
-    'DIM_PRODUTOS_KRONA.parquet'
+df_dim_produtos = ler_dataset_staging(
+    pasta_staging_parquet,
+    'DIM_PRODUTOS_KRONA',
+    colunas=['COD_PROD', 'PESO_UNIT']
 )
 
 df_plano_final_krona = pd.merge(
@@ -563,7 +565,7 @@ print("✅ Planos REGIONAL e CLIENTE unificados com sucesso!")
 # Agrupar valores VOL_CONSENSO_DESAGREGADO e QTD_CONSENSO por coluna
 colunas_grupo = ['COD_PROD', 'DESC_PRODUTO', 'FAMILIA', 'LINHA', 'PERIODO']
 colunas_valor = ['VOL_CONSENSO_DESAGREGADO', 'QTD_CONSENSO']
-df_plano_saida_gabriel = df_plano_final_krona.groupby(colunas_grupo, as_index=False)[colunas_valor].sum()
+df_plano_saida_gabriel = df_plano_final_krona.groupby(colunas_grupo, as_index=False, observed=True)[colunas_valor].sum()
 
 # Renomear colunas
 df_plano_saida_gabriel.rename(columns={'VOL_CONSENSO_DESAGREGADO': 'VOL_CONSENSO'}, inplace=True)
@@ -585,7 +587,7 @@ print(f"✅ 'plano_saida_gabriel_{ciclo_plano}.xlsx' gerado com sucesso!")
 # Gerar saída de novos produtos para arquivo do Gabriel 
 
 # Importar demanda de lancamentos salva e resolvida em parquet
-df_demanda_produtos_lancamento = pd.read_parquet(pasta_staging_parquet / 'df_demanda_produtos_lancamento.parquet')
+df_demanda_produtos_lancamento = ler_dataset_staging(pasta_staging_parquet, 'df_demanda_produtos_lancamento')
 
 # Apagar o arquivo antigo da pasta de staging caso exista, que tenha no nome plano_saida_gabriel_lancamentos_
 for arquivo in pasta_staging_parquet.glob(f'plano_saida_gabriel_lancamentos_*.xlsx'):
@@ -601,7 +603,7 @@ print(f"✅ 'plano_saida_gabriel_lancamentos_{ciclo_plano}.xlsx' gerado com suce
 # Gerar arquivo com estatístico e consenso solicitado pela Karol, porém unificando os dados em um unico arquivo
 colunas_grupo = ['COD_PROD', 'DESC_PRODUTO', 'FAMILIA', 'LINHA', 'REGIONAL', 'REGIONAL_GESTOR', 'PERIODO', 'CICLO']
 colunas_valor = ['QTD_CONSENSO', 'VOL_CONSENSO_DESAGREGADO', 'QTD_ESTATISTICO', 'VOL_ESTATISTICO']
-df_plan_estatistico_consenso = df_plano_final_krona.groupby(colunas_grupo, as_index=False)[colunas_valor].sum()
+df_plan_estatistico_consenso = df_plano_final_krona.groupby(colunas_grupo, as_index=False, observed=True)[colunas_valor].sum()
 
 # Renomerar colunas para o formato solicitado
 df_plan_estatistico_consenso.rename(columns={
@@ -622,6 +624,8 @@ df_plan_estatistico_consenso.to_excel(caminho_saida_excel_estatistico_consenso,
 print(f"✅ 'plano_saida_estatistico_consenso_{ciclo_plano}.xlsx' gerado com sucesso!")
 
 # %%
+fechar_staging()
+
 timer.finalizar()
 print("🎯 Processo concluído com sucesso!")
 
@@ -175,7 +175,8 @@ ultima_revisao = df_plano_consenso_regional.sort_values(by=['PERIODO', 'REVISAO'
 df_plano_consenso_regional = df_plano_consenso_regional[(df_plano_consenso_regional['CICLO'] == ultimo_ciclo) & (df_plano_consenso_regional['REVISAO'] == ultima_revisao)]
 
 # Criar coluna ID na primeira coluna do dataframe, concatenando as colunas REGIONAL, FAMILIA, PERIODO no formato MAR26, separando por traço
-df_plano_consenso_regional['ID'] = df_plano_consenso_regional['REGIONAL'] + '-' + df_plano_consenso_regional['FAMILIA'] + '-' + df_plano_consenso_regional['PERIODO'].dt.strftime('%b%y').str.upper()
+# (o rótulo do mês sai do MES_ID, formatando só os meses distintos)
+df_plano_consenso_regional['ID'] = df_plano_consenso_regional['REGIONAL'] + '-' + df_plano_consenso_regional['FAMILIA'] + '-' + rotulo_mes(mes_id(df_plano_consenso_regional['PERIODO']))
 
 # Reordenar as colunas para que a coluna ID seja a primeira
 cols = ['ID'] + [col for col in df_plano_consenso_regional.columns if col != 'ID']
@@ -227,7 +228,8 @@ else:
     df_plano_consenso_cliente = df_plano_consenso_cliente[(df_plano_consenso_cliente['CICLO'] == ultimo_ciclo) & (df_plano_consenso_cliente['REVISAO'] == ultima_revisao)]
     
     # Criar coluna ID na primeira coluna do dataframe, concatenando as colunas REGIONAL, FAMILIA, PERIODO no formato MAR26, separando por traço
-    df_plano_consenso_cliente['ID'] = df_plano_consenso_cliente['COD_GRP_CLIENTE'] + '-' + df_plano_consenso_cliente['REGIONAL'] + '-' + df_plano_consenso_cliente['FAMILIA'] + '-' + df_plano_consenso_cliente['PERIODO'].dt.strftime('%b%y').str.upper()
+    # (o rótulo do mês sai do MES_ID, formatando só os meses distintos)
+    df_plano_consenso_cliente['ID'] = df_plano_consenso_cliente['COD_GRP_CLIENTE'] + '-' + df_plano_consenso_cliente['REGIONAL'] + '-' + df_plano_consenso_cliente['FAMILIA'] + '-' + rotulo_mes(mes_id(df_plano_consenso_cliente['PERIODO']))
 
     # Reordenar as colunas para que a coluna ID seja a primeira
     cols = ['ID'] + [col for col in df_plano_consenso_cliente.columns if col != 'ID']
@@ -1,7 +1,31 @@
 import ctypes
+import sys
 import time
+import json
+import os
+
+# Pools nativos (BLAS / OpenMP) com 1 thread por padrão, definidos antes do numpy, sklearn e
+# statsmodels serem importados. O paralelismo fica com o joblib (perfil_maquina), e o
+# threadpoolctl ajusta os pools por etapa (executar_paralelo).
+for _variavel_threads in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"):
+    os.environ.setdefault(_variavel_threads, "1")
+
+import hashlib
+import platform
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
 import pandas as pd
 import numpy as np
+import duckdb
+import psutil
+from joblib import Parallel, delayed, parallel_config
+from threadpoolctl import threadpool_limits
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
 def exibir_msgbox(mensagem: str, titulo: str = "Mensagem", tipo: str = "info"):
     tipos = {
@@ -112,6 +136,3068 @@ def Dataframes_in_Memory(print_output: bool = True, as_df: bool = False):
 
     return pd.DataFrame(rows, columns=['NOME', 'MB']) if as_df else rows
 
+######################################################################################
+def fingerprint_arquivo(caminho, conteudo=False):
+    """
+    Assinatura de um arquivo, usada para detectar se uma fonte mudou desde a última execução.
+
+    Parâmetros:
+    - caminho: arquivo a ser verificado.
+    - conteudo: se False (padrão) usa apenas nome, tamanho e data de modificação (sem ler o arquivo).
+      Se True calcula também o hash do conteúdo, para arquivos pequenos que podem ser regravados
+      com o mesmo dado (ex.: dimensões e planilha de regras).
+    """
+    caminho = Path(caminho)
+    st = caminho.stat()
+    if not conteudo:
+        return {"arquivo": caminho.name, "tamanho": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    h = hashlib.sha1()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return {"arquivo": caminho.name, "tamanho": st.st_size, "sha1": h.hexdigest()}
+
+
+def ler_json(caminho, padrao=None):
+    caminho = Path(caminho)
+    if not caminho.exists():
+        return padrao
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def salvar_json(caminho, dados):
+    # Grava em arquivo temporário e troca no final, para nunca deixar um JSON pela metade
+    caminho = Path(caminho)
+    tmp = caminho.with_name(caminho.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(dados, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp, caminho)
+
+######################################################################################
+# PERFIL DA MÁQUINA (NÚCLEOS, MEMÓRIA, THREADS DUCKDB / BLAS, WORKERS JOBLIB)
+# Substitui o N_NUCLEOS editado à mão em cada script:
+# - núcleos e memória detectados com psutil (workers = núcleos físicos, limitados pela
+#   memória livre / MEMORIA_POR_WORKER_MB);
+# - DuckDB com threads = núcleos lógicos em toda conexão (conectar_duckdb);
+# - BLAS/OpenMP com 1 thread por worker (THREADS_BLAS_POR_ETAPA libera mais por etapa, e
+#   os workers são reduzidos na mesma proporção para não haver oversubscription);
+# - na primeira execução de cada etapa paralela na máquina, uma calibração curta (pool já
+#   aquecido e tarefas sorteadas ao longo da lista, que já entram no resultado) escolhe
+#   workers e batch_size, e o resultado fica em PERFIL_MAQUINA.json (por máquina) por
+#   DIAS_VALIDADE_CALIBRACAO dias.
+######################################################################################
+N_NUCLEOS_MANUAL = None             # None = automático | número = força a quantidade de workers
+MEMORIA_POR_WORKER_MB = 500         # memória estimada por worker do joblib (loky)
+THREADS_BLAS_POR_ETAPA = {}         # ex.: {"forecast_01": 2} (padrão 1 thread BLAS por worker)
+CALIBRAR_PARALELISMO = True         # False = usa o perfil detectado sem calibração
+RECALIBRAR_PARALELISMO = False      # True = ignora a calibração gravada nesta execução
+TAREFAS_CALIBRACAO_POR_WORKER = 4   # tamanho da amostra de cada candidato
+DIAS_VALIDADE_CALIBRACAO = 30       # depois disso a etapa é calibrada de novo
+SEGUNDOS_POR_LOTE_JOBLIB = 0.5      # alvo de duração de cada lote enviado a um worker
+
+_perfil_maquina = None
+
+
+def perfil_maquina():
+    """Núcleos, memória e paralelismo padrão desta máquina (detectado uma vez por execução)."""
+    global _perfil_maquina
+    if _perfil_maquina is None:
+        logicos = psutil.cpu_count(logical=True) or 1
+        fisicos = psutil.cpu_count(logical=False) or logicos
+        memoria = psutil.virtual_memory()
+        limite_memoria = max(1, int(memoria.available / 1024**2 // MEMORIA_POR_WORKER_MB))
+        _perfil_maquina = {
+            "maquina": platform.node(),
+            "nucleos_fisicos": fisicos,
+            "nucleos_logicos": logicos,
+            "memoria_total_mb": int(memoria.total / 1024**2),
+            "memoria_livre_mb": int(memoria.available / 1024**2),
+            "workers": N_NUCLEOS_MANUAL or max(1, min(fisicos, limite_memoria)),
+            "threads_duckdb": logicos,
+        }
+        print(
+            f"🖥️ Perfil da máquina | Núcleos: {fisicos} físicos / {logicos} lógicos | "
+            f"Memória: {_perfil_maquina['memoria_livre_mb']:,} MB livres de {_perfil_maquina['memoria_total_mb']:,} MB | "
+            f"Workers: {_perfil_maquina['workers']}"
+        )
+    return _perfil_maquina
+
+
+def _candidatos_workers(workers):
+    return sorted({max(1, workers // 2), workers, min(perfil_maquina()["nucleos_logicos"], workers * 2)})
+
+
+def _rodar_paralelo(funcao, tarefas, workers, batch_size, threads_blas):
+    if not tarefas:
+        return []
+    with threadpool_limits(limits=threads_blas), parallel_config(backend="loky", inner_max_num_threads=threads_blas):
+        return Parallel(n_jobs=workers, batch_size=batch_size, verbose=0)(delayed(funcao)(*t) for t in tarefas)
+
+
+def executar_paralelo(funcao, tarefas, etapa, arquivo_perfil=None):
+    """
+    Executa funcao(*tarefa) para cada tarefa no joblib (loky) com o paralelismo do perfil da máquina.
+    Retorna a lista de resultados na mesma ordem das tarefas (igual ao Parallel).
+
+    Parâmetros:
+    - funcao: worker (nível de módulo, para o loky conseguir serializar).
+    - tarefas: lista de tuplas de argumentos.
+    - etapa: nome da etapa (chave da calibração e de THREADS_BLAS_POR_ETAPA).
+    - arquivo_perfil: JSON onde a calibração é guardada por máquina (None = sem calibração).
+    """
+    perfil = perfil_maquina()
+    tarefas = list(tarefas)
+    threads_blas = THREADS_BLAS_POR_ETAPA.get(etapa, 1)
+    workers = max(1, min(perfil["workers"], perfil["nucleos_logicos"] // threads_blas))
+
+    calibracoes = ler_json(arquivo_perfil, {}) if arquivo_perfil else {}
+    assinatura = {k: perfil[k] for k in ("nucleos_fisicos", "nucleos_logicos", "memoria_total_mb")}
+    assinatura.update(workers=workers, threads_blas=threads_blas)
+    maquina = calibracoes.get(perfil["maquina"], {})
+    calibrada = maquina.get("etapas", {}).get(etapa) if maquina.get("assinatura") == assinatura else None
+    if calibrada and (datetime.now() - datetime.strptime(calibrada["calibrado_em"], "%Y-%m-%d %H:%M:%S")).days >= DIAS_VALIDADE_CALIBRACAO:
+        calibrada = None
+
+    candidatos = _candidatos_workers(workers)
+    # aquecimento (uma tarefa por worker do maior candidato) + fatia medida de cada candidato
+    amostra = max(candidatos) + sum(c * TAREFAS_CALIBRACAO_POR_WORKER for c in candidatos)
+    calibrar = (
+        arquivo_perfil is not None and CALIBRAR_PARALELISMO
+        and (calibrada is None or RECALIBRAR_PARALELISMO) and len(candidatos) > 1 and len(tarefas) > 2 * amostra
+    )
+
+    if not calibrar:
+        if calibrada:
+            workers, batch_size = calibrada["workers"], calibrada["batch_size"]
+        else:
+            batch_size = "auto"
+        print(f"⚙️ {etapa} | Workers: {workers} | batch_size: {batch_size} | Threads BLAS por worker: {threads_blas}")
+        return _rodar_paralelo(funcao, tarefas, workers, batch_size, threads_blas)
+
+    # Calibração: posições sorteadas (semente fixa) ao longo de toda a lista, para a amostra não ficar presa às
+    # primeiras tarefas da ordem de COD_PROD; os resultados são aproveitados na posição de cada tarefa
+    posicoes = np.random.default_rng(0).permutation(len(tarefas))
+    resultados = [None] * len(tarefas)
+
+    def _rodar_posicoes(fatia, n_workers, batch_size):
+        for posicao, resultado in zip(fatia, _rodar_paralelo(funcao, [tarefas[p] for p in fatia], n_workers, batch_size, threads_blas)):
+            resultados[posicao] = resultado
+
+    # Aquecimento fora da medida: spawn dos processos do loky e imports do worker no maior candidato. Os candidatos
+    # são medidos do maior para o menor, então o pool só encolhe e os processos já aquecidos são reaproveitados
+    inicio = max(candidatos)
+    _rodar_posicoes(posicoes[:inicio], inicio, 1)
+
+    medidas = {}
+    for candidato in sorted(candidatos, reverse=True):
+        fatia = posicoes[inicio:inicio + candidato * TAREFAS_CALIBRACAO_POR_WORKER]
+        t0 = time.time()
+        _rodar_posicoes(fatia, candidato, 1)
+        medidas[candidato] = (time.time() - t0) / len(fatia)
+        inicio += len(fatia)
+
+    workers = min(medidas, key=medidas.get)
+    # segundos por tarefa em um worker = tempo médio por tarefa x workers
+    segundos_tarefa = medidas[workers] * workers
+    batch_size = max(1, int(SEGUNDOS_POR_LOTE_JOBLIB / segundos_tarefa)) if segundos_tarefa > 0 else "auto"
+
+    calibracoes[perfil["maquina"]] = {
+        "assinatura": assinatura,
+        "etapas": {**(maquina.get("etapas", {}) if maquina.get("assinatura") == assinatura else {}),
+                   etapa: {"workers": workers, "batch_size": batch_size,
+                           "segundos_por_tarefa": round(segundos_tarefa, 4),
+                           "calibrado_em": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}},
+    }
+    salvar_json(arquivo_perfil, calibracoes)
+    print(
+        f"⚙️ {etapa} | Calibração: " + " | ".join(f"{c} workers: {medidas[c] * 1000:.1f} ms/tarefa" for c in sorted(medidas))
+        + f" → Workers: {workers} | batch_size: {batch_size}"
+    )
+
+    # Restante na ordem original da lista
+    _rodar_posicoes(np.sort(posicoes[inicio:]), workers, batch_size)
+    return resultados
+
+######################################################################################
+# MODO MEMÓRIA LIMITADA (ESTAÇÃO DO CLIENTE)
+# Com MODO_MEMORIA_LIMITADA = True:
+# - toda conexão DuckDB (conectar_duckdb) recebe memory_limit e uma pasta de spill
+#   (temp_directory): joins, agregações e ordenações grandes vão para o disco em vez de
+#   estourar a RAM;
+# - a separação dos produtos de lançamento roda no DuckDB em streaming (row groups),
+#   sem carregar o histórico inteiro em memória;
+# - as etapas pandas do script 01 (exportações colaborativas e desagregação) processam
+#   o histórico em lotes de meses (PERIODO) ou de produtos (COD_PROD).
+# O fato de vendas não tem lote próprio: espelho e ingestão ficam inteiros no DuckDB
+# (COPY direto do scan, sem passar pelo pandas), e o memory_limit + spill seguram o pico.
+# Meta: pico de RSS do processo principal do script 01 abaixo de META_PICO_RSS_MB na base
+# completa do cliente. O script imprime o pico no final (verificar_pico_rss);
+# tests/test_modo_memoria_limitada.py confere a mesma saída com o modo ligado/desligado e o pico
+# de um processo separado que roda o caminho do modo ligado na massa sintética.
+######################################################################################
+MODO_MEMORIA_LIMITADA = False          # True = estação do cliente (pouca RAM)
+LIMITE_MEMORIA_DUCKDB = "2GB"          # memory_limit de cada conexão DuckDB
+PASTA_TEMP_DUCKDB = Path(tempfile.gettempdir()) / "KRONA_DUCKDB_SPILL"
+MESES_POR_LOTE = 6                     # lote das etapas pandas por PERIODO
+PRODUTOS_POR_LOTE = 500                # lote das etapas pandas por COD_PROD
+META_PICO_RSS_MB = 3072                # meta de pico de RSS do script 01 com o modo ligado
+
+
+def conectar_duckdb(banco=":memory:"):
+    """Conexão DuckDB com as threads do perfil da máquina e os limites do modo memória limitada (quando ligado)."""
+    con = duckdb.connect(str(banco))
+    con.execute(f"SET threads = {perfil_maquina()['threads_duckdb']}")
+    if MODO_MEMORIA_LIMITADA:
+        PASTA_TEMP_DUCKDB.mkdir(parents=True, exist_ok=True)
+        con.execute(f"SET memory_limit = '{LIMITE_MEMORIA_DUCKDB}'")
+        con.execute(f"SET temp_directory = '{PASTA_TEMP_DUCKDB.as_posix()}'")
+    if PERFILAR_SQL_DUCKDB and _perfil_sql["pasta"] is not None:
+        return ConexaoPerfilada(con)
+    return con
+
+
+def pico_rss_mb():
+    """Pico de memória residente (RSS) do processo atual em MB (workers do joblib não entram)."""
+    info = psutil.Process().memory_info()
+    pico = getattr(info, "peak_wset", None)  # Windows
+    if pico is None:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            pico *= 1024  # Linux: KB | macOS: bytes
+    return pico / 1024**2
+
+
+def verificar_pico_rss(etapa, meta_mb=None):
+    """
+    Imprime o pico de RSS até aqui e compara com a meta (META_PICO_RSS_MB quando o modo memória
+    limitada está ligado). Retorna True quando está dentro da meta (ou sem meta).
+    """
+    meta_mb = meta_mb if meta_mb is not None else (META_PICO_RSS_MB if MODO_MEMORIA_LIMITADA else None)
+    pico = pico_rss_mb()
+    if meta_mb is None:
+        print(f"🧠 Pico de memória (RSS) | {etapa}: {pico:,.0f} MB")
+        return True
+    dentro = pico <= meta_mb
+    print(f"{'✅' if dentro else '⚠️'} Pico de memória (RSS) | {etapa}: {pico:,.0f} MB | Meta: {meta_mb:,.0f} MB")
+    return dentro
+
+
+def lotes_de_valores(valores, tamanho):
+    """Divide uma lista em lotes de até 'tamanho' itens (mantém a ordem)."""
+    valores = list(valores)
+    return [valores[i:i + tamanho] for i in range(0, len(valores), tamanho)]
+
+######################################################################################
+# PERFIL DAS CONSULTAS DUCKDB (EXPLAIN ANALYZE EM JSON)
+# Com PERFILAR_SQL_DUCKDB = True, depois de iniciar_perfil_sql(pasta_staging, etapa), toda
+# conexão aberta por conectar_duckdb grava o perfil JSON de cada comando (tempo e linhas por
+# operador, memória de buffer e spill em disco) em:
+#   <pasta_staging>/PERFIS_SQL/<AAAAMMDD_HHMMSS>/<seq>_<etapa>.json
+# resumo_perfil_sql(etapa) imprime os operadores mais pesados da etapa e grava o mesmo texto
+# em RESUMO_<etapa>.txt na pasta da execução.
+######################################################################################
+PERFILAR_SQL_DUCKDB = False        # True = grava o perfil de cada comando DuckDB
+PASTA_PERFIS_SQL = "PERFIS_SQL"
+TOP_OPERADORES_PERFIL = 8
+
+_perfil_sql = {"pasta": None, "etapa": "geral", "contador": 0}
+
+
+class ConexaoPerfilada:
+    """Conexão DuckDB que grava o perfil JSON de cada execute() em um arquivo próprio."""
+    def __init__(self, con):
+        self._con = con
+        con.execute("PRAGMA enable_profiling = 'json'")
+        con.execute("SET profiling_mode = 'detailed'")
+
+    def execute(self, sql, parametros=None):
+        _perfil_sql["contador"] += 1
+        arquivo = _perfil_sql["pasta"] / f"{_perfil_sql['contador']:04d}_{_perfil_sql['etapa']}.json"
+        self._con.execute(f"SET profiling_output = '{arquivo.as_posix()}'")
+        return self._con.execute(sql) if parametros is None else self._con.execute(sql, parametros)
+
+    def __getattr__(self, nome):
+        return getattr(self._con, nome)
+
+
+def iniciar_perfil_sql(pasta_staging, etapa):
+    """Define a etapa dos próximos comandos (e cria a pasta da execução na primeira chamada)."""
+    if not PERFILAR_SQL_DUCKDB:
+        return
+    if _perfil_sql["pasta"] is None:
+        pasta = Path(pasta_staging) / PASTA_PERFIS_SQL / datetime.now().strftime("%Y%m%d_%H%M%S")
+        pasta.mkdir(parents=True, exist_ok=True)
+        _perfil_sql["pasta"] = pasta
+    _perfil_sql["etapa"] = etapa
+
+
+def _operadores_perfil(no):
+    # Percorre a árvore de operadores do JSON de perfil
+    if no.get("operator_type"):
+        yield no
+    for filho in no.get("children", []):
+        yield from _operadores_perfil(filho)
+
+
+def resumo_perfil_sql(etapa, top=None):
+    """Resumo da etapa: latência total, pico de buffer/spill e os operadores mais demorados."""
+    if not PERFILAR_SQL_DUCKDB or _perfil_sql["pasta"] is None:
+        return
+
+    arquivos = sorted(_perfil_sql["pasta"].glob(f"*_{etapa}.json"))
+    latencia, pico_buffer, pico_spill, operadores = 0.0, 0, 0, []
+    for arquivo in arquivos:
+        perfil = ler_json(arquivo, {})
+        latencia += perfil.get("latency", 0.0)
+        pico_buffer = max(pico_buffer, perfil.get("system_peak_buffer_memory", 0))
+        pico_spill = max(pico_spill, perfil.get("system_peak_temp_dir_size", 0))
+        for op in _operadores_perfil(perfil):
+            operadores.append((op.get("operator_timing", 0.0), op.get("operator_name") or op["operator_type"],
+                               op.get("operator_cardinality", 0), arquivo.name))
+
+    linhas = [
+        f"📊 Perfil SQL | Etapa: {etapa} | Comandos: {len(arquivos)} | Latência: {latencia:,.2f} s | "
+        f"Pico buffer: {pico_buffer / 1024**2:,.0f} MB | Spill: {pico_spill / 1024**2:,.0f} MB"
+    ]
+    for pos, (tempo, nome, linhas_op, arquivo) in enumerate(sorted(operadores, reverse=True)[:top or TOP_OPERADORES_PERFIL], 1):
+        parcela = tempo / latencia * 100 if latencia else 0.0
+        linhas.append(f"   {pos}. {nome:<20} {tempo:8.3f} s ({parcela:4.1f}%) | Linhas: {linhas_op:,} | {arquivo}")
+
+    texto = "\n".join(linhas)
+    print(texto)
+    (_perfil_sql["pasta"] / f"RESUMO_{etapa}.txt").write_text(texto + "\n", encoding="utf-8")
+
+######################################################################################
+######################################################################################
+# INGESTÃO MULTIEMPRESA
+# Empresas do grupo planejadas a partir do mesmo Fato_Vendas_Krona: nome (filtro LIKE
+# em Nom_Empresa e Des_Origem) -> Cod_Empresa válidos. O espelho do fato é gerado em
+# streaming, uma partição por empresa (cada uma lida só com os Cod_Empresa dela).
+# Com MODO_MULTIEMPRESA = True o script 01 ingere todas as empresas do grupo e o
+# staging (silver/gold) e as saídas do painel de cada uma ficam em
+# <pasta>/EMPRESA=<NOME>/; cada script roda as etapas de forecast da EMPRESA_PLANO.
+# Com o modo desligado só a EMPRESA_PLANO é ingerida, na raiz das pastas (layout atual).
+# Regras de negócio por empresa: cada empresa do grupo tem a própria planilha de regras
+# (PLANILHAS_REGRAS_EMPRESA, na pasta 02_REGRAS_NEGOCIO) com produtos a eliminar, regionais,
+# regional gestor e clientes do plano de demanda, e o cache dela fica no staging da empresa.
+# Empresa sem planilha cadastrada interrompe a ingestão: as regras da Krona nunca são
+# aplicadas a outra empresa. O dataset DIM_PRODUTOS_KRONA mantém o nome em todas as
+# empresas (cada uma grava o seu na pasta EMPRESA=<NOME>/).
+######################################################################################
+MODO_MULTIEMPRESA = False
+EMPRESAS_GRUPO = {
+    "Krona": ["01", "05", "08", "0802", "10"],
+}
+PLANILHAS_REGRAS_EMPRESA = {
+    "Krona": "KRONA_REGRAS.xlsm",
+}
+EMPRESA_PLANO = "Krona"                  # empresa planejada nesta execução dos scripts
+COLUNA_PARTICAO_EMPRESA = "EMPRESA_PLANO"
+
+
+def chave_empresa(empresa):
+    """'Krona' -> 'KRONA' (valor da partição e dos filtros LIKE)."""
+    return empresa.strip().upper()
+
+
+def empresas_ingestao():
+    """
+    Empresas da ingestão: todo o grupo com MODO_MULTIEMPRESA, só a EMPRESA_PLANO sem ele.
+    Interrompe se alguma delas não tiver planilha de regras própria (PLANILHAS_REGRAS_EMPRESA).
+    """
+    empresas = dict(EMPRESAS_GRUPO) if MODO_MULTIEMPRESA else {EMPRESA_PLANO: EMPRESAS_GRUPO[EMPRESA_PLANO]}
+    sem_regras = [e for e in empresas if e not in PLANILHAS_REGRAS_EMPRESA]
+    if sem_regras:
+        raise ValueError(
+            f"❌ Empresas sem planilha de regras em PLANILHAS_REGRAS_EMPRESA: {sem_regras}. "
+            "Cadastre a planilha de cada empresa antes da ingestão (as regras da Krona não valem para outra empresa)."
+        )
+    return empresas
+
+
+def arquivo_regras_empresa(pasta_regras, empresa):
+    """Planilha de regras de negócio da empresa (PLANILHAS_REGRAS_EMPRESA) na pasta 02_REGRAS_NEGOCIO."""
+    if empresa not in PLANILHAS_REGRAS_EMPRESA:
+        raise ValueError(f"❌ Empresa {empresa} sem planilha de regras em PLANILHAS_REGRAS_EMPRESA.")
+    return Path(pasta_regras) / PLANILHAS_REGRAS_EMPRESA[empresa]
+
+
+def pasta_cache_regras(pasta_staging_raiz, empresa):
+    """Cache das abas da planilha de regras da empresa (<staging da empresa>/CACHE_REGRAS)."""
+    return pasta_empresa(pasta_staging_raiz, empresa) / PASTA_CACHE_REGRAS
+
+
+def pasta_empresa(pasta, empresa):
+    """Pasta da empresa: <pasta>/EMPRESA=<NOME>/ com MODO_MULTIEMPRESA, a própria pasta sem ele."""
+    if not MODO_MULTIEMPRESA:
+        return Path(pasta)
+    destino = Path(pasta) / f"EMPRESA={chave_empresa(empresa)}"
+    destino.mkdir(parents=True, exist_ok=True)
+    return destino
+
+
+def espelho_empresa(pasta_espelho, empresa):
+    """Partição da empresa no espelho do fato de vendas (None se a empresa não teve linhas)."""
+    arquivo = Path(pasta_espelho) / f"{COLUNA_PARTICAO_EMPRESA}={chave_empresa(empresa)}" / "data_0.parquet"
+    return arquivo if arquivo.exists() else None
+
+######################################################################################
+def sql_lista(valores):
+    """Formata uma lista Python como lista SQL: ['01','05'] -> '01','05' | [80,90] -> 80,90"""
+    return ",".join(f"'{v}'" if isinstance(v, str) else str(v) for v in valores)
+
+
+def atualizar_espelho_fato_vendas(arquivo_fato, pasta_espelho, empresas, cod_bloqueios, forcar=False):
+    """
+    Mantém um espelho tipado e pré-filtrado do Fato_Vendas na pasta de staging, separado por empresa.
+
+    O fato bruto chega com datas, quantidades e bloqueios em texto. O espelho guarda somente
+    as linhas das empresas / Cod_Empresa / Cod_Bloqueio usados no planejamento, já com:
+    - DATA_EMISSAO (DATE), QTD_VENDA e VOL_VENDA (DOUBLE), COD_BLOQUEIO (INTEGER)
+    - PERIODO pela data cota (dia 21 em diante pertence ao mês seguinte)
+    - ordenado por DATA_EMISSAO, para que o min/max dos row groups permita pular dados
+
+    Cada empresa é gravada em streaming direto da leitura da origem (sem tabela temporária em memória)
+    na própria partição (<pasta_espelho>/EMPRESA_PLANO=<NOME>/data_0.parquet, ver espelho_empresa).
+    O espelho só é regerado quando o arquivo de origem ou os filtros mudam (controle no JSON
+    ao lado da pasta).
+
+    Parâmetros:
+    - arquivo_fato: caminho do Fato_Vendas_Krona.parquet original.
+    - pasta_espelho: pasta do espelho na pasta de staging.
+    - empresas: dict {nome da empresa (filtro de Nom_Empresa e Des_Origem): lista de Cod_Empresa válidos}.
+    - cod_bloqueios: lista de Cod_Bloqueio válidos.
+    - forcar: se True, regera o espelho mesmo sem mudança na origem.
+
+    Retorna:
+    - dict com o controle gravado (fingerprint da origem, filtros e quantidade de linhas por empresa).
+    """
+    arquivo_fato = Path(arquivo_fato)
+    pasta_espelho = Path(pasta_espelho)
+    arquivo_controle = pasta_espelho.with_suffix(".json")
+
+    controle_novo = {
+        "origem": fingerprint_arquivo(arquivo_fato),
+        "empresas": {chave_empresa(e): list(cods) for e, cods in empresas.items()},
+        "cod_bloqueios": list(cod_bloqueios),
+    }
+
+    controle_atual = ler_json(arquivo_controle, {})
+    controle_comparar = {k: controle_atual.get(k) for k in controle_novo}
+
+    if not forcar and pasta_espelho.is_dir() and controle_comparar == controle_novo:
+        for nome, linhas in controle_atual.get("linhas", {}).items():
+            print(f"⏭️ Espelho do fato de vendas já atualizado | Empresa: {nome} | Linhas: {linhas:,}")
+        return controle_atual
+
+    data_emissao = """COALESCE(
+          TRY_CAST(Dat_Emissao_Venda AS DATE),
+          CAST(TRY_STRPTIME(TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)), '%Y-%m-%d') AS DATE),
+          CAST(TRY_STRPTIME(TRIM(CAST(Dat_Emissao_Venda AS VARCHAR)), '%d/%m/%Y') AS DATE)
+        )"""
+
+    def _sql_espelho(nome):
+        # Filtro da empresa como relação (Nom_Empresa / Des_Origem LIKE + Cod_Empresa válidos)
+        cods = controle_novo["empresas"][nome]
+        return f"""
+    WITH empresas AS (
+      SELECT * FROM (VALUES ('{nome}', [{sql_lista(cods)}])) t({COLUNA_PARTICAO_EMPRESA}, COD_EMPRESAS)
+    ),
+    base AS (
+      SELECT
+        e.{COLUNA_PARTICAO_EMPRESA},
+        f.Cod_Produto,
+        f.Chv_Cliente,
+        f.Chv_Vendedor,
+        f.Cod_Empresa,
+        TRIM(f.Nom_Empresa) AS EMPRESA,
+        {data_emissao} AS DATA_EMISSAO,
+        TRY_CAST(NULLIF(TRIM(f.Cod_Bloqueio), '') AS INTEGER) AS COD_BLOQUEIO,
+        TRY_CAST(f.Qtd_Venda AS DOUBLE) AS QTD_VENDA,
+        TRY_CAST(f.Qtd_Peso_Venda AS DOUBLE) AS VOL_VENDA
+      FROM parquet_scan('{arquivo_fato.as_posix()}') f
+      JOIN empresas e
+        ON  UPPER(TRIM(f.Nom_Empresa)) LIKE '%' || e.{COLUNA_PARTICAO_EMPRESA} || '%'
+        AND UPPER(TRIM(f.Des_Origem))  LIKE '%' || e.{COLUNA_PARTICAO_EMPRESA} || '%'
+        AND list_contains(e.COD_EMPRESAS, f.Cod_Empresa)
+      WHERE f.Cod_Empresa IN ({sql_lista(cods)})
+    )
+    SELECT
+      {COLUNA_PARTICAO_EMPRESA},
+      Cod_Produto,
+      Chv_Cliente,
+      Chv_Vendedor,
+      Cod_Empresa,
+      EMPRESA,
+      DATA_EMISSAO,
+      CASE
+        WHEN EXTRACT(DAY FROM DATA_EMISSAO) >= 21
+        THEN DATE_TRUNC('month', DATA_EMISSAO + INTERVAL 1 MONTH)
+        ELSE DATE_TRUNC('month', DATA_EMISSAO)
+      END AS PERIODO,
+      COD_BLOQUEIO,
+      QTD_VENDA,
+      VOL_VENDA
+    FROM base
+    WHERE COD_BLOQUEIO IN ({sql_lista(cod_bloqueios)})
+      AND DATA_EMISSAO IS NOT NULL
+    """
+
+    pasta_tmp = pasta_espelho.with_name(pasta_espelho.name + ".tmp")
+    shutil.rmtree(pasta_tmp, ignore_errors=True)
+    linhas = {}
+
+    con = conectar_duckdb()
+    try:
+        # Sem tabela temporária: um COPY em streaming por empresa, direto da leitura da origem (só as colunas
+        # usadas e os Cod_Empresa da empresa). O ORDER BY usa a ordenação externa do DuckDB, que transborda
+        # para o disco em vez de manter o fato na RAM, e o PARTITION_BY não manteria a ordem por DATA_EMISSAO
+        for nome in controle_novo["empresas"]:
+            particao = pasta_tmp / f"{COLUNA_PARTICAO_EMPRESA}={nome}"
+            particao.mkdir(parents=True)
+            linhas[nome] = int(con.execute(f"""
+            COPY (
+              SELECT * EXCLUDE ({COLUNA_PARTICAO_EMPRESA}) FROM ({_sql_espelho(nome)})
+              ORDER BY DATA_EMISSAO
+            ) TO '{(particao / "data_0.parquet").as_posix()}' (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 122880)
+            """).fetchone()[0])
+    finally:
+        con.close()
+
+    trocar_pasta(pasta_tmp, pasta_espelho)
+
+    # Layout antigo (arquivo único só da Krona)
+    arquivo_unico = pasta_espelho.with_name(pasta_espelho.name + ".parquet")
+    if arquivo_unico.exists():
+        arquivo_unico.unlink()
+
+    controle_novo["linhas"] = linhas
+    controle_novo["atualizado_em"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    salvar_json(arquivo_controle, controle_novo)
+
+    for nome, qtd in linhas.items():
+        print(f"✅ Espelho do fato de vendas regerado | Empresa: {nome} | Linhas: {qtd:,}")
+    return controle_novo
+
+######################################################################################
+def ultimo_periodo_fechado_data_cota(hoje=None):
+    """
+    Último mês completo pela data cota: a partir do dia 21 o mês corrente já está fechado,
+    antes disso o último mês fechado é o anterior. Qualquer PERIODO maior é mês aberto.
+    """
+    hoje = pd.Timestamp.today().normalize() if hoje is None else pd.Timestamp(hoje).normalize()
+
+    if hoje.day >= 21:
+        return hoje.to_period("M").to_timestamp()
+    return (hoje - pd.offsets.MonthBegin(1)).to_period("M").to_timestamp()
+
+######################################################################################
+# CHAVE INTEIRA DE MÊS (MES_ID)
+# O PERIODO era convertido com pd.to_datetime em cada etapa (lançamentos, calendário
+# do forecast, desagregação, planos) só para comparar/juntar meses. MES_ID é a chave
+# canônica do mês: quantidade de meses desde jan/1970 em int32 (jan/1970 = 0), gravada
+# no FATO_VENDAS e nas previsões de staging. Juntas, filtros de horizonte, reindex do
+# calendário e "mês - N" viram aritmética de inteiros; PERIODO (data) e o rótulo MMMAA
+# só são gerados na exportação.
+######################################################################################
+COLUNA_MES_ID = "MES_ID"
+
+
+def mes_id(valores):
+    """
+    PERIODO -> MES_ID. Aceita um valor (Timestamp, data, 'YYYY-MM' / 'YYYY-MM-DD'), que volta como int,
+    ou uma coluna/array, que volta como array int32. Colunas de texto são convertidas só nos valores
+    distintos; colunas datetime só mudam de unidade.
+    Nulos (None / NaN / NaT / texto vazio) numa coluna viram <NA>: o retorno passa a ser Int32 anulável
+    (groupby descarta, merge não casa, rotulo_mes / periodo_de_mes_id devolvem nulo). Valor único nulo é erro.
+    """
+    if isinstance(valores, (str, datetime, np.datetime64)):
+        if pd.isna(valores) or (isinstance(valores, str) and not valores.strip()):
+            raise ValueError("❌ mes_id: PERIODO nulo.")
+        return int(np.datetime64(pd.Timestamp(valores), "M").astype(np.int64))
+
+    datas = np.asarray(valores)
+    if datas.dtype.kind == "M":
+        nulos = np.isnat(datas)
+        ids = datas.astype("datetime64[M]").astype(np.int32)
+    else:
+        # factorize: nulos ficam com código -1 (não indexam o último mês distinto)
+        codigos, distintos = pd.factorize(datas)
+        distintos = pd.to_datetime(distintos).to_numpy().astype("datetime64[M]")
+        nulos = codigos < 0
+        if len(distintos):
+            nulos |= np.isnat(distintos)[np.maximum(codigos, 0)]
+            ids = distintos.astype(np.int32)[np.maximum(codigos, 0)]
+        else:
+            ids = np.zeros(len(codigos), dtype=np.int32)
+
+    if nulos.any():
+        return pd.arrays.IntegerArray(np.where(nulos, 0, ids).astype(np.int32), nulos)
+    return ids
+
+
+def _inteiros_mes_id(ids):
+    """MES_ID (array int ou Int32 anulável) -> (array int64, máscara de nulos ou None)."""
+    if isinstance(getattr(ids, "dtype", None), pd.api.extensions.ExtensionDtype) or np.asarray(ids).dtype == object:
+        ids = pd.array(ids, dtype="Int64")
+        return ids.to_numpy(dtype=np.int64, na_value=0), np.asarray(ids.isna())
+    return np.asarray(ids, dtype=np.int64), None
+
+
+def periodo_de_mes_id(ids):
+    """MES_ID -> primeiro dia do mês (pd.Timestamp para um valor, array datetime64[ns] para coluna; nulo -> NaT)."""
+    if np.ndim(ids) == 0:
+        return pd.NaT if pd.isna(ids) else pd.Timestamp(np.datetime64(int(ids), "M"))
+    valores, nulos = _inteiros_mes_id(ids)
+    datas = valores.astype("datetime64[M]").astype("datetime64[ns]")
+    if nulos is not None:
+        datas[nulos] = np.datetime64("NaT")
+    return datas
+
+
+def rotulo_mes(ids):
+    """MES_ID -> rótulo MMMAA em maiúsculas (ex.: MAR26, no locale ativo); formata só os meses distintos. Nulo -> NaN."""
+    valores, nulos = _inteiros_mes_id(ids)
+    distintos, posicoes = np.unique(valores, return_inverse=True)
+    rotulos = pd.DatetimeIndex(periodo_de_mes_id(distintos)).strftime("%b%y").str.upper().to_numpy(dtype=object)[posicoes]
+    if nulos is not None:
+        rotulos[nulos] = np.nan
+    return rotulos
+
+
+def sql_mes_id(coluna):
+    """Expressão DuckDB que gera o MES_ID a partir de uma coluna de data."""
+    return f"CAST(datediff('month', DATE '1970-01-01', CAST({coluna} AS DATE)) AS INTEGER)"
+
+
+def completar_calendario_mensal(df_hist_base, ultimo_mes_hist, coluna_valor="VOL_VENDA"):
+    """
+    Completa com zero os meses sem venda de todas as séries (COD_PROD, REGIONAL) de uma vez, do
+    primeiro mês de cada série até ultimo_mes_hist. A grade inteira é montada em MES_ID: cada série
+    ocupa um bloco contíguo de (ultimo - primeiro + 1) linhas e cada venda cai na posição
+    offset da série + (MES_ID - primeiro mês), sem groupby / reindex / concat por série.
+
+    Saída igual à do reindex por série: séries na ordem em que aparecem, meses em ordem crescente,
+    colunas COD_PROD, REGIONAL, PERIODO e coluna_valor; meses depois de ultimo_mes_hist ficam de fora.
+    """
+    chaves = ["COD_PROD", "REGIONAL"]
+    meses = (
+        df_hist_base[COLUNA_MES_ID].to_numpy(dtype=np.int64)
+        if COLUNA_MES_ID in df_hist_base.columns
+        else mes_id(df_hist_base["PERIODO"]).astype(np.int64)
+    )
+    ultimo_mes_id = mes_id(ultimo_mes_hist)
+
+    # Série de cada linha na ordem de aparição (linhas com chave nula ficam de fora, como no groupby)
+    serie = df_hist_base.groupby(chaves, sort=False, observed=True).ngroup().to_numpy()
+    validas = serie >= 0
+    serie, meses = serie[validas], meses[validas]
+    valores = df_hist_base[coluna_valor].to_numpy()[validas]
+    qtd_series = int(serie.max()) + 1 if len(serie) else 0
+
+    primeiro_mes = np.full(qtd_series, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(primeiro_mes, serie, meses)
+    tamanho = np.maximum(ultimo_mes_id - primeiro_mes + 1, 0)
+    offset = np.cumsum(tamanho) - tamanho
+    total = int(tamanho.sum())
+
+    no_calendario = meses <= ultimo_mes_id
+    posicao = offset[serie[no_calendario]] + (meses[no_calendario] - primeiro_mes[serie[no_calendario]])
+
+    # Como no reindex: meses que faltam viram NaN (inteiros sobem para float) e depois zero
+    tipo = valores.dtype if (len(posicao) == total or valores.dtype.kind in "fc") else np.float64
+    volume = np.zeros(total, dtype=tipo)
+    volume[posicao] = valores[no_calendario]
+    if volume.dtype.kind in "fc":
+        volume[np.isnan(volume)] = 0
+
+    serie_grade = np.repeat(np.arange(qtd_series), tamanho)
+    mes_grade = np.arange(total, dtype=np.int64) - np.repeat(offset, tamanho) + np.repeat(primeiro_mes, tamanho)
+
+    # Primeira linha de cada série dá o valor das chaves (devolvidas como valores simples, não categoria)
+    primeira_linha = np.flatnonzero(validas)[np.unique(serie, return_index=True)[1]]
+    df_completo = pd.DataFrame({
+        chave: pd.Series(
+            df_hist_base[chave].to_numpy(dtype=object)[primeira_linha][serie_grade], dtype=object
+        ).infer_objects()
+        for chave in chaves
+    })
+    df_completo["PERIODO"] = periodo_de_mes_id(mes_grade.astype(np.int32))
+    df_completo[coluna_valor] = volume
+    return df_completo
+
+
+def sql_assinatura_linhas(colunas):
+    """
+    Expressão SQL agregada (DuckDB) com a assinatura de um conjunto de linhas: quantidade de linhas |
+    soma dos hashes das linhas. Não depende da ordem e, por ser soma (e não XOR), linhas repetidas não
+    se cancelam aos pares. Usada por fingerprint_periodos_vendas e pelos snapshots de dimensões.
+    - colunas: o que entra no HASH de cada linha (ex.: 'Cod_Produto, QTD_VENDA' ou o alias da linha inteira).
+    """
+    return (
+        "CAST(COUNT(*) AS VARCHAR) || '|' || "
+        f"CAST(COALESCE(SUM(CAST(HASH({colunas}) AS HUGEINT)), 0) AS VARCHAR)"
+    )
+
+
+def fingerprint_periodos_vendas(arquivo_vendas, filtro_sql="TRUE"):
+    """
+    Calcula uma assinatura por PERIODO das linhas de venda (sql_assinatura_linhas: quantidade de linhas e
+    soma dos hashes das linhas). Mudou a assinatura de um mês, mudou algum dado daquele mês.
+
+    Retorna:
+    - dict {'AAAA-MM-DD': 'assinatura'}
+    """
+    sql = f"""
+    SELECT
+      CAST(PERIODO AS DATE) AS PERIODO,
+      {sql_assinatura_linhas("Cod_Produto, Chv_Cliente, Chv_Vendedor, EMPRESA, DATA_EMISSAO, QTD_VENDA, VOL_VENDA")} AS ASSINATURA
+    FROM parquet_scan('{Path(arquivo_vendas).as_posix()}')
+    WHERE {filtro_sql}
+    GROUP BY 1
+    ORDER BY 1
+    """
+    con = conectar_duckdb()
+    try:
+        linhas = con.execute(sql).fetchall()
+    finally:
+        con.close()
+
+    return {str(per): assinatura for per, assinatura in linhas}
+
+
+def planejar_carga_incremental(controle_anterior, fingerprints, dependencias, ultimo_fechado, forcar=False):
+    """
+    Decide o que precisa ser reprocessado na ingestão de vendas, comparando com a marca d'água
+    (high-water mark) gravada na última execução.
+
+    Recarga completa quando: não existe controle anterior, forcar=True, ou alguma dependência
+    (dimensões / regras) mudou. Caso contrário reprocessa apenas:
+    - meses novos ou com assinatura diferente da anterior;
+    - meses que estavam abertos na última execução (PERIODO > último fechado gravado).
+    Meses que sumiram da origem são removidos do histórico.
+
+    Retorna:
+    - dict com 'modo' ('COMPLETA' ou 'INCREMENTAL'), 'periodos' (lista 'AAAA-MM-DD' a reprocessar)
+      e 'remover' (lista de meses que devem sair do histórico).
+    """
+    if forcar or not controle_anterior:
+        return {"modo": "COMPLETA", "periodos": sorted(fingerprints), "remover": []}
+
+    if controle_anterior.get("dependencias") != dependencias:
+        return {"modo": "COMPLETA", "periodos": sorted(fingerprints), "remover": []}
+
+    fp_anterior = controle_anterior.get("fingerprint_periodos", {})
+    fechado_anterior = str(controle_anterior.get("ultimo_periodo_fechado", ""))
+
+    periodos = sorted(
+        per for per, fp in fingerprints.items()
+        if fp_anterior.get(per) != fp or per > fechado_anterior or per > str(ultimo_fechado.date())
+    )
+    remover = sorted(set(fp_anterior) - set(fingerprints))
+
+    return {"modo": "INCREMENTAL", "periodos": periodos, "remover": remover}
+
+
+def substituir_periodos_parquet(con, arquivo_historico, sql_lote, periodos, filtro_substituir=None, opcoes="FORMAT PARQUET",
+                                ordem=None):
+    """
+    Emenda um lote reprocessado no histórico em parquet: remove do histórico os PERIODOs
+    informados e acrescenta as linhas do lote, tudo dentro do DuckDB (sem pandas).
+
+    Parâmetros:
+    - con: conexão DuckDB onde as relações usadas pelo sql_lote estão registradas.
+    - arquivo_historico: parquet com o histórico completo (coluna PERIODO).
+    - sql_lote: SELECT que gera as linhas dos períodos reprocessados (mesmas colunas do histórico).
+    - periodos: lista de meses 'AAAA-MM-DD' que serão substituídos/removidos.
+    - filtro_substituir: condição SQL opcional sobre o histórico; as linhas que a atendem (em qualquer
+      mês) também são substituídas pelo lote (ex.: clientes com regional reatribuída).
+    - opcoes: opções do COPY (ver opcoes_copy_staging).
+    - ordem: colunas de ordenação do histórico regravado.
+    """
+    arquivo_historico = Path(arquivo_historico)
+    tmp = arquivo_historico.with_suffix(".tmp")
+    lista = ",".join(f"DATE '{p}'" for p in periodos)
+    condicoes = [f"CAST(PERIODO AS DATE) IN ({lista})"] if periodos else []
+    if filtro_substituir:
+        condicoes.append(f"COALESCE(({filtro_substituir}), FALSE)")
+
+    con.execute(f"""
+    COPY (
+      SELECT * FROM parquet_scan('{arquivo_historico.as_posix()}')
+      WHERE NOT ({" OR ".join(condicoes) or "FALSE"})
+      UNION ALL BY NAME
+      SELECT * FROM ({sql_lote})
+      {f"ORDER BY {sql_ordenacao(ordem)}" if ordem else ""}
+    ) TO '{tmp.as_posix()}' ({opcoes})
+    """)
+
+    os.replace(tmp, arquivo_historico)
+
+
+def atualizar_tabela_resolucao(con, arquivo_tabela, chaves, sql_tuplas, sql_resolucao, assinatura, nome_relacao):
+    """
+    Tabela de resolução (lookup) de uma regra de negócio avaliada uma única vez por combinação de chaves.
+    A tabela fica em parquet com a assinatura das regras/dimensões ao lado (<arquivo>.json):
+    - assinatura igual: só as combinações ainda não resolvidas passam pelo sql_resolucao e são acrescentadas;
+    - assinatura diferente (ou sem tabela): a tabela é refeita do zero com todas as combinações do lote.
+    No fim a tabela é carregada na conexão como nome_relacao, pronta para um único JOIN com o fato.
+
+    Parâmetros:
+    - con: conexão DuckDB com as relações usadas por sql_tuplas e sql_resolucao registradas.
+    - chaves: colunas da combinação (NULL casa com NULL).
+    - sql_tuplas: SELECT DISTINCT das chaves no lote a processar.
+    - sql_resolucao: SELECT sobre a relação 'tuplas_novas' que devolve as chaves + colunas resolvidas.
+    - assinatura: dict com as assinaturas das regras e dimensões que a resolução usa.
+    """
+    arquivo_tabela = Path(arquivo_tabela)
+    arquivo_assinatura = arquivo_tabela.with_suffix(".json")
+    atual = f"parquet_scan('{arquivo_tabela.as_posix()}')"
+    reaproveitar = arquivo_tabela.exists() and ler_json(arquivo_assinatura) == assinatura
+
+    if reaproveitar:
+        con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE tuplas_novas AS
+        SELECT t.* FROM ({sql_tuplas}) t
+        ANTI JOIN {atual} a ON {_juncao_nula(chaves, 't', 'a')}
+        """)
+    else:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE tuplas_novas AS {sql_tuplas}")
+    novas = con.execute("SELECT COUNT(*) FROM tuplas_novas").fetchone()[0]
+
+    if novas or not reaproveitar:
+        tmp = arquivo_tabela.with_suffix(".tmp")
+        anteriores = f"SELECT * FROM {atual} UNION ALL BY NAME " if reaproveitar else ""
+        con.execute(f"COPY ({anteriores}SELECT * FROM ({sql_resolucao})) TO '{tmp.as_posix()}' (FORMAT PARQUET)")
+        os.replace(tmp, arquivo_tabela)
+        salvar_json(arquivo_assinatura, assinatura)
+
+    con.execute("DROP TABLE tuplas_novas")
+    con.execute(f"CREATE OR REPLACE TEMP TABLE {nome_relacao} AS SELECT * FROM {atual}")
+    total = con.execute(f"SELECT COUNT(*) FROM {nome_relacao}").fetchone()[0]
+    situacao = "reaproveitada" if reaproveitar else "refeita"
+    print(f"🔎 Tabela {nome_relacao} {situacao} | Combinações: {total:,} | Resolvidas agora: {novas:,}")
+
+######################################################################################
+# SNAPSHOTS VERSIONADOS DAS DIMENSÕES E REGRAS DE REGIONAL
+# Uma mudança no segmento de um cliente, na Des_Regiao de um vendedor ou em uma linha
+# de DIRECIONA_CLIENTES_REGIONAL forçava a recarga completa do silver/gold. Cada
+# dimensão / aba que decide a REGIONAL é guardada como snapshot versionado
+# (<pasta_staging>/SNAPSHOTS_DIMENSOES/<NOME>/V0001.parquet ...), e a comparação entre
+# a versão refletida no gold e a atual devolve só as chaves novas, alteradas ou
+# removidas, para reprocessar apenas as vendas que dependem delas.
+######################################################################################
+PASTA_SNAPSHOTS_DIMENSOES = "SNAPSHOTS_DIMENSOES"
+VERSOES_SNAPSHOT_MANTER = 12     # versões mais recentes mantidas de cada snapshot
+
+
+def caminho_snapshot_dimensao(pasta_snapshots, nome, versao):
+    return Path(pasta_snapshots) / nome / f"V{int(versao):04d}.parquet"
+
+
+def atualizar_snapshot_dimensao(con, pasta_snapshots, nome, sql_dimensao):
+    """
+    Grava uma nova versão do snapshot quando o conteúdo da dimensão mudou (assinatura de
+    sql_assinatura_linhas, a mesma de fingerprint_periodos_vendas). O manifesto <NOME>.json ao lado
+    da pasta guarda as versões; só as VERSOES_SNAPSHOT_MANTER mais recentes ficam em disco.
+
+    Parâmetros:
+    - con: conexão DuckDB com as relações usadas por sql_dimensao registradas.
+    - pasta_snapshots: pasta dos snapshots (ex.: pasta_staging / PASTA_SNAPSHOTS_DIMENSOES).
+    - nome: nome do snapshot (ex.: 'CLIENTES').
+    - sql_dimensao: SELECT com as linhas tratadas da dimensão.
+
+    Retorna o número da versão atual.
+    """
+    pasta = Path(pasta_snapshots) / nome
+    pasta.mkdir(parents=True, exist_ok=True)
+    arquivo_manifesto = pasta.with_suffix(".json")
+    manifesto = ler_json(arquivo_manifesto, {"versoes": []})
+
+    con.execute(f"CREATE OR REPLACE TEMP TABLE snapshot_dimensao AS {sql_dimensao}")
+    linhas, assinatura = con.execute(
+        f"SELECT COUNT(*), {sql_assinatura_linhas('s')} FROM snapshot_dimensao s"
+    ).fetchone()
+
+    versoes = manifesto["versoes"]
+    if versoes and versoes[-1]["assinatura"] == assinatura:
+        con.execute("DROP TABLE snapshot_dimensao")
+        return versoes[-1]["versao"]
+
+    versao = versoes[-1]["versao"] + 1 if versoes else 1
+    arquivo = caminho_snapshot_dimensao(pasta_snapshots, nome, versao)
+    con.execute(f"COPY snapshot_dimensao TO '{arquivo.as_posix()}' (FORMAT PARQUET)")
+    con.execute("DROP TABLE snapshot_dimensao")
+
+    versoes.append({
+        "versao": versao,
+        "assinatura": assinatura,
+        "linhas": int(linhas),
+        "criado_em": time.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+    for antiga in versoes[:-VERSOES_SNAPSHOT_MANTER]:
+        caminho_snapshot_dimensao(pasta_snapshots, nome, antiga["versao"]).unlink(missing_ok=True)
+    manifesto["versoes"] = versoes[-VERSOES_SNAPSHOT_MANTER:]
+    salvar_json(arquivo_manifesto, manifesto)
+
+    print(f"🗂️ Snapshot {nome} versão {versao} gravado | Linhas: {linhas:,}")
+    return versao
+
+
+def comparar_snapshots_dimensao(con, pasta_snapshots, nome, chave, versao_anterior, versao_atual, nome_relacao):
+    """
+    Compara duas versões de um snapshot pela chave natural e carrega na conexão a relação nome_relacao
+    (CHAVE, SITUACAO) com as chaves NOVA, ALTERADA ou REMOVIDA. Chaves repetidas na dimensão são
+    comparadas pelo conjunto das suas linhas (sql_assinatura_linhas, linhas repetidas contam).
+
+    Retorna dict {SITUACAO: quantidade de chaves}.
+    """
+    if versao_anterior == versao_atual:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE {nome_relacao} AS SELECT NULL::VARCHAR AS CHAVE, NULL::VARCHAR AS SITUACAO WHERE FALSE")
+        return {}
+
+    def _por_chave(versao):
+        arquivo = caminho_snapshot_dimensao(pasta_snapshots, nome, versao).as_posix()
+        return f"""
+          SELECT "{chave}" AS CHAVE, {sql_assinatura_linhas("s")} AS ASSINATURA
+          FROM parquet_scan('{arquivo}') s
+          GROUP BY 1
+        """
+
+    con.execute(f"""
+    CREATE OR REPLACE TEMP TABLE {nome_relacao} AS
+    SELECT
+      COALESCE(b.CHAVE, a.CHAVE) AS CHAVE,
+      CASE WHEN a.ASSINATURA IS NULL THEN 'NOVA'
+           WHEN b.ASSINATURA IS NULL THEN 'REMOVIDA'
+           ELSE 'ALTERADA'
+      END AS SITUACAO
+    FROM ({_por_chave(versao_anterior)}) a
+    FULL JOIN ({_por_chave(versao_atual)}) b
+      ON a.CHAVE IS NOT DISTINCT FROM b.CHAVE
+    WHERE a.ASSINATURA IS DISTINCT FROM b.ASSINATURA
+    """)
+    return dict(con.execute(f"SELECT SITUACAO, COUNT(*) FROM {nome_relacao} GROUP BY 1").fetchall())
+
+######################################################################################
+# REGRAS DE NEGÓCIO (KRONA_REGRAS.xlsm) EM CACHE
+# A planilha é aberta uma única vez, todas as abas são lidas na mesma passada e
+# tratadas conforme REGRAS_NEGOCIO (tipo, obrigatórias, duplicidades, ordem).
+# O resultado fica em parquet (<pasta_staging>/CACHE_REGRAS) com a assinatura do
+# conteúdo de cada aba: se a planilha não mudou as abas vêm direto do cache, e se
+# mudou só as abas com conteúdo diferente são tratadas e regravadas.
+######################################################################################
+PASTA_CACHE_REGRAS = "CACHE_REGRAS"
+
+# texto: colunas lidas como str | datas: colunas convertidas para datetime
+# obrigatorias: linhas com nulo são descartadas | unicas: drop_duplicates | ordenar: sort_values
+REGRAS_NEGOCIO = {
+    "PRODUTOS_ELIMINAR": {"texto": ["COD_PROD"], "obrigatorias": ["COD_PROD"], "unicas": ["COD_PROD"]},
+    "REGIONAIS_GESTOR": {"obrigatorias": ["REGIONAL"], "unicas": ["REGIONAL", "REGIONAL_GESTOR"]},
+    "REGIONAIS_CONSTRUTORA": {"unicas": ["REGIONAL BASE", "REGIONAL ATUALIZADA"]},
+    "CLIENTES_DEMANDA": {
+        "texto": ["Cod_Grupo_Cliente"], "obrigatorias": ["Cod_Grupo_Cliente"], "unicas": ["Cod_Grupo_Cliente"]
+    },
+    "DIRECIONA_CLIENTES_REGIONAL": {"texto": ["COD_GRUPO_CLIENTE", "COD_CLIENTE"], "obrigatorias": ["COD_CLIENTE"]},
+    "PERIODO_PREVISAO": {
+        "datas": ["PERIODO_PROJECAO"], "obrigatorias": ["PERIODO_PROJECAO"],
+        "unicas": ["PERIODO_PROJECAO"], "ordenar": ["PERIODO_PROJECAO"]
+    },
+    "PRODUTOS_LANCAMENTOS": {"texto": ["COD"]},
+}
+
+
+def fingerprint_dataframe(df):
+    """Assinatura do conteúdo de um DataFrame (colunas + valores)."""
+    h = hashlib.sha1("|".join(f"{c}:{type(c).__name__}" for c in df.columns).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df.astype(object), index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def tratar_aba_regras(df, regra):
+    """Aplica o tratamento padrão de REGRAS_NEGOCIO em uma aba lida da planilha."""
+    df = df.copy()
+    for col in regra.get("texto", []):
+        df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    for col in regra.get("datas", []):
+        df[col] = pd.to_datetime(df[col])
+    if regra.get("obrigatorias"):
+        df = df[df[regra["obrigatorias"]].notna().all(axis=1)]
+    if regra.get("unicas"):
+        df = df.drop_duplicates(subset=regra["unicas"])
+    if regra.get("ordenar"):
+        df = df.sort_values(regra["ordenar"])
+    return df.reset_index(drop=True)
+
+
+def _salvar_aba_cache(df, arquivo):
+    """
+    Grava a aba tratada no cache. Nomes de coluna viram texto (o parquet exige) e colunas com tipos
+    misturados viram texto; devolve os nomes que eram datas para restaurar na leitura.
+    """
+    colunas_data = [str(c) for c in df.columns if isinstance(c, (pd.Timestamp, datetime))]
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    for col in df.columns[df.dtypes.eq(object)]:
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    df.to_parquet(arquivo, index=False)
+    return colunas_data
+
+
+def _ler_aba_cache(arquivo, colunas_data):
+    df = pd.read_parquet(arquivo)
+    if colunas_data:
+        df.columns = [pd.Timestamp(c) if c in colunas_data else c for c in df.columns]
+    return df
+
+
+def carregar_regras_negocio(arquivo_regras, pasta_cache, abas=None):
+    """
+    Carrega as abas da planilha de regras já tratadas, usando o cache em parquet sempre que possível.
+
+    Parâmetros:
+    - arquivo_regras: caminho do KRONA_REGRAS.xlsm.
+    - pasta_cache: pasta do cache (ex.: pasta_staging_parquet / PASTA_CACHE_REGRAS).
+    - abas: lista de abas (padrão: todas de REGRAS_NEGOCIO).
+
+    Retorna dict {aba: DataFrame}.
+    """
+    arquivo_regras = Path(arquivo_regras)
+    pasta_cache = Path(pasta_cache)
+    pasta_cache.mkdir(parents=True, exist_ok=True)
+    abas = list(abas or REGRAS_NEGOCIO)
+    arquivo_manifesto = pasta_cache / "MANIFESTO.json"
+
+    manifesto = ler_json(arquivo_manifesto, {"abas": {}})
+    fp_planilha = fingerprint_arquivo(arquivo_regras)
+
+    def _no_cache(aba):
+        return aba in manifesto["abas"] and (pasta_cache / f"{aba}.parquet").exists()
+
+    def _conferida(aba):
+        # aba já conferida com esta mesma versão do arquivo (tamanho + data de modificação)
+        return _no_cache(aba) and manifesto["abas"][aba]["planilha"] == fp_planilha
+
+    # Planilha igual à da última leitura: nem abre o Excel
+    if all(_conferida(aba) for aba in abas):
+        print(f"⚡ Regras de negócio carregadas do cache | Abas: {len(abas)}")
+        return {
+            aba: _ler_aba_cache(pasta_cache / f"{aba}.parquet", manifesto["abas"][aba]["colunas_data"])
+            for aba in abas
+        }
+
+    regras = {}
+    atualizadas = []
+    with pd.ExcelFile(arquivo_regras, engine="calamine") as planilha:
+        for aba in abas:
+            if _conferida(aba):
+                regras[aba] = _ler_aba_cache(pasta_cache / f"{aba}.parquet", manifesto["abas"][aba]["colunas_data"])
+                continue
+
+            regra = REGRAS_NEGOCIO.get(aba, {})
+            bruto = planilha.parse(aba, dtype={c: str for c in regra.get("texto", [])})
+            fp_aba = fingerprint_dataframe(bruto)
+            arquivo_aba = pasta_cache / f"{aba}.parquet"
+
+            if _no_cache(aba) and manifesto["abas"][aba]["fingerprint"] == fp_aba:
+                regras[aba] = _ler_aba_cache(arquivo_aba, manifesto["abas"][aba]["colunas_data"])
+                manifesto["abas"][aba]["planilha"] = fp_planilha
+                continue
+
+            regras[aba] = tratar_aba_regras(bruto, regra)
+            manifesto["abas"][aba] = {
+                "planilha": fp_planilha,
+                "fingerprint": fp_aba,
+                "colunas_data": _salvar_aba_cache(regras[aba], arquivo_aba),
+                "linhas": len(regras[aba]),
+            }
+            atualizadas.append(aba)
+
+    salvar_json(arquivo_manifesto, manifesto)
+
+    print(f"📘 Regras de negócio lidas da planilha | Abas: {len(abas)} | Atualizadas no cache: {atualizadas or 'nenhuma'}")
+    return regras
+
+######################################################################################
+# PREFLIGHT DAS ENTRADAS
+# Extração ruim ou atrasada em 01_BD_PARQUET (coluna faltando, mês sem venda,
+# Fato_Vendas_Krona antigo) só aparecia depois de minutos de DuckDB ou no meio do
+# forecast. O preflight lê apenas o rodapé (footer) dos parquets — schema, linhas e
+# min/max de Dat_Emissao_Venda por row group — e a lista de abas da planilha de regras,
+# e interrompe a execução com todos os problemas encontrados antes da ingestão.
+# Limite do rodapé: mês vazio só é detectado entre row groups (dentro da faixa min/max de
+# um row group ele fica presumido e o preflight avisa quais). Datas em texto DD/MM/YYYY
+# não têm min/max útil e leem a coluna inteira (LER_COLUNA_DATA_TEXTO_PREFLIGHT).
+######################################################################################
+USAR_PREFLIGHT = True
+ARQUIVO_PREFLIGHT = "PREFLIGHT_ENTRADAS.json"  # linhas da última execução aprovada (na pasta de staging raiz)
+QUEDA_MAX_LINHAS_PREFLIGHT = 0.2               # queda de linhas aceita em relação à última execução aprovada
+DIAS_TOLERANCIA_DATA_COTA = 4                  # dias que a última venda pode ficar antes do fim da cota do último mês fechado
+                                               # (dia 20 em fim de semana / feriado emendado não tem faturamento)
+LER_COLUNA_DATA_TEXTO_PREFLIGHT = True         # datas em texto DD/MM/YYYY: lê a coluna inteira como dicionário
+                                               # (fora do orçamento de 1 s do rodapé; False = não confere períodos/atualização)
+COLUNA_DATA_FATO = "Dat_Emissao_Venda"
+
+# Colunas obrigatórias de cada arquivo de 01_BD_PARQUET (as usadas na ingestão e na DIM_PRODUTOS)
+ENTRADAS_PREFLIGHT = {
+    "Fato_Vendas_Krona": [
+        "Cod_Produto", "Chv_Cliente", "Chv_Vendedor", COLUNA_DATA_FATO, "Nom_Empresa",
+        "Des_Origem", "Cod_Empresa", "Cod_Bloqueio", "Qtd_Venda", "Qtd_Peso_Venda"
+    ],
+    "Dim_Clientes_Krona": [
+        "Chv_Cliente", "Nom_Cliente", "Nom_Empresa", "Chv_Vendedor_Cliente", "Des_Segmento",
+        "Cod_Grupo_Cliente", "Des_Grupo_e_Cliente"
+    ],
+    "Dim_Produtos_Vendas_Krona": [
+        "Cod_Produto", "Des_Produto", "Num_Peso", "Cod_Familia", "Des_Familia", "Cod_Linha", "Des_Linha", "Nom_Empresa"
+    ],
+    "Dim_Vendedores_Krona": ["Chv_Vendedor", "Des_Regiao"],
+}
+
+
+def _data_estatistica(valor):
+    """
+    Min/max de um row group -> Timestamp (ou None). Texto só é aceito em ISO (YYYY-MM-DD),
+    único formato em que a ordem do texto (usada nas estatísticas) é a ordem das datas.
+    """
+    if valor is None:
+        return None
+    if isinstance(valor, (str, bytes)):
+        valor = valor.decode("utf-8") if isinstance(valor, bytes) else valor
+        data = pd.to_datetime(valor.strip(), format="%Y-%m-%d", errors="coerce")
+        return None if pd.isna(data) else data
+    return pd.Timestamp(valor)
+
+
+def _datas_distintas_parquet(arquivo, coluna):
+    """
+    Datas distintas de uma coluna de texto, lendo a coluna como dicionário (só os valores distintos
+    de cada row group são convertidos). Mesmos formatos aceitos na ingestão: YYYY-MM-DD e DD/MM/YYYY.
+    """
+    tabela = pq.ParquetFile(arquivo, read_dictionary=[coluna]).read(columns=[coluna])
+    textos = pa.chunked_array([parte.dictionary for parte in tabela.column(0).chunks], pa.string()).unique()
+    textos = pd.Series(textos.to_pandas(), dtype=object).str.strip()
+    datas = pd.to_datetime(textos, format="%Y-%m-%d", errors="coerce").fillna(
+        pd.to_datetime(textos, format="%d/%m/%Y", errors="coerce")
+    )
+    return pd.DatetimeIndex(datas.dropna().unique())
+
+
+def _periodos_cota(datas):
+    """MES_ID do PERIODO pela data cota (dia 21 em diante pertence ao mês seguinte)."""
+    datas = pd.DatetimeIndex(datas)
+    return np.unique(mes_id(datas) + (datas.day >= 21).astype(np.int32))
+
+
+def _periodos_datas_fato(arquivo, metadados, coluna):
+    """
+    Períodos (MES_ID pela data cota) cobertos pelo fato, a última data de emissão, a fonte das datas
+    e os períodos só presumidos (sem venda confirmada).
+
+    Com a coluna em DATE/TIMESTAMP (ou texto ISO) usa só o min/max dos row groups do rodapé: o período
+    do min e o do max de cada row group têm venda, os do meio são presumidos. Mês vazio dentro da faixa
+    de um row group não aparece no rodapé, só entre row groups. Com datas em texto DD/MM/YYYY as
+    estatísticas não seguem a ordem das datas e a coluna inteira é lida como dicionário (valores
+    distintos, sem presumidos), se LER_COLUNA_DATA_TEXTO_PREFLIGHT; sem isso volta (None, None, fonte, None).
+    """
+    indice = metadados.schema.to_arrow_schema().get_field_index(coluna)
+    faixas = []
+    for i in range(metadados.num_row_groups):
+        grupo = metadados.row_group(i)
+        if grupo.num_rows == 0:
+            continue
+        estatisticas = grupo.column(indice).statistics
+        if estatisticas is None or not estatisticas.has_min_max:
+            faixas = None
+            break
+        faixa = (_data_estatistica(estatisticas.min), _data_estatistica(estatisticas.max))
+        if None in faixa:
+            faixas = None
+            break
+        faixas.append(faixa)
+
+    vazio = np.array([], dtype=np.int32)
+    if faixas is None:
+        if not LER_COLUNA_DATA_TEXTO_PREFLIGHT:
+            return None, None, "texto não ISO", None
+        datas = _datas_distintas_parquet(arquivo, coluna)
+        if datas.empty:
+            return vazio, None, "dicionário", vazio
+        return _periodos_cota(datas), datas.max(), "dicionário", vazio
+
+    if not faixas:
+        return vazio, None, "rodapé", vazio
+    limites = np.array([[_periodos_cota([inicio])[0], _periodos_cota([fim])[0]] for inicio, fim in faixas], dtype=np.int32)
+    periodos = np.unique(np.concatenate([np.arange(a, b + 1, dtype=np.int32) for a, b in limites]))
+    presumidos = np.setdiff1d(periodos, limites.ravel())
+    return periodos, max(fim for _, fim in faixas), "rodapé", presumidos
+
+
+def preflight_entradas(pasta_input_parquet, arquivo_regras, pasta_controle, hoje=None):
+    """
+    Confere as entradas do pipeline em menos de um segundo, antes de qualquer etapa pesada.
+
+    - Arquivos de ENTRADAS_PREFLIGHT: existência, colunas obrigatórias e quantidade de linhas (rodapé),
+      com queda máxima de QUEDA_MAX_LINHAS_PREFLIGHT em relação à última execução aprovada.
+    - Fato_Vendas_Krona: períodos sem venda entre o primeiro e o último, e última Dat_Emissao_Venda
+      cobrindo a cota do último mês fechado (dia 20), com DIAS_TOLERANCIA_DATA_COTA de folga.
+      Pelo rodapé, mês vazio dentro da faixa min/max de um row group não é detectado (ver _periodos_datas_fato);
+      datas em texto DD/MM/YYYY leem a coluna inteira, fora do orçamento de um segundo.
+    - Planilha de regras: todas as abas de REGRAS_NEGOCIO presentes (só a lista de abas é lida).
+
+    Parâmetros:
+    - pasta_input_parquet: pasta 01_BD_PARQUET.
+    - arquivo_regras: caminho do KRONA_REGRAS.xlsm.
+    - pasta_controle: pasta onde fica o ARQUIVO_PREFLIGHT (staging raiz).
+    - hoje: data de referência do último mês fechado (padrão: hoje).
+
+    Retorna o resumo gravado no ARQUIVO_PREFLIGHT. Levanta ValueError com todos os problemas encontrados.
+    """
+    inicio = time.perf_counter()
+    pasta_input_parquet = Path(pasta_input_parquet)
+    arquivo_controle = Path(pasta_controle) / ARQUIVO_PREFLIGHT
+    linhas_anteriores = ler_json(arquivo_controle, {}).get("linhas", {})
+    problemas = []
+    resumo = {"linhas": {}}
+
+    for nome, colunas in ENTRADAS_PREFLIGHT.items():
+        arquivo = pasta_input_parquet / f"{nome}.parquet"
+        if not arquivo.exists():
+            problemas.append(f"{arquivo.name}: arquivo não encontrado em {pasta_input_parquet}")
+            continue
+        try:
+            metadados = pq.read_metadata(arquivo)
+        except (OSError, pa.ArrowException) as erro:
+            problemas.append(f"{arquivo.name}: rodapé do parquet ilegível ({erro})")
+            continue
+
+        faltando = [c for c in colunas if c not in metadados.schema.names]
+        if faltando:
+            problemas.append(f"{arquivo.name}: colunas obrigatórias ausentes {faltando}")
+
+        linhas = metadados.num_rows
+        resumo["linhas"][nome] = linhas
+        anterior = linhas_anteriores.get(nome)
+        if linhas == 0:
+            problemas.append(f"{arquivo.name}: arquivo sem linhas")
+        elif anterior and linhas < anterior * (1 - QUEDA_MAX_LINHAS_PREFLIGHT):
+            problemas.append(
+                f"{arquivo.name}: {linhas:,} linhas contra {anterior:,} na última execução "
+                f"(queda acima de {QUEDA_MAX_LINHAS_PREFLIGHT:.0%})"
+            )
+
+        if nome != "Fato_Vendas_Krona" or COLUNA_DATA_FATO in faltando or linhas == 0:
+            continue
+
+        inicio_datas = time.perf_counter()
+        periodos, ultima_data, fonte, presumidos = _periodos_datas_fato(arquivo, metadados, COLUNA_DATA_FATO)
+        if periodos is None:
+            print(
+                f"⚠️ Preflight | {arquivo.name} | {COLUNA_DATA_FATO} em texto não ISO: períodos e atualização não conferidos "
+                "(LER_COLUNA_DATA_TEXTO_PREFLIGHT = False)"
+            )
+            continue
+        if ultima_data is None:
+            problemas.append(f"{arquivo.name}: nenhuma {COLUNA_DATA_FATO} válida")
+            continue
+
+        vazios = np.setdiff1d(np.arange(periodos[0], periodos[-1] + 1), periodos)
+        if vazios.size:
+            alcance = (
+                "detectados entre row groups pelo rodapé; mês vazio dentro de um row group não aparece"
+                if fonte == "rodapé" else "pelas datas distintas da coluna"
+            )
+            problemas.append(f"{arquivo.name}: períodos sem venda {list(rotulo_mes(vazios))} ({alcance})")
+        if presumidos.size:
+            print(
+                f"ℹ️ Preflight | {arquivo.name} | {presumidos.size} períodos só presumidos pela faixa min/max de um row group "
+                f"(mês vazio dentro do row group não é detectado pelo rodapé): {list(rotulo_mes(presumidos))}"
+            )
+
+        fim_cota = ultimo_periodo_fechado_data_cota(hoje) + pd.Timedelta(days=19)
+        if ultima_data < fim_cota - pd.Timedelta(days=DIAS_TOLERANCIA_DATA_COTA):
+            problemas.append(
+                f"{arquivo.name}: última {COLUNA_DATA_FATO} em {ultima_data:%d/%m/%Y}, "
+                f"a cota do último mês fechado vai até {fim_cota:%d/%m/%Y} (extração desatualizada)"
+            )
+        resumo["periodos"] = [str(periodo_de_mes_id(periodos[0]).date()), str(periodo_de_mes_id(periodos[-1]).date())]
+        resumo["ultima_data"] = str(ultima_data.date())
+        primeiro, ultimo = rotulo_mes(periodos[[0, -1]])
+        print(
+            f"🔎 Preflight | {arquivo.name} | Linhas: {linhas:,} | Períodos: {len(periodos)} ({primeiro} a {ultimo}) | "
+            f"Última venda: {ultima_data:%d/%m/%Y} | Datas pelo {fonte} ({(time.perf_counter() - inicio_datas) * 1000:,.0f} ms)"
+        )
+
+    try:
+        with pd.ExcelFile(arquivo_regras, engine="calamine") as planilha:
+            abas_faltando = [aba for aba in REGRAS_NEGOCIO if aba not in planilha.sheet_names]
+        if abas_faltando:
+            problemas.append(f"{Path(arquivo_regras).name}: abas ausentes {abas_faltando}")
+    except Exception as erro:
+        problemas.append(f"{Path(arquivo_regras).name}: planilha de regras não pôde ser aberta ({erro})")
+
+    duracao_ms = (time.perf_counter() - inicio) * 1000
+    if problemas:
+        raise ValueError(
+            f"❌ Preflight das entradas reprovado em {duracao_ms:.0f} ms:\n- " + "\n- ".join(problemas)
+        )
+
+    resumo["atualizado_em"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    arquivo_controle.parent.mkdir(parents=True, exist_ok=True)
+    salvar_json(arquivo_controle, resumo)
+    print(f"✅ Preflight das entradas aprovado em {duracao_ms:.0f} ms | Arquivos: {len(resumo['linhas'])}")
+    return resumo
+
+######################################################################################
+# COLUNAS DE TEXTO COMO CATEGORIA (DICIONÁRIO)
+# Os textos descritivos do histórico de vendas se repetem em todas as linhas.
+# Com USAR_CATEGORIAS_STAGING = True eles são lidos do parquet já como dicionário
+# (pyarrow read_dictionary -> pandas category) e continuam categóricos ao gravar,
+# então os groupby rodam sobre os códigos inteiros (usar observed=True).
+######################################################################################
+USAR_CATEGORIAS_STAGING = True
+COLUNAS_CATEGORICAS_STAGING = [
+    "EMPRESA", "NOME_CLIENTE", "COD_GRUPO_CLIENTE", "DESC_GRUPO_E_CLIENTE", "DESC_PRODUTO",
+    "FAMILIA", "LINHA", "REGIONAL", "REGIAO_CLIENTE", "REGIAO_MOVIMENTO", "REGIONAL_GESTOR"
+]
+# Datasets do histórico/previsão desagregada (as dimensões continuam com texto simples)
+DATASETS_CATEGORICOS_STAGING = [
+    "df_vendas_krona", "df_vendas_krona_gold", "df_vendas_krona_lancamento",
+    "df_prev_krona", "df_forecast_vendas_krona_PRODUTO", "df_forecast_vendas_krona_CLIENTE"
+]
+
+
+def colunas_dicionario_parquet(arquivo, colunas=None):
+    """Colunas categóricas existentes no parquet (e pedidas na leitura), para o read_dictionary do pyarrow."""
+    if not USAR_CATEGORIAS_STAGING or Path(arquivo).stem not in DATASETS_CATEGORICOS_STAGING:
+        return []
+    esquema = ds.dataset(arquivo, format="parquet").schema if Path(arquivo).is_dir() else pq.read_schema(arquivo)
+    nomes = esquema.names
+    return [c for c in COLUNAS_CATEGORICAS_STAGING if c in nomes and (colunas is None or c in colunas)]
+
+
+def categorizar_colunas(df, colunas=None):
+    """
+    Converte as colunas de texto repetitivo em category, com as categorias em ordem alfabética
+    (groupby/sort por código dão a mesma ordem que o texto).
+    """
+    if not USAR_CATEGORIAS_STAGING:
+        return df
+
+    for col in (colunas if colunas is not None else COLUNAS_CATEGORICAS_STAGING):
+        if col not in df.columns:
+            continue
+        serie = df[col]
+        if not isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = serie.astype("category")
+        if not serie.cat.categories.is_monotonic_increasing:
+            serie = serie.cat.reorder_categories(serie.cat.categories.sort_values())
+        df[col] = serie
+    return df
+
+
+def concatenar_categorias(partes):
+    """
+    Concatena lotes (mesmas colunas) sem perder as colunas category: as categorias viram a
+    união em ordem alfabética, então os textos não passam por object no caminho.
+    """
+    partes = list(partes)
+    for col in [c for c in partes[0].columns if isinstance(partes[0][c].dtype, pd.CategoricalDtype)]:
+        categorias = pd.Index([]).append([p[col].cat.categories for p in partes]).unique().sort_values()
+        for parte in partes:
+            parte[col] = parte[col].cat.set_categories(categorias)
+    return pd.concat(partes, ignore_index=True)
+
+
+def relatorio_memoria(df, nome):
+    """Imprime a memória do DataFrame (deep) e quanto ocuparia com as categorias como strings objeto."""
+    atual = df.memory_usage(deep=True, index=False).sum()
+    como_objeto = atual
+    for col in df.columns:
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            # tamanho de cada categoria; o último item (código -1) é o NaN
+            tamanhos = np.array([sys.getsizeof(c) for c in serie.cat.categories] + [sys.getsizeof(np.nan)])
+            objeto = 8 * len(serie) + tamanhos[serie.cat.codes.to_numpy()].sum()
+            como_objeto += objeto - serie.memory_usage(deep=True, index=False)
+
+    print(
+        f"🧠 {nome} | Linhas: {len(df):,} | Memória: {como_objeto / 1024**2:,.1f} MB (strings) "
+        f"→ {atual / 1024**2:,.1f} MB (categorias)"
+    )
+
+######################################################################################
+# HISTÓRICO PARTICIONADO POR MÊS (ANO_MES=YYYY-MM/)
+# Com PARTICIONAR_HISTORICO_VENDAS = True o histórico de vendas é gravado como
+# dataset particionado: <pasta_staging>/<nome>/ANO_MES=YYYY-MM/*.parquet.
+# As leituras (ler_dataset_staging) levam só as colunas pedidas e só as pastas
+# dos meses do filtro de período (periodo_inicio / periodo_fim / ultimos_meses).
+######################################################################################
+PARTICIONAR_HISTORICO_VENDAS = True
+COLUNA_PARTICAO_PERIODO = "ANO_MES"
+DATASETS_PARTICIONADOS_STAGING = ["df_vendas_krona", "ESTRELA/FATO_VENDAS"]
+# Contrato de staging: estes continuam gravados também como <nome>.parquet (arquivo único) ao lado da pasta
+# particionada, para quem lê o arquivo fora dos scripts (BI, planilhas, conferências manuais)
+DATASETS_ARQUIVO_UNICO_STAGING = ["df_vendas_krona"]
+
+
+def dataset_particionado(nome):
+    return PARTICIONAR_HISTORICO_VENDAS and nome in DATASETS_PARTICIONADOS_STAGING
+
+
+def manter_arquivo_unico(nome):
+    return nome in DATASETS_ARQUIVO_UNICO_STAGING
+
+
+def caminho_dataset_staging(pasta_staging, nome):
+    """Pasta do dataset particionado ou arquivo <nome>.parquet."""
+    if dataset_particionado(nome):
+        return Path(pasta_staging) / nome
+    return Path(pasta_staging) / f"{nome}.parquet"
+
+
+def mes_particao(periodo):
+    """Timestamp / data / 'YYYY-MM-DD' -> 'YYYY-MM' (valor da partição)."""
+    return pd.Timestamp(periodo).strftime("%Y-%m")
+
+
+def sql_filtro_particao(periodo_inicio=None, periodo_fim=None):
+    """Condição SQL sobre a coluna de partição (as pastas fora do intervalo nem são abertas)."""
+    condicoes = []
+    if periodo_inicio is not None:
+        condicoes.append(f"{COLUNA_PARTICAO_PERIODO} >= '{mes_particao(periodo_inicio)}'")
+    if periodo_fim is not None:
+        condicoes.append(f"{COLUNA_PARTICAO_PERIODO} <= '{mes_particao(periodo_fim)}'")
+    return " AND ".join(condicoes) if condicoes else None
+
+
+def sql_filtro_periodo(periodo_inicio=None, periodo_fim=None):
+    """Mesmo intervalo de meses da partição, aplicado sobre a coluna PERIODO (arquivo único / banco)."""
+    condicoes = []
+    if periodo_inicio is not None:
+        condicoes.append(f"PERIODO >= DATE '{mes_particao(periodo_inicio)}-01'")
+    if periodo_fim is not None:
+        fim = pd.Timestamp(periodo_fim).to_period("M") + 1
+        condicoes.append(f"PERIODO < DATE '{fim.strftime('%Y-%m')}-01'")
+    return " AND ".join(condicoes) if condicoes else None
+
+
+def sql_scan_dataset(caminho, filtro_particao=None):
+    """
+    Origem SQL (DuckDB) de um parquet único ou de uma pasta particionada.
+    Na pasta particionada a coluna ANO_MES só serve para podar as pastas e não entra no resultado.
+    """
+    caminho = Path(caminho)
+    if not caminho.is_dir():
+        return f"parquet_scan('{caminho.as_posix()}')"
+    where = f" WHERE {filtro_particao}" if filtro_particao else ""
+    return (
+        f"(SELECT * EXCLUDE ({COLUNA_PARTICAO_PERIODO}) "
+        f"FROM parquet_scan('{caminho.as_posix()}/*/*.parquet', hive_partitioning = true){where})"
+    )
+
+
+def periodos_dataset_particionado(caminho):
+    """Meses ('YYYY-MM') presentes no dataset particionado, em ordem, só pelos nomes das pastas."""
+    prefixo = f"{COLUNA_PARTICAO_PERIODO}="
+    return sorted(
+        p.name[len(prefixo):] for p in Path(caminho).iterdir()
+        if p.is_dir() and p.name.startswith(prefixo) and p.name != f"{prefixo}NULL"
+    )
+
+
+def trocar_pasta(pasta_tmp, destino):
+    """Coloca a pasta gerada ao lado (.tmp) no lugar do destino; a versão anterior só é apagada depois da troca."""
+    destino = Path(destino)
+    pasta_antiga = destino.with_name(destino.name + ".old")
+    shutil.rmtree(pasta_antiga, ignore_errors=True)
+    if destino.exists():
+        destino.rename(pasta_antiga)
+    Path(pasta_tmp).rename(destino)
+    shutil.rmtree(pasta_antiga, ignore_errors=True)
+
+
+def sql_ordenacao(ordem):
+    """Lista de colunas para o ORDER BY (entre aspas, na ordem dada)."""
+    return ", ".join(f'"{c}"' for c in ordem)
+
+
+def escrever_dataset_particionado(con, sql, destino, opcoes="FORMAT PARQUET", arquivo_unico=False, ordem=None):
+    """
+    Grava o resultado do SELECT particionado pelo mês de PERIODO (ANO_MES=YYYY-MM/).
+    A pasta é gerada ao lado e só troca de lugar no final.
+    - opcoes: opções do COPY (ver opcoes_copy_staging).
+    - arquivo_unico: também grava <destino>.parquet (layout antigo); o SELECT roda uma vez só e a
+      pasta particionada é gerada a partir desse arquivo.
+    - ordem: colunas de ordenação das linhas dentro de cada mês (e do arquivo único). O PARTITION_BY
+      do DuckDB não preserva a ordem, então com ordem cada mês é gravado por um COPY próprio com
+      ORDER BY, a partir de um parquet temporário ordenado por mês (poda dos row groups no WHERE).
+    """
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    pasta_tmp = destino.with_name(destino.name + ".tmp")
+    shutil.rmtree(pasta_tmp, ignore_errors=True)
+    ordenacao = sql_ordenacao(ordem or [])
+
+    if arquivo_unico:
+        arquivo = destino.with_name(destino.name + ".parquet")
+        arquivo_tmp = destino.with_name(destino.name + ".parquet.tmp")
+        sql_arquivo = f"SELECT * FROM ({sql}) ORDER BY {ordenacao}" if ordenacao else sql
+        con.execute(f"COPY ({sql_arquivo}) TO '{arquivo_tmp.as_posix()}' ({opcoes})")
+        os.replace(arquivo_tmp, arquivo)
+        sql = f"SELECT * FROM parquet_scan('{arquivo.as_posix()}')"
+
+    sql_particao = f"SELECT *, strftime(PERIODO, '%Y-%m') AS {COLUNA_PARTICAO_PERIODO} FROM ({sql})"
+    if not ordenacao:
+        con.execute(f"""
+            COPY ({sql_particao}) TO '{pasta_tmp.as_posix()}' ({opcoes}, PARTITION_BY ({COLUNA_PARTICAO_PERIODO}))
+        """)
+    else:
+        pasta_tmp.mkdir()
+        por_mes = pasta_tmp / "_por_mes.parquet"
+        con.execute(f"""
+            COPY ({sql_particao} ORDER BY {COLUNA_PARTICAO_PERIODO}, {ordenacao})
+            TO '{por_mes.as_posix()}' ({opcoes})
+        """)
+        meses = con.execute(f"SELECT DISTINCT {COLUNA_PARTICAO_PERIODO} FROM parquet_scan('{por_mes.as_posix()}')").fetchall()
+        for (mes,) in meses:
+            # Mesmo layout do PARTITION_BY (coluna da partição fora do arquivo, mês nulo em ANO_MES=NULL)
+            pasta_mes = pasta_tmp / f"{COLUNA_PARTICAO_PERIODO}={mes if mes is not None else 'NULL'}"
+            pasta_mes.mkdir()
+            condicao = f"{COLUNA_PARTICAO_PERIODO} = '{mes}'" if mes is not None else f"{COLUNA_PARTICAO_PERIODO} IS NULL"
+            con.execute(f"""
+                COPY (
+                    SELECT * EXCLUDE ({COLUNA_PARTICAO_PERIODO}) FROM parquet_scan('{por_mes.as_posix()}')
+                    WHERE {condicao} ORDER BY {ordenacao}
+                ) TO '{(pasta_mes / "data_0.parquet").as_posix()}' ({opcoes})
+            """)
+        por_mes.unlink()
+    pasta_tmp.mkdir(exist_ok=True)
+    trocar_pasta(pasta_tmp, destino)
+
+
+def ler_dataset_particionado(caminho, colunas=None, periodo_inicio=None, periodo_fim=None, arrow=False, dicionario=None):
+    """
+    Lê o dataset particionado com pyarrow.dataset: projeção das colunas e poda das pastas pelo intervalo de meses.
+    - dicionario: colunas lidas como dictionary (viram category no pandas).
+    """
+    dataset = ds.dataset(
+        caminho,
+        format=ds.ParquetFileFormat(read_options={"dictionary_columns": dicionario or []}),
+        partitioning=ds.HivePartitioning(pa.schema([(COLUNA_PARTICAO_PERIODO, pa.string())]), null_fallback="NULL")
+    )
+
+    filtro = None
+    if periodo_inicio is not None:
+        filtro = ds.field(COLUNA_PARTICAO_PERIODO) >= mes_particao(periodo_inicio)
+    if periodo_fim is not None:
+        condicao = ds.field(COLUNA_PARTICAO_PERIODO) <= mes_particao(periodo_fim)
+        filtro = condicao if filtro is None else filtro & condicao
+
+    colunas = colunas or [c for c in dataset.schema.names if c != COLUNA_PARTICAO_PERIODO]
+    tabela = dataset.to_table(columns=colunas, filter=filtro)
+    return tabela if arrow else tabela.to_pandas()
+
+
+def periodos_dataset_staging(pasta_staging, nome, usar_banco=None):
+    """
+    Meses ('YYYY-MM') com dados no dataset, em ordem (partição, tabela do banco ou parquet único).
+    - usar_banco: False ignora o banco de staging (padrão: USAR_STAGING_DUCKDB).
+    """
+    if USAR_STAGING_DUCKDB if usar_banco is None else usar_banco:
+        con = conectar_staging(pasta_staging)
+        if tabela_staging_existe(con, nome):
+            origem = f'"{nome_tabela_staging(nome)}"'
+            return [r[0] for r in con.execute(
+                f"SELECT DISTINCT strftime(PERIODO, '%Y-%m') AS m FROM {origem} WHERE PERIODO IS NOT NULL ORDER BY m"
+            ).fetchall()]
+
+    caminho = caminho_dataset_staging(pasta_staging, nome)
+    if caminho.is_dir():
+        return periodos_dataset_particionado(caminho)
+    return [r[0] for r in duckdb.query(
+        f"SELECT DISTINCT strftime(PERIODO, '%Y-%m') AS m FROM {sql_scan_dataset(caminho)} "
+        "WHERE PERIODO IS NOT NULL ORDER BY m"
+    ).fetchall()]
+
+######################################################################################
+# STAGING EM BANCO DUCKDB (OPCIONAL)
+# Com USAR_STAGING_DUCKDB = True os datasets de staging também ficam em um único
+# banco DuckDB local (tabelas tipadas + índices ART nas chaves de junção), e as
+# leituras viram consultas com projeção/filtro em vez de pd.read_parquet do arquivo
+# inteiro. Os parquets continuam sendo gerados (contrato com Power BI / painel).
+######################################################################################
+USAR_STAGING_DUCKDB = False
+NOME_BANCO_STAGING = "STAGING_KRONA.duckdb"
+COLUNAS_INDICE_STAGING = ["COD_PROD", "REGIONAL", "PERIODO", "COD_CLIENTE"]
+
+_conexoes_staging = {}
+
+
+def conectar_staging(pasta_staging):
+    """Abre (uma única vez por script) a conexão com o banco de staging e reaproveita nas próximas chamadas."""
+    caminho = (Path(pasta_staging) / NOME_BANCO_STAGING).resolve()
+    con = _conexoes_staging.get(caminho)
+    if con is None:
+        con = conectar_duckdb(caminho)
+        _conexoes_staging[caminho] = con
+    return con
+
+
+def fechar_staging():
+    """Fecha as conexões abertas com o banco de staging (libera o arquivo para o próximo script)."""
+    for con in _conexoes_staging.values():
+        con.close()
+    _conexoes_staging.clear()
+
+
+def nome_tabela_staging(nome):
+    # 'FORECAST_BI/DIM_SERIE' -> 'FORECAST_BI_DIM_SERIE'
+    return str(nome).replace("/", "_").replace("\\", "_")
+
+
+def tabela_staging_existe(con, nome):
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [nome_tabela_staging(nome)]
+    ).fetchone()[0] > 0
+
+
+def salvar_tabela_staging(con, nome, dados, indices=None):
+    """
+    Cria (ou substitui) uma tabela no banco de staging e os índices ART das chaves de junção.
+
+    Parâmetros:
+    - con: conexão do banco de staging (conectar_staging).
+    - nome: nome do dataset.
+    - dados: DataFrame, tabela Arrow, caminho de um parquet (ou pasta particionada) ou um SELECT.
+    - indices: colunas para indexar (padrão COLUNAS_INDICE_STAGING, somente as que existirem).
+    """
+    tabela = nome_tabela_staging(nome)
+
+    if isinstance(dados, Path) or (isinstance(dados, str) and dados.lower().endswith(".parquet")):
+        origem = sql_scan_dataset(dados)
+    elif isinstance(dados, str):
+        origem = f"({dados})"
+    else:
+        con.register("_dados_staging", dados)
+        origem = "_dados_staging"
+
+    try:
+        con.execute(f'CREATE OR REPLACE TABLE "{tabela}" AS SELECT * FROM {origem}')
+    finally:
+        if origem == "_dados_staging":
+            con.unregister("_dados_staging")
+
+    colunas = [r[0] for r in con.execute(f'DESCRIBE "{tabela}"').fetchall()]
+    for col in (indices if indices is not None else COLUNAS_INDICE_STAGING):
+        if col in colunas:
+            con.execute(f'CREATE INDEX "idx_{tabela}_{col}" ON "{tabela}" ("{col}")')
+
+
+def ler_tabela_staging(con, nome, colunas=None, filtro=None, arrow=False):
+    """Lê somente as colunas e linhas necessárias de uma tabela do banco de staging (pandas ou Arrow)."""
+    cols = ", ".join(f'"{c}"' for c in colunas) if colunas else "*"
+    sql = f'SELECT {cols} FROM "{nome_tabela_staging(nome)}"'
+    if filtro:
+        sql += f" WHERE {filtro}"
+    resultado = con.execute(sql)
+    return resultado.fetch_arrow_table() if arrow else resultado.df()
+
+
+def exportar_tabela_staging(con, nome, destino, opcoes="FORMAT PARQUET", ordem=None):
+    """
+    Exporta uma tabela do banco de staging para o contrato em arquivo.
+    - .parquet: COPY direto do DuckDB (opcoes: opções do COPY, ver opcoes_copy_staging; ordem: colunas do ORDER BY).
+    - .csv: mesmo padrão dos CSVs do painel (; | decimal , | utf-8-sig | 2 casas).
+    """
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    tabela = nome_tabela_staging(nome)
+
+    if destino.suffix.lower() == ".parquet":
+        ordenacao = f" ORDER BY {sql_ordenacao(ordem)}" if ordem else ""
+        con.execute(f"COPY (SELECT * FROM \"{tabela}\"{ordenacao}) TO '{destino.as_posix()}' ({opcoes})")
+    else:
+        con.execute(f'SELECT * FROM "{tabela}"').df().to_csv(
+            destino,
+            sep=";",
+            encoding="utf-8-sig",
+            index=False,
+            decimal=",",
+            float_format="%.2f"
+        )
+
+
+def salvar_dataset_staging(pasta_staging, nome, dados):
+    """
+    Grava um dataset de staging. Sempre gera o parquet <pasta_staging>/<nome>.parquet (contrato atual),
+    ou a pasta particionada por mês para os datasets do histórico (DATASETS_PARTICIONADOS_STAGING);
+    com USAR_STAGING_DUCKDB também mantém a tabela no banco, e o parquet é exportado a partir dela.
+    O parquet segue a política de gravação do dataset (politica_gravacao_staging).
+
+    Parâmetros:
+    - pasta_staging: pasta 02_STAGING_PARQUET.
+    - nome: nome do dataset (pode conter subpasta, ex.: 'FORECAST_BI/DIM_SERIE').
+    - dados: DataFrame, tabela Arrow, caminho de um parquet (só com o banco) ou um SELECT.
+    """
+    destino = caminho_dataset_staging(pasta_staging, nome)
+    politica = politica_gravacao_staging(pasta_staging, nome)
+    opcoes = opcoes_copy_parquet(politica)
+    ordenacao = sql_ordenacao(politica["ordem"])
+
+    if USAR_STAGING_DUCKDB:
+        con = conectar_staging(pasta_staging)
+        salvar_tabela_staging(con, nome, dados)
+        if dataset_particionado(nome):
+            escrever_dataset_particionado(
+                con, f'SELECT * FROM "{nome_tabela_staging(nome)}"', destino, opcoes, manter_arquivo_unico(nome),
+                politica["ordem"]
+            )
+        else:
+            exportar_tabela_staging(con, nome, destino, opcoes, politica["ordem"])
+    elif dataset_particionado(nome) and isinstance(dados, (pd.DataFrame, pa.Table)):
+        con = conectar_duckdb()
+        try:
+            con.register("_dados_staging", dados)
+            escrever_dataset_particionado(
+                con, "SELECT * FROM _dados_staging", destino, opcoes, manter_arquivo_unico(nome), politica["ordem"]
+            )
+        finally:
+            con.close()
+    elif isinstance(dados, str):
+        # SELECT executado em streaming pelo DuckDB (nada passa pelo pandas)
+        con = conectar_duckdb()
+        try:
+            if dataset_particionado(nome):
+                escrever_dataset_particionado(con, dados, destino, opcoes, manter_arquivo_unico(nome), politica["ordem"])
+            else:
+                destino.parent.mkdir(parents=True, exist_ok=True)
+                tmp = destino.with_suffix(".tmp")
+                if ordenacao:
+                    dados = f"SELECT * FROM ({dados}) ORDER BY {ordenacao}"
+                con.execute(f"COPY ({dados}) TO '{tmp.as_posix()}' ({opcoes})")
+                os.replace(tmp, destino)
+        finally:
+            con.close()
+    elif isinstance(dados, (pd.DataFrame, pa.Table)):
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        gravar_parquet_politica(dados, destino, politica)
+    else:
+        raise TypeError("Sem o banco de staging, salvar_dataset_staging espera um DataFrame, uma tabela Arrow ou um SELECT.")
+
+
+def ler_dataset_staging(pasta_staging, nome, colunas=None, filtro=None, arrow=False,
+                        periodo_inicio=None, periodo_fim=None, ultimos_meses=None):
+    """
+    Lê um dataset de staging trazendo só as colunas (e linhas) necessárias.
+    Usa a tabela do banco quando USAR_STAGING_DUCKDB e ela existir; senão lê o parquet
+    (ou só as pastas dos meses pedidos, no histórico particionado).
+    Datasets do CATALOGO_STAGING têm o schema do parquet conferido antes da leitura e voltam
+    só com as colunas declaradas, nos tipos declarados.
+
+    Parâmetros:
+    - pasta_staging: pasta 02_STAGING_PARQUET.
+    - nome: nome do dataset (sem extensão).
+    - colunas: lista de colunas (None = as declaradas no catálogo ou, fora dele, todas).
+    - filtro: condição SQL aplicada na leitura (ex.: "COD_PROD = '0001'").
+    - arrow: True devolve pyarrow.Table, sem converter para pandas.
+    - periodo_inicio / periodo_fim: intervalo de meses de PERIODO (inclusive).
+    - ultimos_meses: somente os N últimos meses com dados (substitui periodo_inicio).
+    """
+    registrar_leitura_staging(pasta_staging, nome, {
+        "colunas": colunas, "filtro": filtro, "arrow": arrow,
+        "periodo_inicio": periodo_inicio, "periodo_fim": periodo_fim, "ultimos_meses": ultimos_meses,
+    })
+    if nome not in CATALOGO_STAGING:
+        return _ler_dataset_staging(
+            pasta_staging, nome, colunas, filtro, arrow, periodo_inicio, periodo_fim, ultimos_meses
+        )
+
+    colunas = colunas or list(CATALOGO_STAGING[nome]["colunas"])
+    if VALIDAR_SCHEMA_STAGING:
+        validar_schema_staging(pasta_staging, nome, colunas)
+    dados = _ler_dataset_staging(
+        pasta_staging, nome, colunas, filtro, arrow, periodo_inicio, periodo_fim, ultimos_meses
+    )
+    return dados if arrow else aplicar_tipos_catalogo(dados, nome)
+
+
+_leituras_registradas = set()
+
+
+def registrar_leitura_staging(pasta_staging, nome, parametros):
+    # Cada combinação nova de parâmetros (por pasta e dataset) entra no LEITURAS_STAGING.json da pasta;
+    # é de lá que benchmark_gravacao_staging tira as leituras dos consumidores. A mesma leitura com
+    # outro intervalo de meses gravada por uma execução anterior é substituída (a janela anda todo mês).
+    parametros = json.loads(json.dumps(
+        {k: v for k, v in parametros.items() if v is not None and v is not False}, sort_keys=True, default=str
+    ))
+    chave = (str(pasta_staging), nome, json.dumps(parametros, sort_keys=True))
+    if chave in _leituras_registradas:
+        return
+    _leituras_registradas.add(chave)
+
+    def _sem_periodo(leitura):
+        return {k: v for k, v in leitura.items() if k not in ("periodo_inicio", "periodo_fim")}
+
+    arquivo = Path(pasta_staging) / ARQUIVO_LEITURAS_STAGING
+    leituras = ler_json(arquivo, {})
+    leituras[nome] = [
+        leitura for leitura in leituras.get(nome, [])
+        if leitura != parametros and (
+            _sem_periodo(leitura) != _sem_periodo(parametros)
+            or (str(pasta_staging), nome, json.dumps(leitura, sort_keys=True)) in _leituras_registradas
+        )
+    ]
+    leituras[nome].append(parametros)
+    salvar_json(arquivo, leituras)
+
+
+def _ler_dataset_staging(pasta_staging, nome, colunas, filtro, arrow, periodo_inicio, periodo_fim, ultimos_meses,
+                         usar_banco=None):
+    # usar_banco=False lê só os arquivos (padrão: USAR_STAGING_DUCKDB)
+    usar_banco = USAR_STAGING_DUCKDB if usar_banco is None else usar_banco
+    if ultimos_meses is not None:
+        meses = periodos_dataset_staging(pasta_staging, nome, usar_banco)
+        periodo_inicio = meses[-ultimos_meses:][0] if meses else None
+
+    filtro_periodo = sql_filtro_periodo(periodo_inicio, periodo_fim)
+
+    if usar_banco:
+        con = conectar_staging(pasta_staging)
+        if tabela_staging_existe(con, nome):
+            filtro_tabela = " AND ".join(f"({c})" for c in [filtro, filtro_periodo] if c) or None
+            dados = ler_tabela_staging(con, nome, colunas, filtro_tabela, arrow)
+            return dados if arrow or nome not in DATASETS_CATEGORICOS_STAGING else categorizar_colunas(dados)
+
+    arquivo = caminho_dataset_staging(pasta_staging, nome)
+    if filtro is None and arquivo.is_dir():
+        dicionario = colunas_dicionario_parquet(arquivo, colunas)
+        dados = ler_dataset_particionado(arquivo, colunas, periodo_inicio, periodo_fim, arrow, dicionario)
+        return dados if arrow or not dicionario else categorizar_colunas(dados)
+
+    if filtro is None and filtro_periodo is None:
+        dicionario = colunas_dicionario_parquet(arquivo, colunas)
+        if arrow:
+            return pq.read_table(arquivo, columns=colunas, read_dictionary=dicionario)
+        dados = pd.read_parquet(arquivo, columns=colunas, read_dictionary=dicionario)
+        return categorizar_colunas(dados) if dicionario else dados
+
+    cols = ", ".join(f'"{c}"' for c in colunas) if colunas else "*"
+    condicao = " AND ".join(f"({c})" for c in [filtro, filtro_periodo] if c)
+    origem = sql_scan_dataset(arquivo, sql_filtro_particao(periodo_inicio, periodo_fim))
+    con = conectar_duckdb()
+    try:
+        resultado = con.execute(f"SELECT {cols} FROM {origem} WHERE {condicao}")
+        if arrow:
+            return resultado.fetch_arrow_table()
+        dados = resultado.df()
+    finally:
+        con.close()
+    return categorizar_colunas(dados) if nome in DATASETS_CATEGORICOS_STAGING else dados
+
+
+def iterar_lotes_periodo(pasta_staging, nome, colunas=None, meses_por_lote=None):
+    """
+    Lê o dataset de staging em lotes de meses consecutivos (MESES_POR_LOTE), na ordem de PERIODO.
+    Usado no modo memória limitada: cada lote traz só as pastas/linhas daqueles meses.
+    """
+    meses = periodos_dataset_staging(pasta_staging, nome)
+    for lote in lotes_de_valores(meses, meses_por_lote or MESES_POR_LOTE):
+        yield ler_dataset_staging(pasta_staging, nome, colunas=colunas, periodo_inicio=lote[0], periodo_fim=lote[-1])
+
+
+def separar_vendas_lancamento(pasta_staging, produtos_lancamento):
+    """
+    Separa do df_vendas_krona as vendas dos produtos de lançamento: grava df_vendas_krona_lancamento com
+    elas e regrava df_vendas_krona sem elas (COD_PROD nulo fica no df_vendas_krona).
+    - Modo memória limitada (sem o banco de staging): roda no DuckDB em streaming, direto do parquet para
+      o parquet. O histórico de lançamento é gravado antes, porque o df_vendas_krona é regravado sobre ele mesmo.
+    - Senão: o histórico é lido como tabela Arrow e filtrado sem passar pelo pandas.
+    """
+    if MODO_MEMORIA_LIMITADA and not USAR_STAGING_DUCKDB:
+        origem_vendas_krona = sql_scan_dataset(caminho_dataset_staging(pasta_staging, "df_vendas_krona"))
+        filtro_lancamento = f"COD_PROD IN ({sql_lista(produtos_lancamento) or 'NULL'})"
+        salvar_dataset_staging(
+            pasta_staging, "df_vendas_krona_lancamento",
+            f"SELECT * FROM {origem_vendas_krona} WHERE {filtro_lancamento}"
+        )
+        salvar_dataset_staging(
+            pasta_staging, "df_vendas_krona",
+            f"SELECT * FROM {origem_vendas_krona} WHERE COD_PROD IS NULL OR NOT ({filtro_lancamento})"
+        )
+        return
+
+    df_vendas_krona = ler_dataset_staging(pasta_staging, "df_vendas_krona", arrow=True)
+    lista_produtos_lancamento = pa.array(produtos_lancamento, type=df_vendas_krona.schema.field("COD_PROD").type)
+    mascara_lancamento = pc.fill_null(pc.is_in(df_vendas_krona["COD_PROD"], value_set=lista_produtos_lancamento), False)
+    salvar_dataset_staging(pasta_staging, "df_vendas_krona", df_vendas_krona.filter(pc.invert(mascara_lancamento)))
+    salvar_dataset_staging(pasta_staging, "df_vendas_krona_lancamento", df_vendas_krona.filter(mascara_lancamento))
+
+######################################################################################
+# ARROW: ARRAYS POR SÉRIE DIRETO DOS BUFFERS
+######################################################################################
+def fatiar_series_arrow(tabela, chaves, colunas):
+    """
+    Separa uma tabela Arrow já ordenada pelas chaves em arrays numpy por série.
+    Os arrays são fatias (views) dos buffers Arrow, sem cópia, quando a coluna não tem nulos.
+
+    Parâmetros:
+    - tabela: pyarrow.Table (ou DataFrame) ordenada por chaves (+ período).
+    - chaves: colunas que identificam a série (ex.: ['COD_PROD', 'REGIONAL']).
+    - colunas: colunas devolvidas como arrays (ex.: ['PERIODO', 'VOL_VENDA']).
+
+    Retorna lista de (tupla_chave, [array_coluna_1, array_coluna_2, ...]) na ordem da tabela.
+    """
+    if isinstance(tabela, pd.DataFrame):
+        tabela = pa.Table.from_pandas(tabela[list(chaves) + list(colunas)], preserve_index=False)
+
+    tabela = tabela.combine_chunks()
+    n = tabela.num_rows
+    if n == 0:
+        return []
+
+    # Início de série = linha onde qualquer chave muda em relação à anterior
+    inicio_serie = np.zeros(n, dtype=bool)
+    inicio_serie[0] = True
+    for chave in chaves:
+        coluna = tabela.column(chave)
+        mudou = pc.fill_null(pc.not_equal(coluna.slice(1), coluna.slice(0, n - 1)), True)
+        inicio_serie[1:] |= mudou.to_numpy(zero_copy_only=False)
+
+    inicios = np.flatnonzero(inicio_serie)
+    fins = np.append(inicios[1:], n)
+
+    valores_chave = [tabela.column(c).take(pa.array(inicios)).to_pylist() for c in chaves]
+    arrays = []
+    for c in colunas:
+        coluna = tabela.column(c)
+        coluna = coluna.chunk(0) if coluna.num_chunks == 1 else coluna.combine_chunks()
+        arrays.append(coluna.to_numpy(zero_copy_only=coluna.null_count == 0))
+
+    return [
+        (tuple(v[i] for v in valores_chave), [a[ini:fim] for a in arrays])
+        for i, (ini, fim) in enumerate(zip(inicios, fins))
+    ]
+
+######################################################################################
+# MODELO ESTRELA DO STAGING (CHAVES INTEIRAS)
+# A camada gold publica dimensões com chave substituta inteira e estável entre
+# execuções (ID_PROD, ID_CLIENTE, ID_REGIONAL, ID_SERIE) e o fato FATO_VENDAS só
+# com IDs, PERIODO / MES_ID e medidas. Previsão e desagregação juntam/agrupam pelos IDs;
+# os textos descritivos só voltam na exportação.
+######################################################################################
+PASTA_ESTRELA_STAGING = "ESTRELA"
+
+# id: chave substituta | chaves: chave natural | atributos: textos descritivos (valor mais recente)
+DIMENSOES_ESTRELA = {
+    "DIM_PRODUTO": {"id": "ID_PROD", "chaves": ["COD_PROD"], "atributos": ["DESC_PRODUTO", "FAMILIA", "LINHA"]},
+    "DIM_CLIENTE": {
+        "id": "ID_CLIENTE",
+        "chaves": ["EMPRESA", "COD_CLIENTE"],
+        "atributos": ["NOME_CLIENTE", "COD_GRUPO_CLIENTE", "DESC_GRUPO_E_CLIENTE"]
+    },
+    "DIM_REGIONAL": {"id": "ID_REGIONAL", "chaves": ["REGIONAL"], "atributos": ["REGIONAL_GESTOR"]},
+}
+
+
+def _juncao_nula(chaves, a, b):
+    # NULL também é um membro válido da dimensão (IS NOT DISTINCT FROM casa NULL com NULL)
+    return " AND ".join(f'{a}."{c}" IS NOT DISTINCT FROM {b}."{c}"' for c in chaves)
+
+
+def atualizar_dimensao_staging(con, arquivo_dim, sql_origem, coluna_id, chaves, atributos, opcoes="FORMAT PARQUET"):
+    """
+    Atualiza uma dimensão do modelo estrela mantendo os IDs já emitidos.
+    - Chaves naturais já existentes: mesmo ID, atributos atualizados pela origem.
+    - Chaves novas: ID = MAX(ID) + sequência (ordem das chaves).
+    - Chaves que sumiram da origem continuam na dimensão com os últimos atributos (o ID não é reaproveitado).
+
+    Parâmetros:
+    - con: conexão DuckDB.
+    - arquivo_dim: parquet da dimensão (criado na primeira execução).
+    - sql_origem: SELECT com as colunas chaves + atributos, uma linha por chave natural.
+    - coluna_id: nome da chave substituta.
+    - opcoes: opções do COPY (ver opcoes_copy_staging).
+    """
+    arquivo_dim = Path(arquivo_dim)
+    arquivo_dim.parent.mkdir(parents=True, exist_ok=True)
+    cols_chave = ", ".join(f'"{c}"' for c in chaves)
+    cols_attr = "".join(f', o."{c}"' for c in atributos)
+
+    if arquivo_dim.exists():
+        atual = f"SELECT * FROM parquet_scan('{arquivo_dim.as_posix()}')"
+    else:
+        atual = f'SELECT CAST(NULL AS BIGINT) AS "{coluna_id}", * FROM ({sql_origem}) WHERE FALSE'
+
+    arquivo_tmp = arquivo_dim.with_suffix(".tmp.parquet")
+    con.execute(f"""
+        COPY (
+            WITH origem AS (SELECT *, TRUE AS _na_origem FROM ({sql_origem})),
+            atual AS ({atual}),
+            mantidos AS (
+                SELECT
+                    a."{coluna_id}", {", ".join(f'a."{c}"' for c in chaves)}
+                    {"".join(f', CASE WHEN o._na_origem THEN o."{c}" ELSE a."{c}" END AS "{c}"' for c in atributos)}
+                FROM atual a
+                LEFT JOIN origem o ON {_juncao_nula(chaves, "a", "o")}
+            ),
+            novos AS (
+                SELECT
+                    (SELECT COALESCE(MAX("{coluna_id}"), 0) FROM atual)
+                        + ROW_NUMBER() OVER (ORDER BY {cols_chave}) AS "{coluna_id}",
+                    {", ".join(f'o."{c}"' for c in chaves)}{cols_attr}
+                FROM origem o
+                ANTI JOIN atual a ON {_juncao_nula(chaves, "a", "o")}
+            )
+            SELECT * FROM mantidos
+            UNION ALL
+            SELECT * FROM novos
+            ORDER BY "{coluna_id}"
+        ) TO '{arquivo_tmp.as_posix()}' ({opcoes})
+    """)
+    os.replace(arquivo_tmp, arquivo_dim)
+
+
+def gerar_modelo_estrela_vendas(pasta_staging, arquivo_vendas, arquivos_dimensao=None):
+    """
+    Gera o modelo estrela do histórico de vendas em <pasta_staging>/ESTRELA:
+    DIM_PRODUTO, DIM_CLIENTE, DIM_REGIONAL, DIM_SERIE (COD_PROD + REGIONAL) e FATO_VENDAS.
+
+    Parâmetros:
+    - pasta_staging: pasta 02_STAGING_PARQUET.
+    - arquivo_vendas: parquet (ou pasta particionada) do histórico que vira o fato (mesmas linhas,
+      só IDs + PERIODO / MES_ID + medidas).
+    - arquivos_dimensao: parquets usados para montar as dimensões (padrão: arquivo_vendas), ex.: o
+      histórico mais os produtos de lançamento, para que todos os membros tenham ID.
+    """
+    pasta_estrela = Path(pasta_staging) / PASTA_ESTRELA_STAGING
+    arquivos_dimensao = arquivos_dimensao or [arquivo_vendas]
+    origem = " UNION ALL BY NAME ".join(
+        f"SELECT * FROM {sql_scan_dataset(a)}" for a in arquivos_dimensao
+    )
+
+    con = conectar_duckdb()
+    try:
+        con.execute(f"CREATE TEMP VIEW origem_dim AS {origem}")
+
+        for nome, dim in DIMENSOES_ESTRELA.items():
+            cols_chave = ", ".join(f'"{c}"' for c in dim["chaves"])
+            # atributo mais recente de cada chave natural
+            cols_attr = "".join(f', arg_max("{c}", PERIODO) AS "{c}"' for c in dim["atributos"])
+            atualizar_dimensao_staging(
+                con,
+                pasta_estrela / f"{nome}.parquet",
+                f"SELECT {cols_chave}{cols_attr} FROM origem_dim GROUP BY ALL",
+                dim["id"],
+                dim["chaves"],
+                dim["atributos"],
+                opcoes_copy_staging(pasta_staging, f"{PASTA_ESTRELA_STAGING}/{nome}")
+            )
+
+        # Série = (produto, regional): os IDs das dimensões vão junto para juntar direto por inteiro
+        dim_prod = (pasta_estrela / "DIM_PRODUTO.parquet").as_posix()
+        dim_reg = (pasta_estrela / "DIM_REGIONAL.parquet").as_posix()
+        atualizar_dimensao_staging(
+            con,
+            pasta_estrela / "DIM_SERIE.parquet",
+            f"""
+                SELECT s.COD_PROD, s.REGIONAL, p.ID_PROD, r.ID_REGIONAL
+                FROM (SELECT DISTINCT COD_PROD, REGIONAL FROM origem_dim) s
+                JOIN parquet_scan('{dim_prod}') p ON {_juncao_nula(["COD_PROD"], "s", "p")}
+                JOIN parquet_scan('{dim_reg}') r ON {_juncao_nula(["REGIONAL"], "s", "r")}
+            """,
+            "ID_SERIE",
+            ["COD_PROD", "REGIONAL"],
+            ["ID_PROD", "ID_REGIONAL"],
+            opcoes_copy_staging(pasta_staging, f"{PASTA_ESTRELA_STAGING}/DIM_SERIE")
+        )
+
+        nome_fato = f"{PASTA_ESTRELA_STAGING}/FATO_VENDAS"
+        arquivo_fato = caminho_dataset_staging(pasta_staging, nome_fato)
+        dims = {nome: (pasta_estrela / f"{nome}.parquet").as_posix() for nome in [*DIMENSOES_ESTRELA, "DIM_SERIE"]}
+        sql_fato = f"""
+            SELECT p.ID_PROD, c.ID_CLIENTE, r.ID_REGIONAL, s.ID_SERIE, v.PERIODO, {sql_mes_id("v.PERIODO")} AS MES_ID,
+                   v.QTD_VENDA, v.VOL_VENDA
+            FROM {sql_scan_dataset(arquivo_vendas)} v
+            JOIN parquet_scan('{dims["DIM_PRODUTO"]}') p ON {_juncao_nula(["COD_PROD"], "v", "p")}
+            JOIN parquet_scan('{dims["DIM_CLIENTE"]}') c ON {_juncao_nula(["EMPRESA", "COD_CLIENTE"], "v", "c")}
+            JOIN parquet_scan('{dims["DIM_REGIONAL"]}') r ON {_juncao_nula(["REGIONAL"], "v", "r")}
+            JOIN parquet_scan('{dims["DIM_SERIE"]}') s ON {_juncao_nula(["COD_PROD", "REGIONAL"], "v", "s")}
+            ORDER BY s.ID_SERIE, v.PERIODO
+        """
+        politica_fato = politica_gravacao_staging(pasta_staging, nome_fato)
+        opcoes_fato = opcoes_copy_parquet(politica_fato)
+        if dataset_particionado(nome_fato):
+            escrever_dataset_particionado(con, sql_fato, arquivo_fato, opcoes_fato, ordem=politica_fato["ordem"])
+        else:
+            arquivo_tmp = arquivo_fato.with_suffix(".tmp.parquet")
+            con.execute(f"COPY ({sql_fato}) TO '{arquivo_tmp.as_posix()}' ({opcoes_fato})")
+            os.replace(arquivo_tmp, arquivo_fato)
+
+        linhas_fato = con.execute(f"SELECT COUNT(*) FROM {sql_scan_dataset(arquivo_fato)}").fetchone()[0]
+        membros = {
+            nome: con.execute(f"SELECT COUNT(*) FROM parquet_scan('{arquivo}')").fetchone()[0]
+            for nome, arquivo in dims.items()
+        }
+    finally:
+        con.close()
+
+    if USAR_STAGING_DUCKDB:
+        con_staging = conectar_staging(pasta_staging)
+        arquivos = {nome: Path(arquivo) for nome, arquivo in dims.items()} | {"FATO_VENDAS": arquivo_fato}
+        for nome, arquivo in arquivos.items():
+            salvar_tabela_staging(
+                con_staging, f"{PASTA_ESTRELA_STAGING}/{nome}", arquivo,
+                indices=["ID_PROD", "ID_CLIENTE", "ID_REGIONAL", "ID_SERIE", "PERIODO"]
+            )
+
+    print(
+        f"⭐ Modelo estrela gerado | FATO_VENDAS: {linhas_fato:,} linhas | "
+        + " | ".join(f"{nome}: {qtd:,}" for nome, qtd in membros.items())
+    )
+
+
+def ler_dimensao_estrela(pasta_staging, nome, colunas=None):
+    """Lê uma dimensão do modelo estrela (ESTRELA/<nome>)."""
+    return ler_dataset_staging(pasta_staging, f"{PASTA_ESTRELA_STAGING}/{nome}", colunas=colunas)
+
+
+def agregar_vendas_por_serie(pasta_staging, codigos_prod=None):
+    """
+    Soma VOL_VENDA do FATO_VENDAS por (ID_SERIE, PERIODO) e só então resolve COD_PROD/REGIONAL pela DIM_SERIE.
+    FSUM = soma compensada (mesmo resultado do groupby().sum() do pandas).
+
+    Parâmetros:
+    - pasta_staging: pasta 02_STAGING_PARQUET.
+    - codigos_prod: opcional, filtra os códigos de produto (comparação sem espaços; COD_PROD volta sem espaços).
+
+    Retorna DataFrame ID_SERIE, COD_PROD, REGIONAL, PERIODO, MES_ID, VOL_VENDA ordenado por COD_PROD, REGIONAL, PERIODO
+    (séries com COD_PROD ou REGIONAL nulos ficam de fora).
+    """
+    # Meses fechados antigos já somados por (ID_SERIE, PERIODO) na camada fria + últimos meses do FATO_VENDAS
+    fato = ler_historico_em_camadas(pasta_staging, "SERIE", arrow=True)
+    dim_serie = ler_dataset_staging(
+        pasta_staging, f"{PASTA_ESTRELA_STAGING}/DIM_SERIE", colunas=["ID_SERIE", "COD_PROD", "REGIONAL"], arrow=True
+    )
+
+    cod_prod = "s.COD_PROD"
+    filtro = "s.COD_PROD IS NOT NULL AND s.REGIONAL IS NOT NULL"
+    if codigos_prod is not None:
+        cod_prod = "TRIM(CAST(s.COD_PROD AS VARCHAR))"
+        filtro += f" AND {cod_prod} IN ({sql_lista(sorted(codigos_prod))})"
+
+    con = conectar_duckdb()
+    try:
+        con.register("fato", fato)
+        con.register("dim_serie", dim_serie)
+        return con.execute(f"""
+            WITH agregado AS (
+                SELECT ID_SERIE, PERIODO, COALESCE(FSUM(VOL_VENDA), 0) AS VOL_VENDA
+                FROM fato
+                WHERE PERIODO IS NOT NULL
+                GROUP BY ID_SERIE, PERIODO
+            )
+            SELECT a.ID_SERIE, {cod_prod} AS COD_PROD, s.REGIONAL, a.PERIODO, {sql_mes_id("a.PERIODO")} AS MES_ID, a.VOL_VENDA
+            FROM agregado a
+            JOIN dim_serie s ON a.ID_SERIE = s.ID_SERIE
+            WHERE {filtro}
+            ORDER BY 2, 3, 4
+        """).fetch_arrow_table().to_pandas()
+    finally:
+        con.close()
+
+######################################################################################
+######################################################################################
+# CATÁLOGO DE SCHEMAS DO STAGING
+# Cada dataset de staging declara aqui suas colunas (nome -> tipo), a ordenação de
+# gravação e quais etapas o produzem e o consomem. ler_dataset_staging usa o catálogo
+# para ler só as colunas declaradas e, antes de abrir os dados, confere o schema no
+# rodapé do parquet (milissegundos): coluna faltando ou com tipo incompatível falha na
+# hora, com o nome de quem gera o dataset, em vez de estourar no meio do forecast.
+# As colunas categóricas são as de COLUNAS_CATEGORICAS_STAGING nos datasets de
+# DATASETS_CATEGORICOS_STAGING (lidas como dicionário).
+######################################################################################
+VALIDAR_SCHEMA_STAGING = True
+
+# Tipos: "texto" (string / dicionário), "data" (timestamp / date) e dtypes numéricos do numpy
+_COLUNAS_VENDAS_STAGING = {
+    "EMPRESA": "texto", "COD_CLIENTE": "texto", "NOME_CLIENTE": "texto", "COD_GRUPO_CLIENTE": "texto",
+    "DESC_GRUPO_E_CLIENTE": "texto", "COD_PROD": "texto", "DESC_PRODUTO": "texto", "FAMILIA": "texto",
+    "LINHA": "texto", "REGIONAL": "texto", "REGIAO_CLIENTE": "texto", "REGIAO_MOVIMENTO": "texto",
+    "REGIONAL_GESTOR": "texto", "PERIODO": "data", "QTD_VENDA": "float64", "VOL_VENDA": "float64"
+}
+_COLUNAS_PREVISAO_STAGING = {
+    "EMPRESA": "texto", "COD_CLIENTE": "texto", "NOME_CLIENTE": "texto", "COD_GRUPO_CLIENTE": "texto",
+    "DESC_GRUPO_E_CLIENTE": "texto", "COD_PROD": "texto", "DESC_PRODUTO": "texto", "FAMILIA": "texto",
+    "LINHA": "texto", "REGIONAL": "texto", "REGIONAL_GESTOR": "texto", "PERIODO": "data", "MES_ID": "int32",
+    "VOL_PREV": "float64", "QTD_PREV": "float64"
+}
+
+CATALOGO_STAGING = {
+    "DIM_PRODUTOS_KRONA": {
+        "colunas": {"COD_PROD": "texto", "DESC_PROD": "texto", "PESO_UNIT": "float64", "FAMILIA": "texto", "LINHA": "texto"},
+        "ordem": [],
+        "produtores": ["01 DIM_PRODUTOS_KRONA", "02 (a partir de Dim_Produtos_Vendas_Krona)"],
+        "consumidores": ["01 demanda de lançamento", "01 desagregação", "02 DIM_SERIE_COMPLETA", "03 desagregação"]
+    },
+    "df_vendas_krona": {
+        "colunas": _COLUNAS_VENDAS_STAGING,
+        "ordem": ["COD_PROD", "REGIONAL", "PERIODO"],
+        "produtores": ["01 ingestão de vendas", "01 separação dos lançamentos"],
+        "consumidores": ["01 modelo estrela", "01 planejamento colaborativo", "01 camada fria", "01 desagregação"]
+    },
+    "df_vendas_krona_gold": {
+        "colunas": _COLUNAS_VENDAS_STAGING,
+        "ordem": ["COD_PROD", "REGIONAL", "PERIODO"],
+        "produtores": ["01 ingestão de vendas"],
+        "consumidores": ["painel / Power BI"]
+    },
+    "df_vendas_krona_lancamento": {
+        "colunas": _COLUNAS_VENDAS_STAGING,
+        "ordem": [],
+        "produtores": ["01 separação dos lançamentos"],
+        "consumidores": ["01 demanda de lançamento", "01 modelo estrela"]
+    },
+    "df_demanda_produtos_lancamento": {
+        "colunas": {
+            "COD_PROD": "texto", "DESC_PROD": "texto", "FAMILIA": "texto", "FAMILIA_SOP": "texto", "LINHA": "texto",
+            "MARCA": "texto", "PROCESSO": "texto", "CD: MT": "texto", "CD: NE": "texto", "CD: CO": "texto",
+            "CD: VQ": "texto", "CD: TM": "texto", "PERIODO": "data", "QTD_LANC": "float64", "VOL_LANC": "float64"
+        },
+        "ordem": ["COD_PROD", "PERIODO"],
+        "produtores": ["01 demanda de lançamento"],
+        "consumidores": ["01 separação dos lançamentos", "03 saída de lançamentos"]
+    },
+    f"{PASTA_ESTRELA_STAGING}/FATO_VENDAS": {
+        "colunas": {
+            "ID_PROD": "int64", "ID_CLIENTE": "int64", "ID_REGIONAL": "int64", "ID_SERIE": "int64",
+            "PERIODO": "data", "MES_ID": "int32", "QTD_VENDA": "float64", "VOL_VENDA": "float64"
+        },
+        "ordem": ["ID_SERIE", "PERIODO"],
+        "produtores": ["01 modelo estrela"],
+        "consumidores": ["01 painel de forecast", "01/02 agregar_vendas_por_serie", "01 camada fria"]
+    },
+    f"{PASTA_ESTRELA_STAGING}/DIM_PRODUTO": {
+        "colunas": {"ID_PROD": "int64", "COD_PROD": "texto", "DESC_PRODUTO": "texto", "FAMILIA": "texto", "LINHA": "texto"},
+        "ordem": ["ID_PROD"],
+        "produtores": ["01 modelo estrela"],
+        "consumidores": ["01 modelo estrela (chaves do FATO_VENDAS)"]
+    },
+    f"{PASTA_ESTRELA_STAGING}/DIM_CLIENTE": {
+        "colunas": {
+            "ID_CLIENTE": "int64", "EMPRESA": "texto", "COD_CLIENTE": "texto", "NOME_CLIENTE": "texto",
+            "COD_GRUPO_CLIENTE": "texto", "DESC_GRUPO_E_CLIENTE": "texto"
+        },
+        "ordem": ["ID_CLIENTE"],
+        "produtores": ["01 modelo estrela"],
+        "consumidores": ["01 modelo estrela (chaves do FATO_VENDAS)"]
+    },
+    f"{PASTA_ESTRELA_STAGING}/DIM_REGIONAL": {
+        "colunas": {"ID_REGIONAL": "int64", "REGIONAL": "texto", "REGIONAL_GESTOR": "texto"},
+        "ordem": ["ID_REGIONAL"],
+        "produtores": ["01 modelo estrela"],
+        "consumidores": ["01 modelo estrela (chaves do FATO_VENDAS)"]
+    },
+    f"{PASTA_ESTRELA_STAGING}/DIM_SERIE": {
+        "colunas": {"ID_SERIE": "int64", "COD_PROD": "texto", "REGIONAL": "texto", "ID_PROD": "int64", "ID_REGIONAL": "int64"},
+        "ordem": ["ID_SERIE"],
+        "produtores": ["01 modelo estrela"],
+        "consumidores": ["01 painel de forecast", "01/02 agregar_vendas_por_serie", "01 desagregação"]
+    },
+    "df_prev_krona": {
+        "colunas": _COLUNAS_PREVISAO_STAGING,
+        "ordem": ["EMPRESA", "COD_CLIENTE", "NOME_CLIENTE", "COD_GRUPO_CLIENTE", "DESC_GRUPO_E_CLIENTE", "COD_PROD",
+                  "DESC_PRODUTO", "FAMILIA", "LINHA", "REGIONAL", "REGIONAL_GESTOR", "MES_ID"],
+        "produtores": ["01 desagregação"],
+        "consumidores": ["01 arquivos do painel S&OP"]
+    },
+    "df_forecast_vendas_krona_PRODUTO": {
+        "colunas": {c: t for c, t in _COLUNAS_PREVISAO_STAGING.items() if c not in [
+            "COD_CLIENTE", "NOME_CLIENTE", "COD_GRUPO_CLIENTE", "DESC_GRUPO_E_CLIENTE", "QTD_PREV"
+        ]},
+        "ordem": ["EMPRESA", "COD_PROD", "DESC_PRODUTO", "FAMILIA", "LINHA", "REGIONAL", "REGIONAL_GESTOR", "PERIODO"],
+        "produtores": ["01 arquivos do painel S&OP"],
+        "consumidores": ["03 desagregação dos planos"]
+    },
+    "df_forecast_vendas_krona_CLIENTE": {
+        "colunas": _COLUNAS_PREVISAO_STAGING,
+        "ordem": [],
+        "produtores": ["01 arquivos do painel S&OP"],
+        "consumidores": ["painel / Power BI"]
+    },
+    "FORECAST_BI/DIM_SERIE": {
+        "colunas": {"ID_SERIE": "int64", "COD_PROD": "texto", "REGIONAL": "texto"},
+        "ordem": ["COD_PROD", "REGIONAL"],
+        "produtores": ["02 forecast BI"],
+        "consumidores": ["02 DIM_SERIE_COMPLETA", "Power BI"]
+    },
+    "FORECAST_BI/DIM_SERIE_COMPLETA": {
+        "colunas": {
+            "ID_SERIE": "int64", "COD_PROD": "texto", "DESC_PROD": "texto", "PESO_UNIT": "float64", "FAMILIA": "texto",
+            "LINHA": "texto", "REGIONAL": "texto", "REGIONAL_GESTOR": "texto"
+        },
+        "ordem": ["ID_SERIE"],
+        "produtores": ["02 DIM_SERIE_COMPLETA"],
+        "consumidores": ["02 fatos com quantidade", "Power BI"]
+    },
+    "FORECAST_BI/FATO_HISTORICO": {
+        "colunas": {"ID_SERIE": "int64", "PERIODO": "data", "VOL_REAL": "float64"},
+        "ordem": ["ID_SERIE", "PERIODO"],
+        "produtores": ["02 forecast BI"],
+        "consumidores": ["02 fatos com quantidade", "Power BI"]
+    },
+    "FORECAST_BI/FATO_PREVISAO_MODELO": {
+        "colunas": {"ID_SERIE": "int64", "PERIODO": "data", "ID_MODELO": "int16", "VOL_PREV": "float64", "MODELO_EXECUTADO": "texto"},
+        "ordem": ["ID_SERIE", "ID_MODELO", "PERIODO"],
+        "produtores": ["02 forecast BI"],
+        "consumidores": ["02 fatos com quantidade", "Power BI"]
+    },
+}
+
+for _nome, _definicao in CATALOGO_STAGING.items():
+    _definicao["categoricas"] = [
+        c for c in _definicao["colunas"]
+        if USAR_CATEGORIAS_STAGING and _nome in DATASETS_CATEGORICOS_STAGING and c in COLUNAS_CATEGORICAS_STAGING
+    ]
+
+
+def _tipo_arrow_compativel(tipo_arrow, tipo):
+    """Tipo do rodapé do parquet x tipo declarado (numéricos aceitam qualquer largura; a leitura converte)."""
+    if pa.types.is_dictionary(tipo_arrow):
+        tipo_arrow = tipo_arrow.value_type
+    if pa.types.is_null(tipo_arrow):
+        return True
+    if tipo == "texto":
+        return pa.types.is_string(tipo_arrow) or pa.types.is_large_string(tipo_arrow)
+    if tipo == "data":
+        return pa.types.is_timestamp(tipo_arrow) or pa.types.is_date(tipo_arrow)
+    if np.dtype(tipo).kind == "f":
+        return pa.types.is_floating(tipo_arrow) or pa.types.is_integer(tipo_arrow) or pa.types.is_decimal(tipo_arrow)
+    return pa.types.is_integer(tipo_arrow)
+
+
+def schema_parquet_staging(caminho):
+    """Schema do rodapé do parquet (na pasta particionada, do primeiro arquivo); None se não existir."""
+    caminho = Path(caminho)
+    if caminho.is_dir():
+        caminho = next(iter(sorted(caminho.rglob("*.parquet"))), None)
+    if caminho is None or not caminho.exists():
+        return None
+    return pq.read_schema(caminho)
+
+
+def validar_schema_staging(pasta_staging, nome, colunas=None, arquivo=None):
+    """
+    Confere o schema do parquet do dataset contra o CATALOGO_STAGING lendo só o rodapé do arquivo.
+
+    Parâmetros:
+    - pasta_staging: pasta 02_STAGING_PARQUET.
+    - nome: nome do dataset no catálogo.
+    - colunas: colunas que serão lidas (None = todas as declaradas).
+    - arquivo: outro parquet que deve seguir o mesmo schema (ex.: a origem alternativa de uma dimensão).
+
+    Gera ValueError com as colunas faltantes / tipos incompatíveis. Sem arquivo não há o que conferir
+    (a leitura é que acusa o arquivo ausente).
+    """
+    definicao = CATALOGO_STAGING[nome]
+    arquivo = Path(arquivo) if arquivo is not None else caminho_dataset_staging(pasta_staging, nome)
+    schema = schema_parquet_staging(arquivo)
+    if schema is None:
+        return
+
+    declaradas = definicao["colunas"]
+    colunas = colunas or list(declaradas)
+    faltantes = [c for c in colunas if c not in schema.names]
+    incompativeis = [
+        f"{c} (esperado {declaradas[c]}, encontrado {schema.field(c).type})"
+        for c in colunas
+        if c in declaradas and c in schema.names and not _tipo_arrow_compativel(schema.field(c).type, declaradas[c])
+    ]
+    if faltantes or incompativeis:
+        raise ValueError(
+            f"❌ Schema de {arquivo.name} diferente do catálogo de staging ({nome}).\n"
+            + (f"Colunas faltantes: {faltantes}\n" if faltantes else "")
+            + (f"Tipos incompatíveis: {incompativeis}\n" if incompativeis else "")
+            + f"Gerado por: {', '.join(definicao['produtores'])}. Gere o dataset novamente antes de continuar."
+        )
+
+
+def aplicar_tipos_catalogo(df, nome):
+    """Converte as colunas lidas para o tipo declarado no catálogo (só quando diferem; avisa o que converteu)."""
+    convertidas = []
+    for col, tipo in CATALOGO_STAGING[nome]["colunas"].items():
+        if col not in df.columns or tipo == "texto":
+            continue
+        atual = df[col].dtype
+        if tipo == "data":
+            if atual.kind != "M":
+                df[col] = pd.to_datetime(df[col])
+                convertidas.append(f"{col} {atual} -> datetime")
+        elif atual != np.dtype(tipo):
+            df[col] = df[col].astype(tipo)
+            convertidas.append(f"{col} {atual} -> {tipo}")
+    if convertidas:
+        print(f"🔧 Catálogo de staging | {nome}: {', '.join(convertidas)}")
+    return df
+
+######################################################################################
+######################################################################################
+# POLÍTICA DE GRAVAÇÃO DO STAGING (CODEC, ROW GROUP, DICIONÁRIO, ORDENAÇÃO)
+# Todo parquet de staging é gravado pela política do dataset: codec (zstd com nível ou
+# snappy), linhas por row group, dicionário e ordenação pelas colunas "ordem" do
+# CATALOGO_STAGING (nos datasets particionados, dentro de cada mês).
+# Sem benchmark vale a POLITICA_GRAVACAO_PADRAO (+ POLITICAS_GRAVACAO_STAGING).
+# Com EXECUTAR_BENCHMARK_GRAVACAO = True (desligado por padrão), o fim do 02 roda
+# benchmark_gravacao_staging: para cada dataset já gerado mede, em cada candidata de
+# CANDIDATAS_BENCHMARK_GRAVACAO, tempo de gravação, tamanho e tempo das leituras que
+# os scripts de fato fizeram (LEITURAS_STAGING.json, registrado por ler_dataset_staging),
+# e grava a escolhida em BENCHMARK_GRAVACAO.json; com USAR_POLITICA_MEDIDA = True as
+# próximas gravações usam a política medida.
+######################################################################################
+POLITICA_GRAVACAO_PADRAO = {
+    "compressao": "zstd",       # "zstd" ou "snappy"
+    "nivel": 3,                 # nível do zstd (1 = mais rápido, 9+ = menor)
+    "linhas_row_group": 122_880,
+    "dicionario": True,
+    "ordenar": True,            # ordena pelas colunas "ordem" do CATALOGO_STAGING
+}
+POLITICAS_GRAVACAO_STAGING = {}  # ajustes fixos por dataset, ex.: {"df_vendas_krona_gold": {"nivel": 9}}
+USAR_POLITICA_MEDIDA = True
+EXECUTAR_BENCHMARK_GRAVACAO = False  # True = mede as candidatas ao fim do 02 e atualiza BENCHMARK_GRAVACAO.json
+ARQUIVO_BENCHMARK_GRAVACAO = "BENCHMARK_GRAVACAO.json"
+ARQUIVO_LEITURAS_STAGING = "LEITURAS_STAGING.json"  # leituras registradas por ler_dataset_staging, por dataset
+PASTA_TESTE_BENCHMARK = "BENCHMARK_GRAVACAO_TMP"
+REPETICOES_BENCHMARK_GRAVACAO = 3
+TOLERANCIA_TEMPO_BENCHMARK = 0.05  # entre candidatas até 5% mais lentas que a melhor, fica a menor em disco
+
+CANDIDATAS_BENCHMARK_GRAVACAO = {
+    "snappy": {"compressao": "snappy"},
+    "zstd1": {"compressao": "zstd", "nivel": 1},
+    "zstd3": {"compressao": "zstd", "nivel": 3},
+    "zstd9": {"compressao": "zstd", "nivel": 9},
+    "zstd3_rg32k": {"compressao": "zstd", "nivel": 3, "linhas_row_group": 32_768},
+    "zstd3_rg1m": {"compressao": "zstd", "nivel": 3, "linhas_row_group": 1_048_576},
+    "zstd3_sem_dicionario": {"compressao": "zstd", "nivel": 3, "dicionario": False},
+    "zstd3_sem_ordem": {"compressao": "zstd", "nivel": 3, "ordenar": False},
+}
+
+def politica_gravacao_staging(pasta_staging, nome):
+    """
+    Política de gravação do dataset: POLITICA_GRAVACAO_PADRAO + POLITICAS_GRAVACAO_STAGING + (com
+    USAR_POLITICA_MEDIDA) a escolhida no último benchmark_gravacao_staging. 'ordem' traz as colunas
+    de ordenação do catálogo (vazia quando a política não ordena).
+    """
+    politica = {**POLITICA_GRAVACAO_PADRAO, **POLITICAS_GRAVACAO_STAGING.get(nome, {})}
+    if USAR_POLITICA_MEDIDA:
+        medida = ler_json(Path(pasta_staging) / ARQUIVO_BENCHMARK_GRAVACAO, {}).get(nome)
+        if medida:
+            politica.update(medida["politica"])
+    politica["ordem"] = CATALOGO_STAGING.get(nome, {}).get("ordem", []) if politica["ordenar"] else []
+    return politica
+
+
+def opcoes_copy_parquet(politica):
+    """Opções do COPY ... TO (FORMAT PARQUET, ...) do DuckDB para a política."""
+    opcoes = ["FORMAT PARQUET", f"COMPRESSION {politica['compressao'].upper()}"]
+    if politica["compressao"] == "zstd" and politica.get("nivel"):
+        opcoes.append(f"COMPRESSION_LEVEL {int(politica['nivel'])}")
+    if politica.get("linhas_row_group"):
+        opcoes.append(f"ROW_GROUP_SIZE {int(politica['linhas_row_group'])}")
+    if not politica["dicionario"]:
+        opcoes.append("DICTIONARY_SIZE_LIMIT 0")
+    return ", ".join(opcoes)
+
+
+def opcoes_copy_staging(pasta_staging, nome):
+    return opcoes_copy_parquet(politica_gravacao_staging(pasta_staging, nome))
+
+
+def _ordenar_tabela_arrow(tabela, ordem):
+    # sort_indices não ordena colunas dicionário: a ordem é calculada sobre os valores decodificados
+    chaves = {}
+    for col in ordem:
+        coluna = tabela.column(col)
+        chaves[col] = coluna.cast(coluna.type.value_type) if pa.types.is_dictionary(coluna.type) else coluna
+    indices = pc.sort_indices(pa.table(chaves), sort_keys=[(c, "ascending") for c in chaves])
+    return tabela.take(indices)
+
+
+def gravar_parquet_politica(dados, destino, politica):
+    """
+    Grava um DataFrame ou tabela Arrow em parquet com a política (ordenação estável pelas colunas
+    'ordem' presentes nos dados, codec, row group e dicionário).
+    """
+    ordem = [c for c in politica.get("ordem", []) if c in dados.columns]
+    if isinstance(dados, pd.DataFrame):
+        if ordem:
+            dados = dados.sort_values(ordem, kind="stable")
+        dados = pa.Table.from_pandas(dados, preserve_index=False)
+    elif ordem:
+        dados = _ordenar_tabela_arrow(dados, ordem)
+
+    pq.write_table(
+        dados,
+        destino,
+        compression=politica["compressao"],
+        compression_level=politica.get("nivel") if politica["compressao"] == "zstd" else None,
+        row_group_size=politica.get("linhas_row_group"),
+        use_dictionary=politica["dicionario"],
+    )
+
+
+def _tamanho_dataset(caminho):
+    caminho = Path(caminho)
+    if caminho.is_dir():
+        return sum(f.stat().st_size for f in caminho.rglob("*.parquet"))
+    return caminho.stat().st_size if caminho.exists() else 0
+
+
+def benchmark_gravacao_staging(pasta_staging, nomes=None, candidatas=None):
+    """
+    Mede cada candidata de política de gravação sobre os datasets de staging já gerados e escolhe a
+    política de cada um: menor tempo de gravação + leituras registradas em ARQUIVO_LEITURAS_STAGING
+    (as chamadas reais de ler_dataset_staging nos scripts; dataset sem registro = leitura completa), e
+    entre as candidatas até TOLERANCIA_TEMPO_BENCHMARK mais lentas que a melhor, a menor em disco.
+    Cada medida é o melhor de REPETICOES_BENCHMARK_GRAVACAO.
+
+    Parâmetros:
+    - pasta_staging: pasta 02_STAGING_PARQUET (da empresa).
+    - nomes: datasets a medir (padrão: todos do CATALOGO_STAGING que existirem).
+    - candidatas: dict {nome: ajustes da política} (padrão: CANDIDATAS_BENCHMARK_GRAVACAO).
+
+    Retorna DataFrame com as medidas (também gravado em BENCHMARK_GRAVACAO.csv) e grava a escolhida de
+    cada dataset em ARQUIVO_BENCHMARK_GRAVACAO.
+    """
+    pasta_staging = Path(pasta_staging)
+    candidatas = candidatas or CANDIDATAS_BENCHMARK_GRAVACAO
+    nomes = [n for n in (nomes or CATALOGO_STAGING) if caminho_dataset_staging(pasta_staging, n).exists()]
+    pasta_teste = pasta_staging / PASTA_TESTE_BENCHMARK
+    arquivo_escolhas = pasta_staging / ARQUIVO_BENCHMARK_GRAVACAO
+    escolhas = ler_json(arquivo_escolhas, {})
+    leituras_registradas = ler_json(pasta_staging / ARQUIVO_LEITURAS_STAGING, {})
+    medidas = []
+
+    def _melhor_tempo(funcao):
+        tempos = []
+        for _ in range(REPETICOES_BENCHMARK_GRAVACAO):
+            inicio = time.perf_counter()
+            funcao()
+            tempos.append(time.perf_counter() - inicio)
+        return min(tempos)
+
+    try:
+        for nome in nomes:
+            try:
+                validar_schema_staging(pasta_staging, nome)
+            except ValueError as erro:
+                print(f"⚠️ Benchmark de gravação | {nome} ignorado: {str(erro).splitlines()[0]}")
+                continue
+            tabela = _ler_dataset_staging(pasta_staging, nome, None, None, True, None, None, None)
+            leituras = leituras_registradas.get(nome) or [{}]
+            destino = caminho_dataset_staging(pasta_teste, nome)
+            particionado = dataset_particionado(nome)
+
+            def _ler_candidata(colunas=None, filtro=None, arrow=False, periodo_inicio=None, periodo_fim=None,
+                               ultimos_meses=None):
+                # Mesma leitura do ler_dataset_staging, mas direto do parquet da candidata: pelo banco de staging,
+                # conectar_staging criaria um .duckdb na pasta de teste e deixaria a conexão aberta no rmtree
+                colunas = colunas or list(CATALOGO_STAGING[nome]["colunas"])
+                dados = _ler_dataset_staging(
+                    pasta_teste, nome, colunas, filtro, arrow, periodo_inicio, periodo_fim, ultimos_meses, usar_banco=False
+                )
+                return dados if arrow else aplicar_tipos_catalogo(dados, nome)
+
+            for candidata, ajustes in candidatas.items():
+                politica = {**POLITICA_GRAVACAO_PADRAO, **ajustes}
+                politica["ordem"] = CATALOGO_STAGING[nome]["ordem"] if politica["ordenar"] else []
+
+                def _gravar():
+                    shutil.rmtree(pasta_teste, ignore_errors=True)
+                    destino.parent.mkdir(parents=True, exist_ok=True)
+                    if particionado:
+                        con = conectar_duckdb()
+                        try:
+                            con.register("_dados_benchmark", tabela)
+                            escrever_dataset_particionado(
+                                con, "SELECT * FROM _dados_benchmark", destino, opcoes_copy_parquet(politica),
+                                ordem=politica["ordem"]
+                            )
+                        finally:
+                            con.close()
+                    else:
+                        gravar_parquet_politica(tabela, destino, politica)
+
+                escrita = _melhor_tempo(_gravar)
+                leitura = sum(
+                    _melhor_tempo(lambda parametros=parametros: _ler_candidata(**parametros))
+                    for parametros in leituras
+                )
+                medidas.append({
+                    "DATASET": nome,
+                    "CANDIDATA": candidata,
+                    "LINHAS": tabela.num_rows,
+                    "ESCRITA_S": escrita,
+                    "LEITURA_S": leitura,
+                    "TOTAL_S": escrita + leitura,
+                    "TAMANHO_MB": _tamanho_dataset(destino) / 2**20,
+                })
+
+            df_nome = pd.DataFrame([m for m in medidas if m["DATASET"] == nome])
+            aceitas = df_nome[df_nome["TOTAL_S"] <= df_nome["TOTAL_S"].min() * (1 + TOLERANCIA_TEMPO_BENCHMARK)]
+            escolhida = aceitas.sort_values(["TAMANHO_MB", "TOTAL_S"]).iloc[0]
+            escolhas[nome] = {
+                "candidata": escolhida["CANDIDATA"],
+                "politica": {**POLITICA_GRAVACAO_PADRAO, **candidatas[escolhida["CANDIDATA"]]},
+                "total_s": round(float(escolhida["TOTAL_S"]), 4),
+                "tamanho_mb": round(float(escolhida["TAMANHO_MB"]), 3),
+                "medido_em": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            print(
+                f"🏁 Benchmark de gravação | {nome} | Escolhida: {escolhida['CANDIDATA']} | "
+                f"Gravação + leituras: {escolhida['TOTAL_S'] * 1000:.0f} ms | Tamanho: {escolhida['TAMANHO_MB']:.2f} MB"
+            )
+    finally:
+        shutil.rmtree(pasta_teste, ignore_errors=True)
+
+    salvar_json(arquivo_escolhas, escolhas)
+    df_medidas = pd.DataFrame(medidas)
+    df_medidas.to_csv(arquivo_escolhas.with_suffix(".csv"), sep=";", decimal=",", index=False, encoding="utf-8-sig")
+    return df_medidas
+
+######################################################################################
+######################################################################################
+# HISTÓRICO EM CAMADAS (QUENTE / FRIA)
+# Meses fechados não mudam, mas cada etapa relia e reagrupava o histórico inteiro no
+# grão cliente x produto x regional. Com USAR_CAMADAS_HISTORICO = True:
+# - camada fria: meses fechados anteriores aos MESES_CAMADA_QUENTE últimos, somados uma
+#   vez nos grãos que o pipeline usa (AGREGADOS_CAMADA_FRIA) e guardados em
+#   <pasta_staging>/CAMADA_FRIA/<agregado>.parquet. Só os meses novos na camada ou com
+#   assinatura diferente (CONTROLE_INGESTAO_VENDAS) são reagregados;
+# - camada quente: os últimos meses, lidos no grão completo do dataset de origem.
+# ler_historico_em_camadas une as duas camadas, então o custo da leitura fica quase
+# constante com o crescimento do histórico.
+######################################################################################
+USAR_CAMADAS_HISTORICO = True
+MESES_CAMADA_QUENTE = 12          # meses fechados mais recentes mantidos no grão completo
+PASTA_CAMADA_FRIA = "CAMADA_FRIA"
+
+# origem: dataset de staging | chaves: grão do agregado (sempre com PERIODO) | soma de VOL_VENDA
+AGREGADOS_CAMADA_FRIA = {
+    # forecast (agregar_vendas_por_serie)
+    "SERIE": {"origem": f"{PASTA_ESTRELA_STAGING}/FATO_VENDAS", "chaves": ["ID_SERIE", "PERIODO"]},
+    # exportações colaborativas (PRODUTO sai do mesmo grão, somando os clientes fora da lista de planejamento)
+    "COLABORATIVO": {
+        "origem": "df_vendas_krona",
+        "chaves": ["COD_GRUPO_CLIENTE", "DESC_GRUPO_E_CLIENTE", "REGIONAL_GESTOR", "REGIONAL", "FAMILIA", "PERIODO"]
+    },
+}
+
+
+def corte_camada_fria(ultimo_fechado=None):
+    """Último mês da camada fria: o último mês fechado menos MESES_CAMADA_QUENTE."""
+    ultimo_fechado = ultimo_periodo_fechado_data_cota() if ultimo_fechado is None else pd.Timestamp(ultimo_fechado)
+    return ultimo_fechado - pd.DateOffset(months=MESES_CAMADA_QUENTE)
+
+
+def atualizar_camada_fria(pasta_staging, assinatura, assinaturas_periodos, ultimo_fechado=None):
+    """
+    Mantém os agregados da camada fria (AGREGADOS_CAMADA_FRIA) em <pasta_staging>/CAMADA_FRIA.
+
+    Parâmetros:
+    - pasta_staging: pasta 02_STAGING_PARQUET (da empresa).
+    - assinatura: dict com o que vale para todos os meses (dimensões, regras, produtos de lançamento);
+      se mudar, os agregados são refeitos do zero.
+    - assinaturas_periodos: dict {'AAAA-MM-DD': assinatura do mês} (fingerprint_periodos da ingestão).
+    - ultimo_fechado: último mês fechado (padrão: ultimo_periodo_fechado_data_cota()).
+    """
+    corte = corte_camada_fria(ultimo_fechado)
+    pasta_fria = Path(pasta_staging) / PASTA_CAMADA_FRIA
+    pasta_fria.mkdir(parents=True, exist_ok=True)
+    periodos_frios = {p: fp for p, fp in assinaturas_periodos.items() if pd.Timestamp(p) <= corte}
+
+    con = conectar_duckdb()
+    try:
+        for nome, agregado in AGREGADOS_CAMADA_FRIA.items():
+            arquivo = pasta_fria / f"{nome}.parquet"
+            controle = ler_json(arquivo.with_suffix(".json"), {})
+            refazer = not arquivo.exists() or controle.get("assinatura") != assinatura
+            anteriores = {} if refazer else controle.get("periodos", {})
+            processar = sorted(p for p, fp in periodos_frios.items() if anteriores.get(p) != fp)
+            remover = sorted(set(anteriores) - set(periodos_frios))
+
+            if not refazer and not processar and not remover:
+                print(f"⏭️ Camada fria {nome} mantida | Até: {corte:%Y-%m} | Linhas: {controle.get('linhas', 0):,}")
+                continue
+
+            chaves = ", ".join(f'"{c}"' for c in agregado["chaves"])
+            filtro_particao = f"{COLUNA_PARTICAO_PERIODO} IN ({sql_lista([mes_particao(p) for p in processar]) or 'NULL'})"
+            sql_lote = f"""
+                SELECT {chaves}, FSUM(VOL_VENDA) AS VOL_VENDA
+                FROM {sql_scan_dataset(caminho_dataset_staging(pasta_staging, agregado["origem"]), filtro_particao)}
+                WHERE CAST(PERIODO AS DATE) IN ({",".join(f"DATE '{p}'" for p in processar) or "NULL"})
+                GROUP BY {chaves}
+            """
+            if refazer:
+                tmp = arquivo.with_suffix(".tmp")
+                con.execute(f"COPY ({sql_lote} ORDER BY {chaves}) TO '{tmp.as_posix()}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+                os.replace(tmp, arquivo)
+            else:
+                substituir_periodos_parquet(con, arquivo, sql_lote, processar + remover)
+
+            linhas = con.execute(f"SELECT COUNT(*) FROM parquet_scan('{arquivo.as_posix()}')").fetchone()[0]
+            salvar_json(arquivo.with_suffix(".json"), {
+                "assinatura": assinatura,
+                "corte": str(corte.date()),
+                "periodos": periodos_frios,
+                "linhas": int(linhas),
+                "atualizado_em": time.strftime("%Y-%m-%d %H:%M:%S"),
+            })
+            situacao = "refeita" if refazer else "atualizada"
+            print(
+                f"🧊 Camada fria {nome} {situacao} | Até: {corte:%Y-%m} | "
+                f"Meses agregados agora: {len(processar)} | Linhas: {linhas:,}"
+            )
+    finally:
+        con.close()
+
+
+def camada_fria_disponivel(pasta_staging, agregado):
+    """True quando as leituras do agregado podem usar a camada fria (modo ligado e agregado gerado)."""
+    arquivo = Path(pasta_staging) / PASTA_CAMADA_FRIA / f"{agregado}.parquet"
+    return USAR_CAMADAS_HISTORICO and arquivo.exists() and arquivo.with_suffix(".json").exists()
+
+
+def ler_historico_em_camadas(pasta_staging, agregado, arrow=False):
+    """
+    Histórico no grão do agregado: meses até o corte vindos da camada fria e meses seguintes lidos
+    no grão completo da origem (só as pastas desses meses). Sem camada fria, lê a origem inteira.
+    As linhas da camada quente não são somadas aqui: quem lê agrupa nas mesmas chaves.
+
+    Retorna as chaves do agregado + VOL_VENDA (DataFrame ou, com arrow=True, pyarrow.Table).
+    """
+    definicao = AGREGADOS_CAMADA_FRIA[agregado]
+    colunas = definicao["chaves"] + ["VOL_VENDA"]
+    if not camada_fria_disponivel(pasta_staging, agregado):
+        return ler_dataset_staging(pasta_staging, definicao["origem"], colunas=colunas, arrow=arrow)
+
+    arquivo = Path(pasta_staging) / PASTA_CAMADA_FRIA / f"{agregado}.parquet"
+    inicio_quente = pd.Timestamp(ler_json(arquivo.with_suffix(".json"))["corte"]) + pd.DateOffset(months=1)
+    quente = ler_dataset_staging(
+        pasta_staging, definicao["origem"], colunas=colunas, arrow=arrow, periodo_inicio=inicio_quente
+    )
+
+    if arrow:
+        fria = pq.read_table(arquivo, columns=colunas)
+        return pa.concat_tables([fria, quente.cast(fria.schema)])
+
+    fria = pd.read_parquet(arquivo, columns=colunas)
+    if definicao["origem"] in DATASETS_CATEGORICOS_STAGING:
+        return concatenar_categorias([categorizar_colunas(fria), categorizar_colunas(quente)])
+    return pd.concat([fria, quente], ignore_index=True)
+
+######################################################################################
+######################################################################################
+# PAINEL DE FORECAST (SÉRIE x MÊS, MEMORY-MAP)
+# Os scripts 01 e 02 agregavam o FATO_VENDAS por série, cortavam no último mês fechado,
+# completavam o calendário e fatiavam os arrays de cada série a cada execução. Com
+# USAR_PAINEL_FORECAST = True a ingestão grava uma vez em <pasta_staging>/PAINEL_FORECAST:
+# - VOLUME.npy: matriz float64 séries x meses (zeros nos meses sem venda);
+# - SERIES.arrow (Arrow IPC): ID_SERIE, COD_PROD, REGIONAL e PRIMEIRO_MES_ID, na ordem
+#   das linhas da matriz (COD_PROD, REGIONAL);
+# - PAINEL.json: eixo do calendário (MES_ID inicial / final) e a assinatura das fontes.
+# Os forecasts abrem a matriz com memory-map e cada série é uma fatia (view) da linha,
+# sem cópia, até o último mês do corte. Fontes com assinatura diferente (modelo estrela
+# ou camada fria regravados depois) fazem o painel ser gerado de novo na leitura.
+######################################################################################
+USAR_PAINEL_FORECAST = True
+PASTA_PAINEL_FORECAST = "PAINEL_FORECAST"
+
+
+def _assinatura_fontes_painel(pasta_staging):
+    """Assinatura (nome, tamanho, mtime) dos arquivos de que o painel é derivado."""
+    pasta_staging = Path(pasta_staging)
+    fontes = [
+        caminho_dataset_staging(pasta_staging, f"{PASTA_ESTRELA_STAGING}/FATO_VENDAS"),
+        caminho_dataset_staging(pasta_staging, f"{PASTA_ESTRELA_STAGING}/DIM_SERIE"),
+    ]
+    if camada_fria_disponivel(pasta_staging, "SERIE"):
+        fontes.append(pasta_staging / PASTA_CAMADA_FRIA / "SERIE.parquet")
+
+    assinatura = {}
+    for fonte in fontes:
+        arquivos = sorted(fonte.rglob("*.parquet")) if fonte.is_dir() else [fonte]
+        for arquivo in arquivos:
+            if arquivo.exists():
+                assinatura[arquivo.relative_to(pasta_staging).as_posix()] = fingerprint_arquivo(arquivo)
+    return assinatura
+
+
+def gerar_painel_forecast(pasta_staging):
+    """
+    Grava o painel de forecast (VOLUME.npy, SERIES.arrow, PAINEL.json) a partir do agregado por série
+    (agregar_vendas_por_serie), sem corte de mês: o corte é feito por quem lê (recortar_painel_forecast).
+    Os arquivos são gravados em temporários e trocados no fim, com o JSON por último.
+    """
+    inicio = time.perf_counter()
+    pasta_painel = Path(pasta_staging) / PASTA_PAINEL_FORECAST
+    pasta_painel.mkdir(parents=True, exist_ok=True)
+    assinatura = _assinatura_fontes_painel(pasta_staging)
+    df_group = agregar_vendas_por_serie(pasta_staging)
+
+    # Linha da matriz = série na ordem do agregado (COD_PROD, REGIONAL); coluna = MES_ID - primeiro mês do painel
+    linha = df_group.groupby(["COD_PROD", "REGIONAL"], sort=False, observed=True).ngroup().to_numpy()
+    meses = df_group["MES_ID"].to_numpy(dtype=np.int64)
+    mes_id_inicial = int(meses.min()) if len(meses) else 0
+    mes_id_final = int(meses.max()) if len(meses) else -1
+    qtd_series = int(linha.max()) + 1 if len(linha) else 0
+
+    volume = np.zeros((qtd_series, mes_id_final - mes_id_inicial + 1), dtype=np.float64)
+    volume[linha, meses - mes_id_inicial] = df_group["VOL_VENDA"].fillna(0).to_numpy(dtype=np.float64)
+
+    series = df_group.groupby(linha, sort=True).agg(
+        ID_SERIE=("ID_SERIE", "first"),
+        COD_PROD=("COD_PROD", "first"),
+        REGIONAL=("REGIONAL", "first"),
+        PRIMEIRO_MES_ID=("MES_ID", "min"),
+    ).reset_index(drop=True)
+    series["PRIMEIRO_MES_ID"] = series["PRIMEIRO_MES_ID"].astype(np.int32)
+
+    arquivo_volume = pasta_painel / "VOLUME.npy"
+    arquivo_series = pasta_painel / "SERIES.arrow"
+    tmp_volume = pasta_painel / "VOLUME.tmp.npy"
+    tmp_series = pasta_painel / "SERIES.tmp.arrow"
+    np.save(tmp_volume, volume)
+    tabela_series = pa.Table.from_pandas(series, preserve_index=False)
+    with pa.OSFile(tmp_series.as_posix(), "wb") as destino, pa.ipc.new_file(destino, tabela_series.schema) as escritor:
+        escritor.write_table(tabela_series)
+    os.replace(tmp_volume, arquivo_volume)
+    os.replace(tmp_series, arquivo_series)
+
+    salvar_json(pasta_painel / "PAINEL.json", {
+        "assinatura": assinatura,
+        "mes_id_inicial": mes_id_inicial,
+        "mes_id_final": mes_id_final,
+        "series": qtd_series,
+        "gerado_em": time.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+    print(
+        f"🧮 Painel de forecast gravado | Séries: {qtd_series:,} | Meses: {volume.shape[1]:,} | "
+        f"{volume.nbytes / 2**20:,.1f} MB | {(time.perf_counter() - inicio) * 1000:,.0f} ms"
+    )
+
+
+def carregar_painel_forecast(pasta_staging):
+    """
+    Abre o painel de forecast: VOLUME.npy com memory-map (somente leitura) e o índice das séries.
+    Painel ausente ou com fontes alteradas desde a gravação é gerado de novo antes da leitura.
+
+    Retorna dict com 'volume' (np.memmap séries x meses), 'series' (DataFrame do índice) e 'mes_id_inicial'.
+    """
+    pasta_painel = Path(pasta_staging) / PASTA_PAINEL_FORECAST
+    meta = ler_json(pasta_painel / "PAINEL.json", {})
+    if not meta or meta.get("assinatura") != _assinatura_fontes_painel(pasta_staging):
+        print("⚠️ Painel de forecast ausente ou desatualizado em relação ao FATO_VENDAS. Gerando novamente...")
+        gerar_painel_forecast(pasta_staging)
+        meta = ler_json(pasta_painel / "PAINEL.json")
+
+    with pa.memory_map((pasta_painel / "SERIES.arrow").as_posix(), "r") as origem:
+        series = pa.ipc.open_file(origem).read_all().to_pandas()
+    return {
+        "volume": np.load(pasta_painel / "VOLUME.npy", mmap_mode="r"),
+        "series": series,
+        "mes_id_inicial": int(meta["mes_id_inicial"]),
+    }
+
+
+def recortar_painel_forecast(painel, ultimo_mes_hist, coluna_valor="VOL_VENDA", codigos_prod=None):
+    """
+    Recorta o painel até ultimo_mes_hist no formato que os forecasts consomem (mesmo resultado de
+    agregar_vendas_por_serie + corte + completar_calendario_mensal + fatiar_series_arrow).
+
+    Parâmetros:
+    - painel: retorno de carregar_painel_forecast.
+    - ultimo_mes_hist: último mês do histórico consumido (meses depois dele ficam de fora).
+    - coluna_valor: nome da coluna de volume no histórico devolvido.
+    - codigos_prod: opcional, filtra os códigos de produto (comparação sem espaços; COD_PROD volta sem espaços).
+
+    Retorna (df_series, df_hist_base, tasks):
+    - df_series: ID_SERIE, COD_PROD, REGIONAL das séries com venda até o corte;
+    - df_hist_base: COD_PROD, REGIONAL, PERIODO, coluna_valor com os meses completos;
+    - tasks: lista de (cod_prod, regional, periodos_np, y_np), y_np como view da matriz quando possível.
+    """
+    ultimo_mes_id = mes_id(ultimo_mes_hist)
+    mes_id_inicial = painel["mes_id_inicial"]
+    series = painel["series"]
+    linhas = np.arange(len(series))
+
+    if codigos_prod is not None:
+        cod_limpo = series["COD_PROD"].astype(str).str.strip()
+        filtro = cod_limpo.isin(set(codigos_prod)).to_numpy()
+        series = series.loc[filtro].assign(COD_PROD=cod_limpo[filtro])
+        linhas = linhas[filtro]
+        ordem = np.lexsort((series["REGIONAL"].to_numpy(), series["COD_PROD"].to_numpy()))
+        series, linhas = series.iloc[ordem], linhas[ordem]
+
+    no_corte = (series["PRIMEIRO_MES_ID"] <= ultimo_mes_id).to_numpy()
+    series, linhas = series.loc[no_corte].reset_index(drop=True), linhas[no_corte]
+
+    # Colunas do painel até o corte (meses depois do fim do painel entram como zero, como no calendário completo)
+    qtd_meses = max(ultimo_mes_id - mes_id_inicial + 1, 0)
+    volume = painel["volume"][:, :qtd_meses]
+    if volume.shape[1] < qtd_meses:
+        volume = np.pad(volume, ((0, 0), (0, qtd_meses - volume.shape[1])))
+    periodos_eixo = periodo_de_mes_id(np.arange(mes_id_inicial, mes_id_inicial + qtd_meses, dtype=np.int32))
+
+    inicio = series["PRIMEIRO_MES_ID"].to_numpy(dtype=np.int64) - mes_id_inicial
+    cod_prods = series["COD_PROD"].tolist()
+    regionais = series["REGIONAL"].tolist()
+    tasks = [
+        (cod_prod, regional, periodos_eixo[ini:], volume[linha, ini:])
+        for cod_prod, regional, linha, ini in zip(cod_prods, regionais, linhas, inicio)
+    ]
+
+    # Histórico longo: máscara "mês >= primeiro mês da série", em ordem de linha. O volume sai das mesmas
+    # views por linha das tasks (volume[linhas] copiaria as linhas inteiras do memmap antes da máscara)
+    mascara = np.arange(qtd_meses)[None, :] >= inicio[:, None]
+    tamanho = mascara.sum(axis=1)
+    df_hist_base = pd.DataFrame({
+        "COD_PROD": pd.Series(np.repeat(np.array(cod_prods, dtype=object), tamanho), dtype=object).infer_objects(),
+        "REGIONAL": pd.Series(np.repeat(np.array(regionais, dtype=object), tamanho), dtype=object).infer_objects(),
+        "PERIODO": np.broadcast_to(periodos_eixo, mascara.shape)[mascara],
+        coluna_valor: np.concatenate([y_np for *_, y_np in tasks]) if tasks else np.empty(0, dtype=volume.dtype),
+    })
+    return series[["ID_SERIE", "COD_PROD", "REGIONAL"]], df_hist_base, tasks
+
+
+def carregar_series_forecast(pasta_staging, ultimo_mes_hist, coluna_valor="VOL_VENDA", codigos_prod=None):
+    """
+    Séries do forecast cortadas em ultimo_mes_hist: pelo painel (USAR_PAINEL_FORECAST) ou, com o painel
+    desligado, agregando o FATO_VENDAS e completando o calendário na hora. Mesmo retorno de
+    recortar_painel_forecast: (df_series, df_hist_base, tasks).
+    """
+    if USAR_PAINEL_FORECAST:
+        return recortar_painel_forecast(
+            carregar_painel_forecast(pasta_staging), ultimo_mes_hist, coluna_valor, codigos_prod
+        )
+
+    df_group = agregar_vendas_por_serie(pasta_staging, codigos_prod).rename(columns={"VOL_VENDA": coluna_valor})
+    df_group = df_group[df_group["MES_ID"] <= mes_id(ultimo_mes_hist)]
+    df_series = df_group[["ID_SERIE", "COD_PROD", "REGIONAL"]].drop_duplicates().reset_index(drop=True)
+    df_hist_base = completar_calendario_mensal(df_group, ultimo_mes_hist, coluna_valor)
+    tasks = [
+        (cod_prod, regional, periodos_np, y_np)
+        for (cod_prod, regional), (periodos_np, y_np) in fatiar_series_arrow(
+            df_hist_base, ["COD_PROD", "REGIONAL"], ["PERIODO", coluna_valor]
+        )
+    ]
+    return df_series, df_hist_base, tasks
+
+######################################################################################
+######################################################################################
+# TENDÊNCIA LINEAR EM LOTE (FORMA FECHADA)
+# O pred_lr ajustava um LinearRegression do scikit-learn por série no torneio do 01,
+# de novo em cada dobra de 6 meses do backtest e mais uma vez por série e dobra nas
+# métricas do 02. Reta no índice do tempo tem solução fechada: com as séries numa matriz
+# séries x tempo alinhada à direita (cada uma começa na sua coluna) e somas acumuladas
+# de y e t*y, inclinação e intercepto de qualquer janela [início da série, fim do treino)
+# saem de duas subtrações. Com USAR_TENDENCIA_LINEAR_LOTE = True os scripts calculam de
+# uma vez as previsões de todas as séries e dobras (previsoes_tendencia_linear) e o
+# pred_lr de cada worker só consulta o resultado pelo tamanho do treino.
+######################################################################################
+USAR_TENDENCIA_LINEAR_LOTE = True
+
+
+def tendencia_linear_lote(volume, inicio, linhas, fim_treino, passos):
+    """
+    Mínimos quadrados de y = a + b*t (t = 0, 1, ... desde o início da série) para várias janelas de
+    uma vez, mesmo resultado do LinearRegression sobre np.arange(n), previsões truncadas em zero.
+
+    Parâmetros:
+    - volume: matriz séries x tempo (valores antes do início de cada série são ignorados).
+    - inicio: coluna inicial de cada série (array com uma posição por linha da matriz).
+    - linhas: linha da matriz de cada consulta.
+    - fim_treino: coluna final (exclusiva) do treino de cada consulta; treino = [inicio, fim_treino).
+    - passos: quantidade de meses previstos depois do treino.
+
+    Retorna matriz consultas x passos.
+    """
+    volume = np.asarray(volume, dtype=np.float64)
+    inicio = np.asarray(inicio, dtype=np.int64)
+    linhas = np.asarray(linhas, dtype=np.int64)
+    fim_treino = np.asarray(fim_treino, dtype=np.int64)
+    colunas = np.arange(volume.shape[1], dtype=np.int64)
+
+    # Cada série centrada na própria média (a inclinação não muda e as somas acumuladas ficam pequenas)
+    na_serie = colunas[None, :] >= inicio[:, None]
+    qtd_serie = np.maximum(na_serie.sum(axis=1), 1)
+    nivel = np.where(na_serie, volume, 0.0).sum(axis=1) / qtd_serie
+    centrado = np.where(na_serie, volume - nivel[:, None], 0.0)
+    tempo = np.where(na_serie, colunas[None, :] - inicio[:, None], 0).astype(np.float64)
+
+    soma_y = np.zeros((volume.shape[0], volume.shape[1] + 1))
+    soma_ty = np.zeros((volume.shape[0], volume.shape[1] + 1))
+    np.cumsum(centrado, axis=1, out=soma_y[:, 1:])
+    np.cumsum(tempo * centrado, axis=1, out=soma_ty[:, 1:])
+
+    n = (fim_treino - inicio[linhas]).astype(np.float64)
+    sy = soma_y[linhas, fim_treino]
+    sty = soma_ty[linhas, fim_treino]
+    t_medio = (n - 1) / 2
+    sxx = n * (n * n - 1) / 12
+    # Uma observação só: inclinação zero e intercepto = o próprio valor (como no LinearRegression)
+    inclinacao = np.divide(sty - t_medio * sy, sxx, out=np.zeros_like(sxx), where=sxx > 0)
+    intercepto = sy / np.maximum(n, 1) - inclinacao * t_medio + nivel[linhas]
+
+    t_futuro = n[:, None] + np.arange(passos)[None, :]
+    return np.maximum(intercepto[:, None] + inclinacao[:, None] * t_futuro, 0)
+
+
+def previsoes_tendencia_linear(series_y, treinos, passos):
+    """
+    Previsões da tendência linear para todas as séries e tamanhos de treino pedidos, num lote só.
+
+    Parâmetros:
+    - series_y: lista com o array de volumes de cada série (histórico completo, do primeiro mês ao corte).
+    - treinos: lista (uma por série) com os tamanhos de treino a prever (treino = primeiros n meses).
+    - passos: meses previstos por treino (o consumidor usa os primeiros que precisar).
+
+    Retorna lista (uma por série) de dict {tamanho do treino: array com as previsões}, no formato que o
+    pred_lr dos scripts consulta.
+    """
+    tamanhos = np.array([len(y) for y in series_y], dtype=np.int64)
+    if len(tamanhos) == 0:
+        return []
+
+    # Séries alinhadas à direita: todas terminam na última coluna e cada uma começa em (largura - tamanho)
+    largura = int(tamanhos.max())
+    inicio = largura - tamanhos
+    volume = np.zeros((len(series_y), largura))
+    volume[np.arange(largura)[None, :] >= inicio[:, None]] = np.concatenate(
+        [np.asarray(y, dtype=np.float64) for y in series_y]
+    )
+
+    treinos = [sorted({int(n) for n in lista if 1 <= n <= tamanho}) for lista, tamanho in zip(treinos, tamanhos)]
+    linhas = np.repeat(np.arange(len(series_y)), [len(lista) for lista in treinos])
+    n_treino = np.array([n for lista in treinos for n in lista], dtype=np.int64)
+    previsoes = tendencia_linear_lote(volume, inicio, linhas, inicio[linhas] + n_treino, passos)
+
+    resultado = [{} for _ in series_y]
+    for linha, n, previsao in zip(linhas, n_treino, previsoes):
+        resultado[linha][int(n)] = previsao
+    return resultado
+
+
+def treinos_walk_forward(tamanho, min_treino, step):
+    """Tamanhos de treino das dobras do backtest walk-forward (min_treino, min_treino + step, ... < tamanho)."""
+    return list(range(min_treino, tamanho, step))
+
 ######################################################################################
 # def limpar_dataframes_com_prefixo(prefixo='_'):
 #     """
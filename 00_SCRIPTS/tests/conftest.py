@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Os scripts importam o functions.py pela pasta 00_SCRIPTS (não é um pacote instalado)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
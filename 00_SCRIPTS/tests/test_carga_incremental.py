@@ -0,0 +1,37 @@
+import pandas as pd
+
+import functions as f
+
+FECHADO = pd.Timestamp("2025-02-01")
+
+
+def _vendas(caminho, linhas_fevereiro):
+    # Janeiro fixo; fevereiro (mês fechado) com as linhas informadas (produto, quantidade)
+    linhas = [("P1", 10.0, "2025-01-01"), ("P2", 5.0, "2025-01-01")]
+    linhas += [(produto, qtd, "2025-02-01") for produto, qtd in linhas_fevereiro]
+    df = pd.DataFrame(linhas, columns=["Cod_Produto", "QTD_VENDA", "PERIODO"])
+    df = df.assign(
+        Chv_Cliente="C1", Chv_Vendedor="V1", EMPRESA="KRONA", DATA_EMISSAO=pd.to_datetime(df["PERIODO"]),
+        VOL_VENDA=df["QTD_VENDA"] / 2, PERIODO=pd.to_datetime(df["PERIODO"]),
+    )
+    df.to_parquet(caminho, index=False)
+    return f.fingerprint_periodos_vendas(caminho)
+
+
+def test_mes_fechado_alterado_so_em_linhas_repetidas_e_reprocessado(tmp_path):
+    # {A, A, B} -> {C, C, B}: mesma quantidade de linhas; com XOR dos hashes as repetidas se cancelavam
+    antes = _vendas(tmp_path / "antes.parquet", [("P1", 10.0), ("P1", 10.0), ("P2", 5.0)])
+    depois = _vendas(tmp_path / "depois.parquet", [("P9", 99.0), ("P9", 99.0), ("P2", 5.0)])
+    assert antes["2025-01-01"] == depois["2025-01-01"]
+    assert antes["2025-02-01"] != depois["2025-02-01"]
+
+    controle = {"fingerprint_periodos": antes, "dependencias": {}, "ultimo_periodo_fechado": "2025-02-01"}
+    plano = f.planejar_carga_incremental(controle, depois, {}, FECHADO)
+    assert plano == {"modo": "INCREMENTAL", "periodos": ["2025-02-01"], "remover": []}
+
+
+def test_linha_duplicada_muda_a_assinatura(tmp_path):
+    unica = _vendas(tmp_path / "unica.parquet", [("P1", 10.0)])
+    duplicada = _vendas(tmp_path / "duplicada.parquet", [("P1", 10.0), ("P1", 10.0)])
+    triplicada = _vendas(tmp_path / "triplicada.parquet", [("P1", 10.0)] * 3)
+    assert len({unica["2025-02-01"], duplicada["2025-02-01"], triplicada["2025-02-01"]}) == 3
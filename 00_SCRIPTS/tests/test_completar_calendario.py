@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions as f
+
+ULTIMO_MES = pd.Timestamp("2026-03-01")
+
+
+def _calendario_referencia(df_hist_base, ultimo_mes_hist, coluna_valor="VOL_VENDA"):
+    """Implementação anterior (reindex série a série), mantida aqui como referência de paridade."""
+    df_hist_base = df_hist_base.copy()
+    if "MES_ID" not in df_hist_base.columns:
+        df_hist_base["MES_ID"] = f.mes_id(df_hist_base["PERIODO"])
+    ultimo_mes_id = f.mes_id(ultimo_mes_hist)
+
+    partes = []
+    for (cod_prod, regional), g in df_hist_base.groupby(["COD_PROD", "REGIONAL"], sort=False):
+        g = g.sort_values("MES_ID")
+        calendario = np.arange(g["MES_ID"].min(), ultimo_mes_id + 1, dtype=np.int32)
+        g2 = g.set_index("MES_ID").reindex(calendario).rename_axis("MES_ID").reset_index()
+        g2["COD_PROD"] = cod_prod
+        g2["REGIONAL"] = regional
+        g2[coluna_valor] = g2[coluna_valor].fillna(0)
+        partes.append(g2[["COD_PROD", "REGIONAL", "MES_ID", coluna_valor]])
+
+    df_completo = pd.concat(partes, ignore_index=True)
+    df_completo.insert(2, "PERIODO", f.periodo_de_mes_id(df_completo.pop("MES_ID")))
+    return df_completo
+
+
+def _historico(series=300, categorias=False, com_mes_id=True, inteiro=False, nulos=False, semente=1):
+    # Séries com meses faltando, linhas embaralhadas e nenhum mês depois de ULTIMO_MES
+    rng = np.random.default_rng(semente)
+    ultimo = f.mes_id(ULTIMO_MES)
+    linhas = [
+        (f"P{s % 37:03d}", f"R{s // 37}", mes, rng.random() * 100)
+        for s in range(series)
+        for mes in rng.choice(np.arange(ultimo - 79, ultimo + 1), size=rng.integers(1, 20), replace=False)
+    ]
+    df = pd.DataFrame(linhas, columns=["COD_PROD", "REGIONAL", "MES_ID", "VOL_VENDA"]).sample(frac=1, random_state=semente)
+    df = df.reset_index(drop=True).astype({"MES_ID": np.int32})
+    df["PERIODO"] = f.periodo_de_mes_id(df["MES_ID"])
+    if inteiro:
+        df["VOL_VENDA"] = df["VOL_VENDA"].round().astype(np.int64)
+    if nulos:
+        df.loc[df.sample(frac=0.1, random_state=3).index, "VOL_VENDA"] = np.nan
+    if categorias:
+        df = df.astype({"COD_PROD": "category", "REGIONAL": "category"})
+    return df if com_mes_id else df.drop(columns="MES_ID")
+
+
+# A referência usa o groupby de antes (observed padrão), que avisa com chaves category
+@pytest.mark.filterwarnings("ignore:The default of observed=False:FutureWarning")
+@pytest.mark.parametrize("variante", [
+    {}, {"categorias": True}, {"com_mes_id": False}, {"inteiro": True}, {"nulos": True},
+], ids=["texto", "categorias", "sem_mes_id", "inteiro", "nulos"])
+def test_mesma_saida_e_dtypes_da_implementacao_anterior(variante):
+    df = _historico(**variante)
+    pd.testing.assert_frame_equal(f.completar_calendario_mensal(df, ULTIMO_MES), _calendario_referencia(df, ULTIMO_MES))
+
+
+def test_coluna_valor_informada():
+    df = _historico().rename(columns={"VOL_VENDA": "VOL_REAL"})
+    pd.testing.assert_frame_equal(
+        f.completar_calendario_mensal(df, ULTIMO_MES, coluna_valor="VOL_REAL"),
+        _calendario_referencia(df, ULTIMO_MES, coluna_valor="VOL_REAL"),
+    )
+
+
+def test_series_completas_mantem_inteiro():
+    df = pd.DataFrame({
+        "COD_PROD": ["A", "A", "B"], "REGIONAL": ["X", "X", "Y"],
+        "MES_ID": np.array([5, 6, 6], dtype=np.int32), "VOL_VENDA": [1, 2, 3],
+    })
+    ultimo = f.periodo_de_mes_id(6)
+    resultado = f.completar_calendario_mensal(df, ultimo)
+    pd.testing.assert_frame_equal(resultado, _calendario_referencia(df, ultimo))
+    assert resultado["VOL_VENDA"].dtype == np.int64
@@ -0,0 +1,34 @@
+import functions as f
+
+
+def _perfil(monkeypatch, workers):
+    monkeypatch.setattr(f, "_perfil_maquina", {
+        "maquina": "teste", "nucleos_fisicos": workers, "nucleos_logicos": workers * 2,
+        "memoria_total_mb": 8192, "memoria_livre_mb": 4096, "workers": workers, "threads_duckdb": workers * 2,
+    })
+
+
+def test_calibracao_mantem_ordem_e_grava_perfil(tmp_path, monkeypatch):
+    _perfil(monkeypatch, 2)
+    arquivo = tmp_path / "PERFIL_MAQUINA.json"
+    tarefas = [(i, 2) for i in range(200)]
+
+    resultados = f.executar_paralelo(pow, tarefas, "teste", arquivo)
+
+    assert resultados == [i ** 2 for i in range(200)]
+    calibrada = f.ler_json(arquivo)["teste"]["etapas"]["teste"]
+    assert calibrada["workers"] in f._candidatos_workers(2)
+
+
+def test_calibracao_vencida_e_refeita(tmp_path, monkeypatch):
+    _perfil(monkeypatch, 2)
+    arquivo = tmp_path / "PERFIL_MAQUINA.json"
+    tarefas = [(i, 2) for i in range(200)]
+    f.executar_paralelo(pow, tarefas, "teste", arquivo)
+
+    perfil = f.ler_json(arquivo)
+    perfil["teste"]["etapas"]["teste"]["calibrado_em"] = "2000-01-01 00:00:00"
+    f.salvar_json(arquivo, perfil)
+
+    assert f.executar_paralelo(pow, tarefas, "teste", arquivo) == [i ** 2 for i in range(200)]
+    assert f.ler_json(arquivo)["teste"]["etapas"]["teste"]["calibrado_em"] != "2000-01-01 00:00:00"
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions as f
+
+
+def test_texto_sem_nulos_volta_int32():
+    ids = f.mes_id(pd.Series(["2025-01-01", "2025-03-01", "2025-01-15"]))
+    assert ids.dtype == np.int32
+    assert ids.tolist() == [660, 662, 660]
+
+
+def test_texto_com_nulo_nao_vira_ultimo_mes():
+    ids = f.mes_id(["2025-01-01", None, "2025-03-01", ""])
+    assert ids.dtype == "Int32"
+    assert ids.tolist() == [660, pd.NA, 662, pd.NA]
+
+
+def test_datetime_com_nat_nao_vira_mes_zero():
+    ids = f.mes_id(pd.Series(pd.to_datetime(["2025-01-01", None])))
+    assert ids.tolist() == [660, pd.NA]
+
+
+def test_todos_nulos():
+    assert f.mes_id(pd.Series([None, None], dtype=object)).tolist() == [pd.NA, pd.NA]
+
+
+def test_valor_unico_nulo_e_erro():
+    with pytest.raises(ValueError):
+        f.mes_id(pd.NaT)
+    assert f.mes_id("2025-03-20") == 662
+
+
+def test_nulo_propaga_para_periodo_e_rotulo():
+    ids = f.mes_id(["2026-03-01", None])
+    assert f.rotulo_mes(ids)[0] == pd.Timestamp("2026-03-01").strftime("%b%y").upper()
+    assert pd.isna(f.rotulo_mes(ids)[1])
+    assert pd.isna(f.periodo_de_mes_id(ids)[1])
+    assert f.periodo_de_mes_id(ids)[0] == np.datetime64("2026-03-01")
+
+
+def test_groupby_descarta_mes_nulo_como_o_nat():
+    df = pd.DataFrame({"PERIODO": ["2025-01-01", None, "2025-01-01"], "VOL": [1.0, 2.0, 3.0]})
+    df["MES_ID"] = f.mes_id(df["PERIODO"])
+    antes = df.assign(PERIODO=pd.to_datetime(df["PERIODO"])).groupby("PERIODO")["VOL"].sum()
+    depois = df.groupby("MES_ID")["VOL"].sum()
+    assert antes.tolist() == depois.tolist() == [4.0]
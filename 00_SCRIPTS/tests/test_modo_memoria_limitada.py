@@ -0,0 +1,146 @@
+import subprocess
+import sys
+import textwrap
+import types
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions as f
+
+CHAVES_CLIENTE = ["COD_GRUPO_CLIENTE", "DESC_GRUPO_E_CLIENTE", "REGIONAL_GESTOR", "REGIONAL", "FAMILIA", "PERIODO"]
+
+
+def _historico_sintetico(linhas=60_000, semente=7):
+    rng = np.random.default_rng(semente)
+    grupos = np.array([f"G{i:03d}" for i in range(40)])
+    regionais = np.array(["SUL", "SUDESTE", "NORTE", "TELEVENDAS"])
+    familias = np.array([f"{i} - FAMILIA {i}" for i in range(12)])
+    idx_grupo = rng.integers(0, len(grupos), linhas)
+    idx_regional = rng.integers(0, len(regionais), linhas)
+    cod_prod = np.char.zfill(rng.integers(1, 300, linhas).astype(str), 4)
+    vol_venda = rng.gamma(2.0, 50.0, linhas).round(3)
+    return pd.DataFrame({
+        "EMPRESA": "KRONA",
+        "COD_CLIENTE": np.char.zfill(rng.integers(1, 900, linhas).astype(str), 6),
+        "NOME_CLIENTE": np.char.add("CLIENTE ", grupos[idx_grupo]),
+        "COD_GRUPO_CLIENTE": grupos[idx_grupo],
+        "DESC_GRUPO_E_CLIENTE": np.char.add("CLIENTE ", grupos[idx_grupo]),
+        "COD_PROD": cod_prod,
+        "DESC_PRODUTO": np.char.add("PRODUTO ", cod_prod),
+        "FAMILIA": familias[rng.integers(0, len(familias), linhas)],
+        "LINHA": "1 - LINHA",
+        "REGIONAL": regionais[idx_regional],
+        "REGIAO_CLIENTE": regionais[idx_regional],
+        "REGIAO_MOVIMENTO": regionais[idx_regional],
+        "REGIONAL_GESTOR": np.char.add("G ", regionais[idx_regional]),
+        "PERIODO": pd.to_datetime("2023-01-01") + pd.to_timedelta(rng.integers(0, 30, linhas) * 31, unit="D"),
+        "QTD_VENDA": vol_venda * 2,
+        "VOL_VENDA": vol_venda,
+    }).assign(PERIODO=lambda d: d["PERIODO"].dt.to_period("M").dt.to_timestamp())
+
+
+@pytest.fixture
+def staging(tmp_path):
+    f.salvar_dataset_staging(tmp_path, "df_vendas_krona", _historico_sintetico())
+    return tmp_path
+
+
+def _agregar(df):
+    return (
+        df.groupby(CHAVES_CLIENTE, as_index=False, observed=True)
+        .agg({"VOL_VENDA": "sum"})
+        .sort_values(CHAVES_CLIENTE)
+        .reset_index(drop=True)
+    )
+
+
+def _separacao_lancamento(staging, produtos_lancamento):
+    f.separar_vendas_lancamento(staging, produtos_lancamento)
+    ordem = ["COD_PROD", "PERIODO", "COD_GRUPO_CLIENTE", "FAMILIA", "VOL_VENDA"]
+    return [
+        f.ler_dataset_staging(staging, nome).astype({"COD_PROD": str}).sort_values(ordem).reset_index(drop=True)
+        for nome in ["df_vendas_krona", "df_vendas_krona_lancamento"]
+    ]
+
+
+def _executar(staging, limitada, monkeypatch):
+    monkeypatch.setattr(f, "MODO_MEMORIA_LIMITADA", limitada)
+    monkeypatch.setattr(f, "PASTA_TEMP_DUCKDB", staging / "SPILL")
+    vendas, lancamento = _separacao_lancamento(staging, ["0010", "0011", "0150"])
+
+    colunas = CHAVES_CLIENTE + ["VOL_VENDA"]
+    if limitada:
+        partes = [_agregar(lote) for lote in f.iterar_lotes_periodo(staging, "df_vendas_krona", colunas, meses_por_lote=4)]
+        colaborativo = f.concatenar_categorias(partes).sort_values(CHAVES_CLIENTE).reset_index(drop=True)
+    else:
+        colaborativo = _agregar(f.ler_dataset_staging(staging, "df_vendas_krona", colunas=colunas))
+    return vendas, lancamento, colaborativo
+
+
+def test_modo_memoria_limitada_mesma_saida_e_dentro_da_meta(tmp_path, monkeypatch):
+    base_desligado, base_ligado = tmp_path / "desligado", tmp_path / "ligado"
+    historico = _historico_sintetico()
+    for pasta in (base_desligado, base_ligado):
+        f.salvar_dataset_staging(pasta, "df_vendas_krona", historico)
+
+    desligado = _executar(base_desligado, False, monkeypatch)
+    ligado = _executar(base_ligado, True, monkeypatch)
+
+    for a, b in zip(desligado, ligado):
+        assert len(a) > 0
+        pd.testing.assert_frame_equal(
+            a.astype({c: str for c in a.columns if isinstance(a[c].dtype, pd.CategoricalDtype)}),
+            b.astype({c: str for c in b.columns if isinstance(b[c].dtype, pd.CategoricalDtype)}),
+        )
+
+
+
+def test_pico_do_modo_ligado_medido_em_processo_proprio(tmp_path):
+    # O pico (ru_maxrss) do processo do pytest soma todos os testes anteriores; o caminho do modo ligado
+    # roda num processo novo e só o pico dele é conferido com a meta
+    f.salvar_dataset_staging(tmp_path, "df_vendas_krona", _historico_sintetico())
+    codigo = textwrap.dedent(f"""
+        from pathlib import Path
+        import functions as f
+        f.MODO_MEMORIA_LIMITADA = True
+        f.PASTA_TEMP_DUCKDB = Path({str(tmp_path / "SPILL")!r})
+        staging = Path({str(tmp_path)!r})
+        f.separar_vendas_lancamento(staging, ["0010", "0011", "0150"])
+        for lote in f.iterar_lotes_periodo(staging, "df_vendas_krona", {CHAVES_CLIENTE + ["VOL_VENDA"]!r}, meses_por_lote=4):
+            lote.groupby({CHAVES_CLIENTE!r}, observed=True)["VOL_VENDA"].sum()
+        print(f.pico_rss_mb())
+    """)
+    resultado = subprocess.run(
+        [sys.executable, "-c", codigo], cwd=Path(f.__file__).parent, capture_output=True, text=True, check=True
+    )
+    pico = float(resultado.stdout.strip().splitlines()[-1])
+    assert 0 < pico <= f.META_PICO_RSS_MB
+
+
+def test_conexao_duckdb_recebe_limite_no_modo_memoria_limitada(staging, monkeypatch):
+    monkeypatch.setattr(f, "MODO_MEMORIA_LIMITADA", True)
+    monkeypatch.setattr(f, "PASTA_TEMP_DUCKDB", staging / "SPILL")
+    con = f.conectar_duckdb()
+    try:
+        limite = con.execute("SELECT current_setting('memory_limit')").fetchone()[0]
+        pasta = con.execute("SELECT current_setting('temp_directory')").fetchone()[0]
+    finally:
+        con.close()
+    referencia = duckdb.connect()
+    referencia.execute(f"SET memory_limit = '{f.LIMITE_MEMORIA_DUCKDB}'")
+    assert limite == referencia.execute("SELECT current_setting('memory_limit')").fetchone()[0]
+    referencia.close()
+    assert pasta.endswith("SPILL")
+
+
+@pytest.mark.parametrize("plataforma, maxrss, esperado_mb", [("linux", 2048 * 1024, 2048), ("darwin", 2048 * 1024**2, 2048)])
+def test_pico_rss_unidade_por_plataforma(monkeypatch, plataforma, maxrss, esperado_mb):
+    import resource
+    monkeypatch.setattr(f.psutil, "Process", lambda: types.SimpleNamespace(memory_info=lambda: types.SimpleNamespace()))
+    monkeypatch.setattr(resource, "getrusage", lambda _: types.SimpleNamespace(ru_maxrss=maxrss))
+    monkeypatch.setattr(f.sys, "platform", plataforma)
+    assert f.pico_rss_mb() == pytest.approx(esperado_mb)
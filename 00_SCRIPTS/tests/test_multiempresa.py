@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+
+import functions as f
+
+EMPRESAS_TESTE = {"Krona": ["01", "05"], "Tigre": ["20"]}
+
+
+@pytest.fixture
+def grupo_duas_empresas(monkeypatch):
+    monkeypatch.setattr(f, "MODO_MULTIEMPRESA", True)
+    monkeypatch.setattr(f, "EMPRESAS_GRUPO", EMPRESAS_TESTE)
+    monkeypatch.setattr(f, "PLANILHAS_REGRAS_EMPRESA", {"Krona": "KRONA_REGRAS.xlsm", "Tigre": "TIGRE_REGRAS.xlsm"})
+
+
+def _fato_bruto(caminho):
+    # Textos como no Fato_Vendas_Krona de origem; a linha da Tigre com Cod_Empresa da Krona e a de
+    # Cod_Bloqueio fora da lista não entram em nenhuma partição
+    pd.DataFrame({
+        "Cod_Produto": ["0001", "0002", "0003", "0004", "0005", "0006"],
+        "Chv_Cliente": ["K|000001", "K|000002", "T|000001", "T|000002", "K|000003", "T|000003"],
+        "Chv_Vendedor": ["V1", "V2", "V3", "V4", "V5", "V6"],
+        "Dat_Emissao_Venda": ["2025-01-10", "25/01/2025", "2025-02-03", "2025-02-22", "2025-03-01", "2025-03-05"],
+        "Nom_Empresa": ["Krona ", "Krona", "Tigre", "Tigre", "Krona", "Tigre"],
+        "Des_Origem": ["KRONA", "KRONA", "TIGRE", "TIGRE", "KRONA", "TIGRE"],
+        "Cod_Empresa": ["01", "05", "20", "20", "01", "01"],
+        "Cod_Bloqueio": ["80", "", "90", "60", "12", "80"],
+        "Qtd_Venda": ["10", "5", "3", "7", "1", "2"],
+        "Qtd_Peso_Venda": ["1.5", "2.0", "0.5", "4.0", "1.0", "1.0"],
+    }).to_parquet(caminho, index=False)
+
+
+def test_espelho_separa_as_empresas_do_grupo(tmp_path, grupo_duas_empresas):
+    arquivo_fato = tmp_path / "Fato_Vendas_Krona.parquet"
+    _fato_bruto(arquivo_fato)
+    pasta_espelho = tmp_path / "FATO_VENDAS_KRONA_ESPELHO"
+
+    controle = f.atualizar_espelho_fato_vendas(arquivo_fato, pasta_espelho, f.empresas_ingestao(), [80, 90, 95, 99, 60, 81])
+
+    krona = pd.read_parquet(f.espelho_empresa(pasta_espelho, "Krona"))
+    tigre = pd.read_parquet(f.espelho_empresa(pasta_espelho, "Tigre"))
+    assert controle["linhas"] == {"KRONA": 1, "TIGRE": 2}
+    assert krona["Cod_Produto"].tolist() == ["0001"]
+    assert tigre["Cod_Produto"].tolist() == ["0003", "0004"]
+    # data cota: dia 21 em diante pertence ao mês seguinte
+    assert tigre["PERIODO"].astype(str).tolist() == ["2025-02-01", "2025-03-01"]
+
+
+def test_cada_empresa_tem_staging_e_regras_proprias(tmp_path, grupo_duas_empresas):
+    assert f.pasta_empresa(tmp_path, "Tigre") == tmp_path / "EMPRESA=TIGRE"
+    assert f.pasta_cache_regras(tmp_path, "Tigre") == tmp_path / "EMPRESA=TIGRE" / f.PASTA_CACHE_REGRAS
+    assert f.arquivo_regras_empresa(tmp_path, "Tigre") == tmp_path / "TIGRE_REGRAS.xlsm"
+    assert f.arquivo_regras_empresa(tmp_path, "Krona") == tmp_path / "KRONA_REGRAS.xlsm"
+
+
+def test_empresa_sem_planilha_de_regras_interrompe_a_ingestao(monkeypatch, grupo_duas_empresas):
+    monkeypatch.setattr(f, "PLANILHAS_REGRAS_EMPRESA", {"Krona": "KRONA_REGRAS.xlsm"})
+    with pytest.raises(ValueError, match="Tigre"):
+        f.empresas_ingestao()
+    with pytest.raises(ValueError, match="Tigre"):
+        f.arquivo_regras_empresa("02_REGRAS_NEGOCIO", "Tigre")
+
+
+def test_sem_multiempresa_so_a_empresa_plano(monkeypatch, grupo_duas_empresas):
+    monkeypatch.setattr(f, "MODO_MULTIEMPRESA", False)
+    monkeypatch.setattr(f, "PLANILHAS_REGRAS_EMPRESA", {"Krona": "KRONA_REGRAS.xlsm"})
+    assert f.empresas_ingestao() == {"Krona": ["01", "05"]}
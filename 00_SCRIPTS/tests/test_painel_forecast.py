@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions as f
+
+MES_ID_INICIAL = f.mes_id(pd.Timestamp("2024-01-01"))
+
+
+@pytest.fixture
+def painel(tmp_path):
+    rng = np.random.default_rng(5)
+    volume = rng.gamma(2.0, 50.0, (6, 24)) * (rng.random((6, 24)) < 0.7)
+    primeiro = np.array([0, 3, 0, 10, 23, 7])
+    volume[np.arange(24)[None, :] < primeiro[:, None]] = 0
+    np.save(tmp_path / "VOLUME.npy", volume)
+    series = pd.DataFrame({
+        "ID_SERIE": np.arange(1, 7),
+        "COD_PROD": [" 0001", "0001", "0002", "0003", "0003", "0004"],
+        "REGIONAL": ["NORTE", "SUL", "SUL", "NORTE", "SUL", "SUL"],
+        "PRIMEIRO_MES_ID": primeiro + MES_ID_INICIAL,
+    })
+    return {"volume": np.load(tmp_path / "VOLUME.npy", mmap_mode="r"), "series": series, "mes_id_inicial": MES_ID_INICIAL}
+
+
+def _historico_esperado(painel, ultimo_mes_hist, coluna_valor):
+    # Linha a linha: meses do primeiro mês da série ao corte (depois do fim do painel, zero)
+    qtd_meses = f.mes_id(ultimo_mes_hist) - MES_ID_INICIAL + 1
+    partes = []
+    for linha, serie in painel["series"].iterrows():
+        inicio = serie["PRIMEIRO_MES_ID"] - MES_ID_INICIAL
+        if inicio >= qtd_meses:
+            continue
+        valores = np.zeros(qtd_meses)
+        largura = min(qtd_meses, painel["volume"].shape[1])
+        valores[:largura] = painel["volume"][linha, :largura]
+        partes.append(pd.DataFrame({
+            "COD_PROD": serie["COD_PROD"], "REGIONAL": serie["REGIONAL"],
+            "PERIODO": f.periodo_de_mes_id(np.arange(inicio, qtd_meses, dtype=np.int32) + MES_ID_INICIAL),
+            coluna_valor: valores[inicio:],
+        }))
+    return pd.concat(partes, ignore_index=True)
+
+
+@pytest.mark.parametrize("ultimo_mes_hist", ["2024-06-01", "2025-12-01", "2026-05-01"])
+def test_historico_longo_igual_ao_recorte_linha_a_linha(painel, ultimo_mes_hist):
+    ultimo = pd.Timestamp(ultimo_mes_hist)
+    _, df_hist_base, tasks = f.recortar_painel_forecast(painel, ultimo, coluna_valor="VOL_REAL")
+
+    pd.testing.assert_frame_equal(df_hist_base, _historico_esperado(painel, ultimo, "VOL_REAL"))
+    assert len(tasks) == df_hist_base.groupby(["COD_PROD", "REGIONAL"]).ngroups
+    if f.mes_id(ultimo) - MES_ID_INICIAL < painel["volume"].shape[1]:
+        # Dentro do painel as séries das tasks continuam views do memmap
+        assert all(np.shares_memory(y_np, painel["volume"]) for *_, y_np in tasks)
+
+
+def test_filtro_de_produtos_e_corte_antes_de_todas_as_series(painel):
+    df_series, df_hist_base, _ = f.recortar_painel_forecast(painel, pd.Timestamp("2024-12-01"), codigos_prod={"0001"})
+    assert df_series["ID_SERIE"].tolist() == [1, 2]
+    assert set(df_hist_base["COD_PROD"]) == {"0001"}
+
+    df_series, df_hist_base, tasks = f.recortar_painel_forecast(painel, pd.Timestamp("2023-12-01"))
+    assert df_series.empty and df_hist_base.empty and tasks == []
@@ -0,0 +1,55 @@
+import pyarrow.parquet as pq
+
+import functions as f
+from test_modo_memoria_limitada import _historico_sintetico
+
+ORDEM_VENDAS = ["COD_PROD", "REGIONAL", "PERIODO"]
+
+
+def _ordenado(caminho, ordem):
+    df = pq.read_table(caminho, columns=ordem).to_pandas()
+    return df.reset_index(drop=True).equals(df.sort_values(ordem, kind="stable").reset_index(drop=True))
+
+
+def test_historico_particionado_ordenado_dentro_de_cada_mes(tmp_path):
+    f.salvar_dataset_staging(tmp_path, "df_vendas_krona", _historico_sintetico(linhas=20_000))
+
+    destino = f.caminho_dataset_staging(tmp_path, "df_vendas_krona")
+    arquivos_mes = sorted(destino.glob("*/*.parquet"))
+    assert f.politica_gravacao_staging(tmp_path, "df_vendas_krona")["ordem"] == ORDEM_VENDAS
+    assert len(arquivos_mes) > 1
+    assert all(_ordenado(arquivo, ORDEM_VENDAS) for arquivo in arquivos_mes)
+    assert _ordenado(destino.with_name("df_vendas_krona.parquet"), ORDEM_VENDAS)
+    assert len(f.ler_dataset_staging(tmp_path, "df_vendas_krona")) == 20_000
+
+
+def test_benchmark_usa_as_leituras_registradas(tmp_path):
+    f.salvar_dataset_staging(tmp_path, "df_vendas_krona", _historico_sintetico(linhas=5_000))
+    f.ler_dataset_staging(tmp_path, "df_vendas_krona", colunas=["COD_PROD", "PERIODO", "QTD_VENDA"], ultimos_meses=3)
+    f.ler_dataset_staging(tmp_path, "df_vendas_krona", arrow=True)
+
+    leituras = f.ler_json(tmp_path / f.ARQUIVO_LEITURAS_STAGING)["df_vendas_krona"]
+    assert {"colunas": ["COD_PROD", "PERIODO", "QTD_VENDA"], "ultimos_meses": 3} in leituras
+    assert {"arrow": True} in leituras
+
+    medidas = f.benchmark_gravacao_staging(tmp_path, nomes=["df_vendas_krona"], candidatas={"zstd1": {"nivel": 1}})
+    assert medidas["CANDIDATA"].tolist() == ["zstd1"]
+    assert f.ler_json(tmp_path / f.ARQUIVO_BENCHMARK_GRAVACAO)["df_vendas_krona"]["candidata"] == "zstd1"
+
+
+def test_benchmark_com_banco_de_staging_nao_abre_banco_na_pasta_de_teste(tmp_path, monkeypatch):
+    monkeypatch.setattr(f, "USAR_STAGING_DUCKDB", True)
+    try:
+        f.salvar_dataset_staging(tmp_path, "df_vendas_krona", _historico_sintetico(linhas=5_000))
+        f.ler_dataset_staging(tmp_path, "df_vendas_krona", colunas=["COD_PROD", "PERIODO", "QTD_VENDA"], ultimos_meses=3)
+
+        medidas = f.benchmark_gravacao_staging(
+            tmp_path, nomes=["df_vendas_krona"], candidatas={"zstd1": {"nivel": 1}, "snappy": {"compressao": "snappy"}}
+        )
+
+        assert len(medidas) == 2 and (medidas["LEITURA_S"] > 0).all()
+        pasta_teste = (tmp_path / f.PASTA_TESTE_BENCHMARK).resolve()
+        assert not any(pasta_teste in caminho.parents for caminho in f._conexoes_staging)
+        assert not pasta_teste.exists()
+    finally:
+        f.fechar_staging()
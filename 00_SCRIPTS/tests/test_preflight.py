@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import functions as f
+
+
+def _fato(caminho, datas, row_group_size):
+    n = len(datas)
+    tabela = pa.table({
+        **{c: pa.array(["1"] * n) for c in f.ENTRADAS_PREFLIGHT["Fato_Vendas_Krona"] if c != f.COLUNA_DATA_FATO},
+        f.COLUNA_DATA_FATO: pa.array(pd.to_datetime(datas).date, pa.date32()),
+    })
+    pq.write_table(tabela, caminho, row_group_size=row_group_size)
+
+
+@pytest.fixture
+def entradas(tmp_path):
+    pasta = tmp_path / "01_BD_PARQUET"
+    pasta.mkdir()
+    for nome, colunas in f.ENTRADAS_PREFLIGHT.items():
+        if nome != "Fato_Vendas_Krona":
+            pd.DataFrame({c: ["1"] for c in colunas}).to_parquet(pasta / f"{nome}.parquet", index=False)
+    regras = tmp_path / "KRONA_REGRAS.xlsx"
+    with pd.ExcelWriter(regras, engine="openpyxl") as planilha:
+        for aba in f.REGRAS_NEGOCIO:
+            pd.DataFrame({"x": [1]}).to_excel(planilha, sheet_name=aba, index=False)
+    return pasta, regras
+
+
+def _rotulos(ids):
+    return [str(f.periodo_de_mes_id(i).date())[:7] for i in ids]
+
+
+def test_rodape_mes_vazio_entre_row_groups_e_detectado(tmp_path):
+    arquivo = tmp_path / "fato.parquet"
+    # row groups [jan], [mar]: fevereiro (cota) sem venda entre os dois
+    _fato(arquivo, ["2025-01-05", "2025-01-10", "2025-03-05", "2025-03-10"], row_group_size=2)
+    periodos, ultima, fonte, presumidos = f._periodos_datas_fato(arquivo, pq.read_metadata(arquivo), f.COLUNA_DATA_FATO)
+    assert fonte == "rodapé"
+    assert _rotulos(periodos) == ["2025-01", "2025-03"]
+    assert presumidos.size == 0
+    assert ultima == pd.Timestamp("2025-03-10")
+
+
+def test_rodape_mes_dentro_do_row_group_fica_presumido(tmp_path):
+    arquivo = tmp_path / "fato.parquet"
+    # um único row group de janeiro a março: fevereiro não é confirmado, só presumido
+    _fato(arquivo, ["2025-01-05", "2025-03-05"], row_group_size=10)
+    periodos, _, _, presumidos = f._periodos_datas_fato(arquivo, pq.read_metadata(arquivo), f.COLUNA_DATA_FATO)
+    assert _rotulos(periodos) == ["2025-01", "2025-02", "2025-03"]
+    assert _rotulos(presumidos) == ["2025-02"]
+
+
+def test_texto_dd_mm_so_com_leitura_da_coluna(tmp_path, monkeypatch):
+    arquivo = tmp_path / "fato.parquet"
+    pq.write_table(pa.table({f.COLUNA_DATA_FATO: ["05/01/2025", "2025-03-05"]}), arquivo)
+    metadados = pq.read_metadata(arquivo)
+    periodos, _, fonte, _ = f._periodos_datas_fato(arquivo, metadados, f.COLUNA_DATA_FATO)
+    assert fonte == "dicionário" and _rotulos(periodos) == ["2025-01", "2025-03"]
+
+    monkeypatch.setattr(f, "LER_COLUNA_DATA_TEXTO_PREFLIGHT", False)
+    assert f._periodos_datas_fato(arquivo, metadados, f.COLUNA_DATA_FATO)[0] is None
+
+
+def test_tolerancia_cobre_dia_20_em_fim_de_semana(entradas, tmp_path):
+    pasta, regras = entradas
+    # cota de setembro/2025 vai até sábado 20/09; última venda na sexta 19/09
+    datas = pd.date_range("2025-06-01", "2025-09-19", freq="D")
+    _fato(pasta / "Fato_Vendas_Krona.parquet", datas, row_group_size=20)
+    resumo = f.preflight_entradas(pasta, regras, tmp_path, hoje="2025-09-22")
+    assert resumo["ultima_data"] == "2025-09-19"
+
+
+def test_extracao_desatualizada_e_mes_vazio_interrompem(entradas, tmp_path):
+    pasta, regras = entradas
+    # 01/05 a 10/06 (41 dias) no primeiro row group: a cota de julho (21/06 a 20/07) fica vazia entre row groups
+    datas = list(pd.date_range("2025-05-01", "2025-06-10", freq="D")) + list(pd.date_range("2025-07-25", "2025-09-05", freq="D"))
+    _fato(pasta / "Fato_Vendas_Krona.parquet", datas, row_group_size=41)
+    with pytest.raises(ValueError) as erro:
+        f.preflight_entradas(pasta, regras, tmp_path, hoje="2025-09-22")
+    assert "extração desatualizada" in str(erro.value)
+    assert "períodos sem venda" in str(erro.value) and "row group" in str(erro.value)
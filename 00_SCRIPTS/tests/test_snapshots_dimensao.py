@@ -0,0 +1,36 @@
+import pandas as pd
+
+import functions as f
+
+
+def _snapshot(con, pasta, linhas):
+    con.register("direciona", pd.DataFrame(linhas, columns=["COD_CLIENTE", "REGIONAL"]))
+    return f.atualizar_snapshot_dimensao(con, pasta, "DIRECIONA", "SELECT * FROM direciona")
+
+
+def test_troca_de_linhas_repetidas_gera_versao_e_chave_alterada(tmp_path):
+    # {A, A, B} -> {C, C, B}: com XOR dos hashes a linha repetida se cancelava (mesma assinatura)
+    con = f.conectar_duckdb()
+    try:
+        v1 = _snapshot(con, tmp_path, [("C1", "SUL"), ("C1", "SUL"), ("C2", "NORTE")])
+        v2 = _snapshot(con, tmp_path, [("C1", "CENTRO"), ("C1", "CENTRO"), ("C2", "NORTE")])
+        assert v2 == v1 + 1
+
+        situacoes = f.comparar_snapshots_dimensao(con, tmp_path, "DIRECIONA", "COD_CLIENTE", v1, v2, "alteradas")
+        assert situacoes == {"ALTERADA": 1}
+        assert con.execute("SELECT CHAVE FROM alteradas").fetchall() == [("C1",)]
+    finally:
+        con.close()
+
+
+def test_mesmo_conteudo_em_outra_ordem_mantem_a_versao(tmp_path):
+    con = f.conectar_duckdb()
+    try:
+        v1 = _snapshot(con, tmp_path, [("C1", "SUL"), ("C1", "SUL"), ("C2", "NORTE")])
+        assert _snapshot(con, tmp_path, [("C2", "NORTE"), ("C1", "SUL"), ("C1", "SUL")]) == v1
+        # Uma cópia a menos da linha repetida é mudança
+        v2 = _snapshot(con, tmp_path, [("C1", "SUL"), ("C2", "NORTE")])
+        assert v2 == v1 + 1
+        assert f.comparar_snapshots_dimensao(con, tmp_path, "DIRECIONA", "COD_CLIENTE", v1, v2, "alteradas") == {"ALTERADA": 1}
+    finally:
+        con.close()
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+
+import functions as f
+
+PASSOS = 12
+TOLERANCIA = 1e-13  # erro máximo relativo à escala da série (maior |y| do treino)
+
+
+def _pred_lr(y_train, steps):
+    # Mesmo pred_lr dos scripts (LinearRegression sobre np.arange(n), previsão truncada em zero)
+    y_train = np.asarray(y_train, dtype=float)
+    t = np.arange(len(y_train)).reshape(-1, 1)
+    lr = LinearRegression().fit(t, y_train)
+    t_future = np.arange(len(y_train), len(y_train) + steps).reshape(-1, 1)
+    return np.maximum(lr.predict(t_future), 0)
+
+
+def _series(quantidade=300, semente=0):
+    # Vendas intermitentes de várias escalas, séries constantes e séries de um mês só
+    rng = np.random.default_rng(semente)
+    series = []
+    for i in range(quantidade):
+        n = int(rng.integers(1, 90))
+        y = rng.gamma(0.5, 2000, n) * (rng.random(n) < 0.6)
+        if i % 7 == 0:
+            y = y * 1e4
+        if i % 11 == 0:
+            y = np.full(n, 123.4)
+        series.append(y)
+    return series + [np.array([42.0]), np.zeros(24)]
+
+
+def _erro_relativo(y_train, previsao):
+    referencia = _pred_lr(y_train, PASSOS)
+    return np.max(np.abs(referencia - previsao)) / max(np.abs(y_train).max(), 1.0)
+
+
+def test_previsoes_em_lote_iguais_ao_linear_regression():
+    series = _series()
+    treinos = [[len(y) - min(12, max(3, len(y) // 3)), len(y)] + f.treinos_walk_forward(len(y), 12, 6) for y in series]
+
+    previsoes = f.previsoes_tendencia_linear(series, treinos, PASSOS)
+
+    consultas = 0
+    for y, por_treino in zip(series, previsoes):
+        for n, previsao in por_treino.items():
+            assert _erro_relativo(y[:n], previsao) <= TOLERANCIA
+            consultas += 1
+    assert consultas > len(series)
+
+
+@pytest.mark.parametrize("fim_treino", [1, 2, 17, 36])
+def test_janela_que_comeca_no_meio_da_matriz(fim_treino):
+    # Série começando na coluna 4 de uma matriz com valores antes do início (devem ser ignorados)
+    rng = np.random.default_rng(fim_treino)
+    volume = rng.gamma(2.0, 50.0, (3, 40))
+    inicio = np.array([0, 4, 10])
+    fim = 4 + fim_treino
+
+    previsao = f.tendencia_linear_lote(volume, inicio, np.array([1]), np.array([fim]), PASSOS)[0]
+
+    assert _erro_relativo(volume[1, 4:fim], previsao) <= TOLERANCIA